@@ -1,13 +1,44 @@
+import ast
+import bisect
+import codecs
+import fnmatch
+import functools
 import glob
+import hashlib
+import heapq
+import importlib.util
+import json
 import logging
+import math
+import mmap
 import os
+import queue
 import random
+import re
+import shutil
 import subprocess
 import sys
-from typing import List, Tuple, Union
+import sysconfig
+import time
+import types
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-import tiktoken
+if TYPE_CHECKING:
+    import tiktoken
 
 # Configuration Variables
 
@@ -77,6 +108,8 @@ Note:
     - Patterns are case-sensitive.
     - '**' matches any number of directories.
     - '*' matches any number of characters within a single directory or file name.
+    - Rules from the project's .gitignore and .aiderignore files are applied as well,
+      see USE_IGNORE_FILES.
 
 Example patterns:
     - ".gitignore": Ignores the exact file named ".gitignore"
@@ -87,6 +120,25 @@ Returns:
     set: A set of strings representing file and directory patterns to ignore.
 """
 
+USE_IGNORE_FILES = True
+"""
+Enables the project's .gitignore and .aiderignore files during scanning.
+
+When True, the rules of the .gitignore and .aiderignore files in PROJECT_DIR, of
+.git/info/exclude, and of .gitignore files in scanned subdirectories are applied in
+addition to IGNORE_FILES, with git's semantics: negated rules ("!pattern"), rules
+anchored to their directory ("/build", "src/*.js"), directory-only rules ("dist/"),
+and "**" wildcards. The .git directory itself is always skipped.
+
+Note:
+    - IGNORE_FILES patterns cannot be re-included by negated rules.
+    - Files in MANUALLY_ADDED_FILES are only filtered by IGNORE_FILES.
+
+See Also:
+    IGNORE_FILES: Patterns that are always ignored
+    IgnoreMatcher: Class that compiles and evaluates all ignore rules
+"""
+
 LLM = "default"
 """
 Specifies the language model to be used for AI interactions.
@@ -132,6 +184,33 @@ See Also:
     execute_aider_command: Function that utilizes these models
 """
 
+TOKENIZERS = {
+    "default": ("cl100k_base", 1.0),
+    "gpt-4o-2024-08-06": ("o200k_base", 1.0),
+    "chatgpt-4o-latest": ("o200k_base", 1.0),
+    "claude-3-5-sonnet-20240620": ("cl100k_base", 1.15),
+}
+"""
+Maps AI models to the tokenizer used for their token accounting.
+
+Each entry maps a model name to a tuple of a tiktoken encoding name and a calibration
+ratio. Token counts are calculated with the encoding and multiplied by the ratio, which
+approximates models whose tokenizer is not available in tiktoken, such as Claude.
+The "default" entry is used when aider's default model is used (LLM = "default") and
+for models that are neither listed here nor known to tiktoken.
+
+Note:
+    - Every model in MODELS should have an entry, or be known to tiktoken.
+    - A ratio of 1.0 means the encoding is the model's exact tokenizer.
+
+Example:
+    {"gpt-4o-2024-08-06": ("o200k_base", 1.0), "claude-3-opus-20240229": ("cl100k_base", 1.15)}
+
+See Also:
+    get_tokenizer: Function that resolves the tokenizer of a model
+    MODELS: List of available AI models
+"""
+
 EDIT_FORMAT = "diff"
 """
 Specifies the edit format to be used when executing aider commands.
@@ -172,11 +251,168 @@ See Also:
     calculate_token_count: Function for counting tokens in files
 """
 
+TOKEN_CACHE_FILE = os.path.join(
+    os.path.dirname(__file__), ".aider_all_token_cache.json"
+)
+"""
+Defines the path of the persistent token count cache.
+
+Token counts calculated by calculate_token_count are stored in this file and reused
+on later runs, so only files that changed since the previous run are read and
+tokenized again. Entries are keyed by file path, size and modification time, are
+verified by a content hash when the modification time changes, and are stored per
+encoding name. Entries of files that no longer exist are evicted when the cache is
+saved.
+
+Note:
+    - Set to None or an empty string to disable the cache.
+    - The cache file can be deleted at any time; it is rebuilt on the next run.
+
+See Also:
+    TOKEN_CACHE_VERIFY: Forces content hash verification for every cache hit
+    calculate_token_count: Function that reads and updates this cache
+"""
+
+TOKEN_CACHE_VERIFY = False
+"""
+Forces content hash verification for every token cache hit.
+
+When False, a cached token count is reused as soon as the file size and modification
+time match the cache entry, and the content hash is only checked when they differ.
+When True, every file is read and hashed before its cached count is reused, which is
+slower but safe on file systems with coarse or unreliable modification times.
+
+See Also:
+    TOKEN_CACHE_FILE: Path of the persistent token count cache
+"""
+
+TOKENIZER_WORKERS = os.cpu_count() or 1
+"""
+Defines the number of worker threads used for token counting.
+
+Files are read concurrently by a thread pool of this size and encoded with tiktoken's
+multi-threaded batch encoder using the same number of threads. If the installed
+tiktoken has no batch encoder, a process pool of this size is used instead.
+
+Note:
+    - A value of 1 reads and encodes files sequentially.
+    - The default uses one worker per CPU core.
+
+See Also:
+    calculate_token_counts: Function that counts a batch of files in parallel
+"""
+
+TOKEN_COUNTING = "exact"
+"""
+Defines how token counts are obtained when files are grouped.
+
+Possible values:
+- "exact": Every file is tokenized with the model's tokenizer.
+- "estimate": Token counts are predicted from file sizes using per-extension byte per
+  token ratios, and a file is only tokenized when the total of its group with the file
+  lands within TOKEN_ESTIMATE_MARGIN of TOKEN_LIMIT, where the estimate could flip the
+  decision.
+
+Note:
+    The "estimate" mode makes planning of very large repositories nearly instant, at the
+    cost of groups that may be up to TOKEN_ESTIMATE_MARGIN below the limit.
+
+See Also:
+    TOKEN_ESTIMATE_MARGIN: Relative error margin around TOKEN_LIMIT
+    TOKEN_ESTIMATE_BYTES_PER_TOKEN: Default ratios used by the estimator
+"""
+
+TOKEN_ESTIMATE_MARGIN = 0.15
+"""
+Defines the relative error margin of token estimates around TOKEN_LIMIT.
+
+When TOKEN_COUNTING is "estimate", a file is counted exactly if the estimated total of
+its group with the file falls between TOKEN_LIMIT * (1 - margin) and
+TOKEN_LIMIT * (1 + margin). Totals below fit and totals above overflow without counting.
+
+See Also:
+    TOKEN_COUNTING: Selects exact or estimated token counting
+"""
+
+TOKEN_ESTIMATE_BYTES_PER_TOKEN = {
+    ".js": 3.6,
+    ".vue": 3.4,
+    ".scss": 3.0,
+    "default": 4.0,
+}
+"""
+Defines the default number of bytes per token used by the token estimator.
+
+These ratios are only used until enough exact counts of an extension are available in
+the token cache: the estimator calibrates the ratio of every extension with at least
+TOKEN_ESTIMATE_MIN_SAMPLES cached files from those exact counts, per encoding.
+
+See Also:
+    TOKEN_COUNTING: Selects exact or estimated token counting
+    TOKEN_CACHE_FILE: Source of the exact counts used for calibration
+"""
+
+TOKEN_ESTIMATE_MIN_SAMPLES = 5
+"""
+Defines how many cached exact counts an extension needs before its ratio is calibrated.
+
+See Also:
+    TOKEN_ESTIMATE_BYTES_PER_TOKEN: Default ratios for uncalibrated extensions
+"""
+
+STREAMING_THRESHOLD = 1024 * 1024
+"""
+Defines the file size in bytes above which files are tokenized in a streaming fashion.
+
+Larger files, such as bundles and generated files, are memory-mapped and tokenized in
+chunks instead of being read into memory at once. When the caller only needs to know
+whether a file exceeds a token ceiling, such as TOKEN_LIMIT while grouping files,
+tokenization stops as soon as the ceiling is crossed.
+
+Note:
+    - Set to 0 to stream every file.
+
+See Also:
+    count_tokens_streaming: Function that implements the streaming counter
+"""
+
+TOKENIZER_CACHE_DIR = os.path.join(os.path.dirname(__file__), ".tiktoken_cache")
+"""
+Defines the local directory tiktoken loads its BPE files from.
+
+The directory is used as tiktoken's cache directory, so BPE files downloaded once are
+reused. For machines without internet access, the BPE files can be placed here under
+their encoding name, e.g. "cl100k_base.tiktoken" or "o200k_base.tiktoken"; they are
+verified by tiktoken and registered in the cache on first use.
+
+Note:
+    - Set to None or an empty string to use tiktoken's own cache location.
+    - The tokenizer is only loaded when token counts are actually needed.
+
+See Also:
+    TOKENIZER_OFFLINE: Prevents tiktoken from downloading BPE files
+"""
+
+TOKENIZER_OFFLINE = False
+"""
+Prevents tiktoken from downloading BPE files.
+
+When True, a tokenizer whose BPE file is not in TOKENIZER_CACHE_DIR is treated as
+unavailable instead of being downloaded. Unavailable tokenizers fall back to the
+calibrated size-based token estimator, so runs on air-gapped machines neither stall
+on the download nor count every file as 0 tokens.
+
+See Also:
+    TOKENIZER_CACHE_DIR: Local directory holding the BPE files
+    TOKEN_ESTIMATE_BYTES_PER_TOKEN: Ratios used by the estimator
+"""
+
 # Thread-local storage for tracking the current turn in edit format selection
 EDIT_FORMAT_TURN = threading.local()
 
-# Thread-local storage for tracking the current turn in model selection
-MODEL_TURN = threading.local()
+# Storage for tracking the current turn in model selection, shared by all threads
+# since the pipeline selects models in a background stage
+MODEL_TURN = types.SimpleNamespace()
 
 
 # Function to initialize turn counters for edit format and model selection
@@ -230,6 +466,141 @@ See Also:
     get_files_to_process: Function that uses this depth limit
 """
 
+DISCOVERY_BACKEND = "auto"
+"""
+Defines how candidate files are discovered.
+
+Possible values:
+- "auto": Use the git index when PROJECT_DIR is a git checkout, otherwise scan the
+  file system.
+- "git": Enumerate files with "git ls-files", falling back to scanning the file system
+  with a warning if git is unavailable.
+- "filesystem": Always scan the file system.
+
+Note:
+    With git, PROCESSED_EXTENSIONS, IGNORE_FILES, the ignore files, SCAN_START and
+    SCAN_DEPTH are applied to the listed files, so both backends find the same files,
+    except that tracked files matching a .gitignore rule are still ignored. The blob
+    hashes of unmodified tracked files are used as free content fingerprints by the
+    token cache.
+
+See Also:
+    GIT_INCLUDE_UNTRACKED: Includes untracked files with the git backend
+"""
+
+GIT_INCLUDE_UNTRACKED = True
+"""
+Includes untracked files that are not ignored when discovering files with git.
+
+See Also:
+    DISCOVERY_BACKEND: Selects how candidate files are discovered
+"""
+
+CHANGED_SINCE = None
+"""
+Limits processing to files added or modified since a git revision.
+
+Possible values:
+- None: Process all files found by the scan.
+- A git revision (e.g. "origin/main", "HEAD~10", a commit hash): Process only files
+  added, modified, renamed or copied since that revision, including uncommitted
+  changes and untracked files.
+- "last-run": Use the commit that was checked out at the start of the last run in
+  which every aider command succeeded, as recorded in RUN_STATE_FILE. If no run was
+  recorded yet, all files are processed.
+
+Note:
+    The selected files still have to be found by the scan, so PROCESSED_EXTENSIONS,
+    IGNORE_FILES, SCAN_START and SCAN_DEPTH apply as usual.
+
+See Also:
+    CHANGED_INCLUDE_DEPENDENTS: Adds the files depending on changed files
+    RUN_STATE_FILE: Records the commit of the last successful run
+"""
+
+CHANGED_INCLUDE_DEPENDENTS = False
+"""
+Adds the direct dependents of changed files when CHANGED_SINCE is set.
+
+When True, files found by the scan that import one of the changed files, according
+to the dependency graph, are processed as well.
+
+See Also:
+    CHANGED_SINCE: Limits processing to changed files
+"""
+
+RUN_STATE_FILE = os.path.join(os.path.dirname(__file__), ".aider_all_state.json")
+"""
+Defines the path of the file recording the state of the last successful run.
+
+After every run that is not a dry run and in which every aider command succeeded, the
+commit checked out in PROJECT_DIR when the run started is recorded here, for use with
+CHANGED_SINCE = "last-run".
+
+See Also:
+    CHANGED_SINCE: Limits processing to changed files
+"""
+
+FOLLOW_SYMLINKS = False
+"""
+Enables following symbolic links to directories while scanning.
+
+When False, symbolic links to directories are not descended into, like os.walk does by
+default. When True, they are followed; directories that were already visited through
+another path, including symbolic link loops, are skipped, and files reachable through
+several paths are only processed once.
+
+See Also:
+    get_files_to_process: Function that scans the project directory
+"""
+
+SCAN_WORKERS = 1
+"""
+Defines the number of threads scanning directories concurrently.
+
+With 1, the directory tree is scanned by a single thread. Higher values scan
+subdirectories concurrently, which hides the latency of network file systems such as
+NFS, where each directory listing is a round-trip to the server. The files are
+returned in the same order either way.
+
+See Also:
+    SCAN_BENCHMARK: Compares the scan time with a serial os.walk traversal
+"""
+
+SCAN_BENCHMARK = False
+"""
+Enables timing the directory scan against a serial os.walk traversal.
+
+When True, the scan start is also traversed with os.walk after scanning the file
+system, and both durations are logged along with the speedup.
+
+See Also:
+    SCAN_WORKERS: Number of threads scanning directories
+"""
+
+SCAN_MANIFEST_FILE = os.path.join(
+    os.path.dirname(__file__), ".aider_all_scan_manifest.json"
+)
+"""
+Defines the path of the persistent directory scan manifest.
+
+The manifest records the modification time and the matching entries of each scanned
+directory. On later runs, only directories whose modification time changed are listed
+again; the cached listings of all other directories are reused. The manifest is
+discarded when PROCESSED_EXTENSIONS, IGNORE_FILES, SCAN_START, SCAN_DEPTH, the other
+scan settings or the top-level ignore files change, and the subdirectories of a
+directory are listed again when its .gitignore file changes.
+
+Note:
+    - Set to None or an empty string to disable the manifest.
+    - The manifest is only used when scanning the file system, not with git
+      discovery.
+    - The manifest file can be deleted at any time; it is rebuilt on the next run.
+
+See Also:
+    DISCOVERY_BACKEND: Selects how files are discovered
+"""
+
 SCAN_LOGIC = "standard"
 """
 Defines the scanning logic to be used for processing files.
@@ -252,176 +623,3215 @@ See Also:
     process_standard_dependency_cruiser: Specific processing functions for each logic
 """
 
-MESSAGES = [
-    "Update API_DOCUMENTATION.md using the supplied files without being repetitive. Assume the supplied files are correct.",
-    "Enrich API_DOCUMENTATION.md using the supplied files without being repetitive. Assume the supplied files are correct.",
-]
+DEPENDENCY_GRAPH_CACHE_FILE = os.path.join(
+    os.path.dirname(__file__), ".aider_all_dependency_graph.json"
+)
 """
-Defines a list to store messages for processing.
+Defines the path of the persistent dependency graph cache.
 
-This constant is initialized as an empty list and is intended to be populated
-with messages that will be used during file processing operations. The specific
-content and format of these messages depend on the implementation details of
-the processing functions.
+The dependencies of every module are stored here together with a fingerprint of the
+module's content. On later runs, only modules whose content changed, new modules,
+modules importing deleted modules and, when modules were added, modules with imports
+that could not be resolved are passed to dependency-cruiser again; the dependencies
+of all other modules are reused. The cache is rebuilt from scratch when package.json,
+tsconfig.json, jsconfig.json, the webpack or Vue configuration or the dependency
+backend change, since they affect module resolution.
+
+Note:
+    - Set to None or an empty string to disable the cache.
+    - The cache file can be deleted at any time; it is rebuilt on the next run.
 
 See Also:
-    execute_aider_command: Function that uses messages from this list
-    process_files: Function that indirectly uses these messages
+    DEPENDENCY_CRUISER_CACHE_DIR: dependency-cruiser's own cache
 """
 
-DRY_RUN = False
+DEPENDENCY_CRUISER_CACHE_DIR = os.path.join(
+    os.path.dirname(__file__), ".dependency_cruiser_cache"
+)
 """
-Flag to enable or disable dry run mode.
-
-When set to True, the script will simulate execution without making actual changes.
-This is useful for testing and debugging purposes. When False, the script will
-perform actual file processing and modifications.
+Defines the directory passed to dependency-cruiser's --cache option.
 
-Note:
-    This constant affects the behavior of various functions throughout the script,
-    particularly those involved in file processing and aider command execution.
+dependency-cruiser keeps its own cache of module resolutions there, which speeds up
+full rebuilds of the dependency graph. Set to None or an empty string to run
+dependency-cruiser without its cache.
 
 See Also:
-    execute_aider_command: Function that checks this flag before executing commands
-    log_aider_command: Function called when this flag is True to log dry run information
+    DEPENDENCY_GRAPH_CACHE_FILE: Persistent dependency graph cache
 """
 
-DEBUG = True
+DEPENDENCY_CRUISER_PATH = None
 """
-Enables or disables the debug mode for logging purposes.
+Defines where dependency-cruiser is installed if it is not found automatically.
 
-When set to True, the logging is configured to display debug-level messages,
-providing detailed output for troubleshooting. When False, the logging level is set
-to info, which provides less verbose output. 
+dependency-cruiser is located once per run, in this order: a local installation in
+the node_modules directory of PROJECT_DIR or one of its parents, a global npm
+installation, and this setting. It is then run with node directly instead of through
+npx, which would resolve the package again for every run and may try to download it.
 
-Note:
-    This constant is used when setting up the logging configuration.
+Possible values:
+- None: Only use a local or global installation.
+- The path of the dependency-cruiser package directory or of its bin script, which is
+  run with node.
+- The path of another executable that behaves like dependency-cruiser.
 
 See Also:
-    logging.basicConfig: Function that utilizes this DEBUG setting for log level configuration
+    run_dependency_cruiser: Function that runs dependency-cruiser
 """
 
-# Set up logging
-logging.basicConfig(
-    level=logging.DEBUG if DEBUG else logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
-logger = logging.getLogger(__name__)
+DEPENDENCY_BACKEND = "auto"
+"""
+Selects the tool that extracts the dependencies of JavaScript, TypeScript and Vue files.
 
+Possible values:
+- "dependency-cruiser": Run dependency-cruiser through Node.js.
+- "native": Extract ES imports, require calls and dynamic imports with the built-in
+  Python extractor, which resolves relative paths, index files, node_modules packages
+  and the path aliases of tsconfig.json, jsconfig.json, webpack.config.js and
+  vue.config.js. It needs no Node.js installation and avoids its startup time.
+- "auto": Use dependency-cruiser if it is installed, the native extractor otherwise.
 
-def debug_log(message):
-    """
-    Logs a debug message if debugging is enabled.
+See Also:
+    DEPENDENCY_ALIASES: Additional path aliases for the native extractor
+    DEPENDENCY_BENCHMARK: Compares both backends
+"""
 
-    This function checks the global DEBUG flag and logs the provided
-    message at the debug level if debugging is enabled. This allows for
-    conditional logging of detailed output for development and troubleshooting.
+DEPENDENCY_ALIASES = {}
+"""
+Defines additional module path aliases for the native dependency extractor.
 
-    Args:
-        message: The message string to be logged.
+Keys are import prefixes, values are directories relative to PROJECT_DIR, for example
+{"@": "src", "~components": "src/components"}. They are added to the aliases found in
+the tsconfig.json, jsconfig.json, webpack.config.js and vue.config.js of PROJECT_DIR.
 
-    Returns:
-        None
+See Also:
+    DEPENDENCY_BACKEND: Selects the native extractor
+"""
 
-    Raises:
-        This function does not raise any exceptions.
+SCSS_LOAD_PATHS = []
+"""
+Defines the directories SCSS imports are resolved against, like Sass's --load-path.
 
-    See Also:
-        logger: The logger object used for logging messages.
-    """
-    if DEBUG:
-        logger.debug(message)
+Paths are relative to PROJECT_DIR, for example ["src/styles"]. SCSS imports are first
+resolved relative to the importing file, then through the aliases of the native
+dependency extractor, then against these directories and finally in node_modules.
 
+See Also:
+    DEPENDENCY_ALIASES: Module path aliases that also apply to SCSS imports
+"""
 
-def calculate_token_count(files: List[str]) -> int:
-    """
-    Calculate the total number of tokens in the given files using tiktoken.
+PYTHON_PACKAGE_ROOTS = []
+"""
+Defines the directories absolute Python imports are resolved against.
 
-    This function iterates through the list of file paths provided, reads their
-    contents, and calculates the total token count using the tiktoken library with
-    the "cl100k_base" encoding. It returns the sum of token counts for all specified files.
+Paths are relative to PROJECT_DIR, for example ["services/api", "libs"]. PROJECT_DIR,
+its src directory and the directory containing the top-level package of the importing
+file are always tried. Imports of the standard library are core modules, imports of
+installed packages resolve to their files like npm packages.
 
-    Args:
-        files (List[str]): A list of file paths for which token counts need to be calculated.
+See Also:
+    extract_python_dependencies: Function that extracts the imports of Python files
+"""
 
-    Returns:
-        int: The total token count across all files.
+DEPENDENCY_WORKERS = os.cpu_count() or 1
+"""
+Defines the number of worker processes reading imports for the native extractor.
 
-    Raises:
-        Exception: Logs an error if any file fails to process due to reading issues or encoding problems.
-    """
-    debug_log(f"Calculating token count for {len(files)} files")
-    enc = tiktoken.get_encoding("cl100k_base")
-    total_tokens = 0
-    for file in files:
-        try:
-            with open(file, "r", encoding="utf-8") as f:
-                content = f.read()
-            file_tokens = len(enc.encode(content.strip()))
-            total_tokens += file_tokens
-            debug_log(f"File: {file}, Tokens: {file_tokens}")
-        except Exception as e:
-            logger.error(f"Error processing file {file}: {e}")
-    debug_log(f"Total tokens: {total_tokens}")
-    return total_tokens
+Note:
+    - A value of 1 reads all files in the main process.
+    - The default uses one worker per CPU core.
+"""
 
+DEPENDENCY_BENCHMARK = False
+"""
+Enables comparing the dependency-cruiser and native backends.
 
-def get_files_to_process() -> List[str]:
-    """
-    Collects a list of files to be processed based on project-specific rules.
+When True, both backends are run over all files to process when the dependency graph
+is built, and their durations and the agreement of the dependencies they find between
+files are logged.
 
-    This function scans the project directory starting from a specified subdirectory and
-    collects all files with extensions that match the configured processed extensions.
-    It excludes any files that match the specified ignore patterns. Additionally, it
-    includes any manually added files even if they don't match the processed extensions.
+See Also:
+    DEPENDENCY_BACKEND: Selects the backend that is actually used
+"""
 
-    Returns:
-        List[str]: A list of absolute file paths that meet the processing criteria.
+READ_ONLY_TOKEN_LIMIT = 8192
+"""
+Defines the token budget for dependencies added as read-only context to a group.
 
-    Raises:
-        This function does not explicitly raise any exceptions but will propagate any
+Only applies to the dependency-cruiser scan logics. The dependencies of a group are
+ranked by their distance from the group's files in the dependency graph, then by the
+number of modules importing them, and added in that order as long as they fit into the
+budget. npm packages and imports that could not be resolved are never added. The
+dependencies that were left out are listed in the dry run log.
+
+Possible values:
+- An integer: Maximum number of tokens of the dependencies of each group.
+- None: Add all dependencies of the project, regardless of their size.
+
+Note:
+    - The budget is separate from TOKEN_LIMIT and does not include MANUALLY_ADDED_FILES.
+
+See Also:
+    select_dependencies: Function that selects the dependencies within the budget
+"""
+
+READ_ONLY_IMPORTERS = 0
+"""
+Defines how many importers of each file are added as read-only context.
+
+Only applies to the dependency-cruiser scan logics. The modules importing each file of
+a group are looked up in the dependency graph, so the callers of a module are taken
+into account when it is changed. Importers of a file are ranked by how many files of
+the group they import, then by their own fan-in, and the first ones of each file are
+added within the same READ_ONLY_TOKEN_LIMIT budget as the dependencies, ranked like
+direct dependencies.
+
+Note:
+    - A value of 0 disables adding importers.
+    - Only modules that are in the dependency graph are found as importers, so the
+      scan logic should cover the whole project.
+"""
+
+PROCESSING_ORDER = "leaves-first"
+"""
+Defines the order in which the dependency-cruiser scan logics process files.
+
+The dependency graph is condensed into its strongly connected components, i.e. groups
+of modules importing each other in a cycle, which are then sorted topologically. The
+components are assigned to levels, such that no module depends on a module of the
+same level; the modules of a level are independent of each other.
+
+Possible values:
+- "leaves-first": Process modules before the modules importing them, so changes to a
+  module are already visible when its importers are processed.
+- "roots-first": Process modules before the modules they import.
+- "scan": Process files in the order in which they are found.
+
+Note:
+    - Ordering the files requires the whole scan to complete before the first group
+      is formed.
+
+See Also:
+    get_processing_levels: Function that computes the levels of the files
+"""
+
+GROUPING_STRATEGY = "sequential"
+"""
+Defines how the "standard_dependency-cruiser" scan logic groups files.
+
+Possible values:
+- "sequential": Fill groups with files in processing order.
+- "clustered": Partition the dependency graph into clusters within TOKEN_LIMIT, so
+  modules importing each other end up in the same group and do not need to be added
+  to other groups as read-only context. The number of read-only tokens saved compared
+  with "sequential" is logged and, in a dry run, written to the dry run log.
+
+See Also:
+    plan_clustered_file_groups: Function that clusters the files
+"""
+
+PIPELINE = False
+"""
+Enables the streaming pipeline from the scan to the aider commands.
+
+When True, discovering files, counting their tokens, grouping them, resolving their
+dependencies and executing aider run as concurrent stages connected by bounded queues.
+The first aider command starts as soon as its group is complete, while the rest of the
+project is still being scanned and planned. When False, all files are collected and
+grouped before the first aider command starts.
+
+Either way the files are grouped and processed in the same order. The pipeline is
+opt-in: its stages run in background threads, so log messages of different stages
+interleave.
+
+See Also:
+    PIPELINE_QUEUE_SIZE: Capacity of the queues between the stages
+    PIPELINE_BATCH_SIZE: Number of files tokenized together
+"""
+
+PIPELINE_QUEUE_SIZE = 256
+"""
+Defines how many items each pipeline stage may produce ahead of the next stage.
+
+Bounding the queues keeps fast stages, such as the scan, from running arbitrarily far
+ahead of the aider commands and holding the whole project in memory.
+"""
+
+PIPELINE_BATCH_SIZE = 64
+"""
+Defines how many files the pipeline tokenizes together in one parallel batch.
+
+Smaller batches let the first group start sooner, larger batches use the tokenizer
+workers more efficiently.
+
+See Also:
+    TOKENIZER_WORKERS: Number of threads tokenizing a batch
+"""
+
+MESSAGES = [
+    "Update API_DOCUMENTATION.md using the supplied files without being repetitive. Assume the supplied files are correct.",
+    "Enrich API_DOCUMENTATION.md using the supplied files without being repetitive. Assume the supplied files are correct.",
+]
+"""
+Defines a list to store messages for processing.
+
+This constant is initialized as an empty list and is intended to be populated
+with messages that will be used during file processing operations. The specific
+content and format of these messages depend on the implementation details of
+the processing functions.
+
+See Also:
+    execute_aider_command: Function that uses messages from this list
+    process_files: Function that indirectly uses these messages
+"""
+
+DRY_RUN = False
+"""
+Flag to enable or disable dry run mode.
+
+When set to True, the script will simulate execution without making actual changes.
+This is useful for testing and debugging purposes. When False, the script will
+perform actual file processing and modifications.
+
+Note:
+    This constant affects the behavior of various functions throughout the script,
+    particularly those involved in file processing and aider command execution.
+
+See Also:
+    execute_aider_command: Function that checks this flag before executing commands
+    log_aider_command: Function called when this flag is True to log dry run information
+"""
+
+DEBUG = True
+"""
+Enables or disables the debug mode for logging purposes.
+
+When set to True, the logging is configured to display debug-level messages,
+providing detailed output for troubleshooting. When False, the logging level is set
+to info, which provides less verbose output. 
+
+Note:
+    This constant is used when setting up the logging configuration.
+
+See Also:
+    logging.basicConfig: Function that utilizes this DEBUG setting for log level configuration
+"""
+
+# Set up logging
+logging.basicConfig(
+    level=logging.DEBUG if DEBUG else logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+
+def debug_log(message):
+    """
+    Logs a debug message if debugging is enabled.
+
+    This function checks the global DEBUG flag and logs the provided
+    message at the debug level if debugging is enabled. This allows for
+    conditional logging of detailed output for development and troubleshooting.
+
+    Args:
+        message: The message string to be logged.
+
+    Returns:
+        None
+
+    Raises:
+        This function does not raise any exceptions.
+
+    See Also:
+        logger: The logger object used for logging messages.
+    """
+    if DEBUG:
+        logger.debug(message)
+
+
+class TokenCache:
+    """
+    Persistent, content-hash verified cache of per-file token counts.
+
+    The cache maps absolute file paths to the file size, modification time and content
+    hash seen when the file was last tokenized, together with the token count for each
+    encoding the file was tokenized with. It is loaded from and saved to a JSON file.
+    Content hashes are git blob hashes, so the blob hashes of unmodified files in the
+    git index can be compared with them without reading the files.
+
+    Attributes:
+        path (Optional[str]): Path of the JSON file backing the cache, or None if the
+            cache is kept in memory only.
+        entries (Dict[str, dict]): Cache entries keyed by absolute file path.
+    """
+
+    VERSION = 4
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self.seen = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path: Optional[str]) -> "TokenCache":
+        """
+        Loads the token cache from the given file.
+
+        A missing, unreadable or incompatible cache file results in an empty cache,
+        so a damaged cache never prevents the script from running.
+
+        Args:
+            path (Optional[str]): Path of the JSON cache file.
+
+        Returns:
+            TokenCache: The loaded cache.
+        """
+        cache = cls(path)
+        if not path or not os.path.isfile(path):
+            return cache
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == cls.VERSION:
+                cache.entries = data.get("entries", {})
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable token cache {path}: {e}")
+        debug_log(f"Loaded {len(cache.entries)} token cache entries from {path}")
+        return cache
+
+    def lookup(
+        self,
+        file: str,
+        stat: os.stat_result,
+        encoding_name: str,
+        digest: Optional[str] = None,
+    ) -> Optional[int]:
+        """
+        Looks up the cached token count of a file.
+
+        Without a digest, the entry is only used if the file size and modification time
+        match. With a digest, the entry is used if the content hash matches, in which
+        case the stored size and modification time are refreshed.
+
+        Args:
+            file (str): Absolute path of the file.
+            stat (os.stat_result): Current stat result of the file.
+            encoding_name (str): Name of the encoding the count is requested for.
+            digest (Optional[str]): Content hash of the file, if already computed.
+
+        Returns:
+            Optional[int]: The cached token count, or None on a cache miss.
+        """
+        with self.lock:
+            self.seen.add(file)
+            entry = self.entries.get(file)
+            if not entry or encoding_name not in entry.get("tokens", {}):
+                return None
+            if digest is None:
+                if (
+                    TOKEN_CACHE_VERIFY
+                    or entry.get("size") != stat.st_size
+                    or entry.get("mtime_ns") != stat.st_mtime_ns
+                ):
+                    return None
+            elif entry.get("hash") != digest:
+                return None
+            elif entry.get("mtime_ns") != stat.st_mtime_ns:
+                entry["size"] = stat.st_size
+                entry["mtime_ns"] = stat.st_mtime_ns
+                self.dirty = True
+            self.hits += 1
+            return entry["tokens"][encoding_name]
+
+    def store(
+        self,
+        file: str,
+        stat: os.stat_result,
+        digest: str,
+        encoding_name: str,
+        tokens: int,
+    ):
+        """
+        Stores the token count of a file.
+
+        Counts for other encodings are kept as long as the content hash is unchanged and
+        discarded otherwise.
+
+        Args:
+            file (str): Absolute path of the file.
+            stat (os.stat_result): Stat result of the file when it was read.
+            digest (str): Content hash of the file.
+            encoding_name (str): Name of the encoding used for the count.
+            tokens (int): The token count.
+        """
+        with self.lock:
+            entry = self.entries.get(file)
+            if not entry or entry.get("hash") != digest:
+                entry = {"tokens": {}}
+                self.entries[file] = entry
+            entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns, hash=digest)
+            entry["tokens"][encoding_name] = tokens
+            self.seen.add(file)
+            self.misses += 1
+            self.dirty = True
+
+    def bytes_per_token(self, encoding_name: str) -> Dict[str, float]:
+        """
+        Calibrates the bytes per token ratio of each extension from cached counts.
+
+        Args:
+            encoding_name (str): Name of the encoding the ratios are calibrated for.
+
+        Returns:
+            Dict[str, float]: Bytes per token keyed by lower-case file extension, for
+            extensions with at least TOKEN_ESTIMATE_MIN_SAMPLES cached counts.
+        """
+        totals: Dict[str, List[int]] = {}
+        with self.lock:
+            for file, entry in self.entries.items():
+                tokens = entry.get("tokens", {}).get(encoding_name)
+                if not tokens:
+                    continue
+                ext = os.path.splitext(file)[1].lower()
+                total = totals.setdefault(ext, [0, 0, 0])
+                total[0] += entry.get("size", 0)
+                total[1] += tokens
+                total[2] += 1
+        return {
+            ext: size / tokens
+            for ext, (size, tokens, samples) in totals.items()
+            if samples >= TOKEN_ESTIMATE_MIN_SAMPLES
+        }
+
+    def evict_missing(self) -> int:
+        """
+        Removes the entries of files that no longer exist.
+
+        Files looked up during this run are known to exist and are not checked again.
+
+        Returns:
+            int: The number of evicted entries.
+        """
+        missing = [
+            file
+            for file in self.entries
+            if file not in self.seen and not os.path.isfile(file)
+        ]
+        for file in missing:
+            del self.entries[file]
+        if missing:
+            self.dirty = True
+        return len(missing)
+
+    def save(self):
+        """
+        Evicts stale entries and writes the cache back to its file.
+
+        The file is written to a temporary path first and then moved into place, so an
+        interrupted run never leaves a truncated cache behind.
+
+        Raises:
+            This method does not raise exceptions; write errors are logged as warnings.
+        """
+        evicted = self.evict_missing()
+        if not self.path or not self.dirty:
+            return
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": self.VERSION, "entries": self.entries}, f)
+            os.replace(temp_path, self.path)
+            self.dirty = False
+        except OSError as e:
+            logger.warning(f"Could not write token cache {self.path}: {e}")
+        debug_log(
+            f"Token cache saved: {self.hits} hits, {self.misses} misses, "
+            f"{evicted} evicted, {len(self.entries)} entries"
+        )
+
+
+_token_cache: Optional[TokenCache] = None
+
+
+def get_token_cache() -> TokenCache:
+    """
+    Returns the token cache of the current run, loading it on first use.
+
+    Returns:
+        TokenCache: The shared token cache. If TOKEN_CACHE_FILE is not set, the cache
+        is kept in memory only.
+    """
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenCache.load(TOKEN_CACHE_FILE)
+    return _token_cache
+
+
+def save_token_cache():
+    """
+    Saves the token cache of the current run if it has been loaded.
+
+    See Also:
+        TokenCache.save: Writes the cache and evicts entries of deleted files.
+    """
+    if _token_cache is not None:
+        _token_cache.save()
+
+
+def get_tokenizer(model: Optional[str] = None) -> Tuple[str, float]:
+    """
+    Resolves the tokenizer used for the token accounting of a model.
+
+    Models listed in TOKENIZERS use their configured encoding and calibration ratio.
+    Other models use the encoding tiktoken knows for them, or the "default" entry.
+
+    Args:
+        model (Optional[str]): The model name, or None for aider's default model.
+
+    Returns:
+        Tuple[str, float]: The tiktoken encoding name and the calibration ratio.
+    """
+    if model is None:
+        return TOKENIZERS["default"]
+    if model in TOKENIZERS:
+        return TOKENIZERS[model]
+    try:
+        import tiktoken
+
+        return tiktoken.encoding_name_for_model(model), 1.0
+    except (ImportError, KeyError):
+        return TOKENIZERS["default"]
+
+
+def prepare_tokenizer_cache(encoding_name: str):
+    """
+    Points tiktoken at TOKENIZER_CACHE_DIR and registers BPE files placed there.
+
+    tiktoken caches BPE files under the SHA-1 of their download URL. A file placed in
+    the directory under its encoding name is copied to that cache name, so tiktoken
+    finds it without downloading it.
+
+    Args:
+        encoding_name (str): Name of the encoding about to be loaded.
+
+    Raises:
+        FileNotFoundError: If TOKENIZER_OFFLINE is set and the BPE file is not available
+            locally.
+    """
+    url = (
+        f"https://openaipublic.blob.core.windows.net/encodings/{encoding_name}.tiktoken"
+    )
+    cache_path = os.path.join(
+        TOKENIZER_CACHE_DIR, hashlib.sha1(url.encode()).hexdigest()
+    )
+    named_path = os.path.join(TOKENIZER_CACHE_DIR, f"{encoding_name}.tiktoken")
+    os.environ["TIKTOKEN_CACHE_DIR"] = TOKENIZER_CACHE_DIR
+
+    if not os.path.isfile(cache_path) and os.path.isfile(named_path):
+        shutil.copyfile(named_path, cache_path)
+    if TOKENIZER_OFFLINE and not os.path.isfile(cache_path):
+        raise FileNotFoundError(
+            f"{named_path} not found and downloads are disabled by TOKENIZER_OFFLINE"
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoder(encoding_name: str) -> Optional["tiktoken.Encoding"]:
+    """
+    Returns the tiktoken encoding with the given name, loading it only once per run.
+
+    tiktoken is imported lazily, so runs that never count tokens do not pay for it.
+    A tokenizer that cannot be loaded is reported once and treated as unavailable.
+
+    Args:
+        encoding_name (str): Name of the tiktoken encoding.
+
+    Returns:
+        Optional[tiktoken.Encoding]: The loaded encoding, or None if tiktoken or its
+        BPE file is unavailable.
+
+    See Also:
+        TOKENIZER_CACHE_DIR: Local directory holding the BPE files
+    """
+    debug_log(f"Loading tokenizer {encoding_name}")
+    try:
+        import tiktoken
+
+        if TOKENIZER_CACHE_DIR:
+            os.makedirs(TOKENIZER_CACHE_DIR, exist_ok=True)
+            prepare_tokenizer_cache(encoding_name)
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(
+            f"Tokenizer {encoding_name} is unavailable ({e}). "
+            "Token counts will be estimated from file sizes."
+        )
+        return None
+
+
+def hash_blob(data: bytes) -> str:
+    """
+    Hashes file content the way git hashes blobs.
+
+    Args:
+        data (bytes): The file content.
+
+    Returns:
+        str: The hexadecimal SHA-1 of the content as a git blob object.
+    """
+    hasher = hashlib.sha1(b"blob %d\0" % len(data))
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def find_token_boundary(text: str) -> int:
+    """
+    Finds the last position in the text where it can be split without changing tokens.
+
+    The text is split after a line break that is followed by a letter or a digit, or
+    before a space that follows a letter or a digit. The pre-tokenization patterns of
+    the encodings in TOKENIZERS never join a line break with a following letter or
+    digit, nor a letter or digit with a following space, so both halves tokenize
+    exactly like the whole text. Other positions are not safe for every encoding:
+    o200k_base, for example, joins punctuation with the line breaks and slashes that
+    follow it, so ";\\n//" is a single pre-token.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        int: The split position, or 0 if the text contains no safe split position.
+    """
+    index = text.rfind("\n", 0, len(text) - 1)
+    while index != -1 and not text[index + 1].isalnum():
+        index = text.rfind("\n", 0, index)
+    if index != -1:
+        return index + 1
+
+    index = text.rfind(" ", 1)
+    while index > 0 and not text[index - 1].isalnum():
+        index = text.rfind(" ", 1, index)
+    return max(index, 0)
+
+
+def count_tokens_streaming(
+    path: str,
+    enc: "tiktoken.Encoding",
+    ceiling: Optional[int] = None,
+    max_chunk: int = 1024 * 1024,
+) -> Tuple[int, bool, Optional[str]]:
+    """
+    Counts the tokens of a file by tokenizing a memory-mapped view of it in chunks.
+
+    Chunks are split at boundaries that do not change tokenization, so the complete
+    count equals tokenizing the whole stripped file at once. Text without any such
+    boundary is split anywhere once it grows beyond four chunks, and the count is
+    then reported as incomplete, so it is not cached. If a ceiling is given, counting
+    stops as soon as it is exceeded; chunks are sized so that no more bytes are read
+    than the remaining tokens up to the ceiling could occupy.
+
+    Args:
+        path (str): Path of the file to count.
+        enc (tiktoken.Encoding): The encoding used to tokenize the file.
+        ceiling (Optional[int]): Token count above which counting may stop early.
+        max_chunk (int): The maximum number of bytes tokenized at once.
+
+    Returns:
+        Tuple[int, bool, Optional[str]]: The token count, whether the count is
+        complete and exact rather than a lower bound above the ceiling or an
+        approximation of text without safe split positions, and the content hash of
+        the file if it was read completely.
+
+    Raises:
+        OSError: If the file cannot be read.
+        UnicodeDecodeError: If the file is not valid UTF-8.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    tokens = 0
+    pending = ""
+    started = False
+    approximate = False
+    offset = 0
+
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        hasher = hashlib.sha1(b"blob %d\0" % size)
+        if size == 0:
+            return 0, True, hasher.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            while offset < size:
+                if ceiling is None:
+                    step = max_chunk
+                else:
+                    # Every token takes at least one byte
+                    step = min(max(ceiling - tokens + 1, 4096), max_chunk)
+                chunk = mapped[offset : offset + step]
+                offset += len(chunk)
+                hasher.update(chunk)
+                final = offset >= size
+
+                text = pending + decoder.decode(chunk, final=final)
+                if not started:
+                    text = text.lstrip()
+                    started = bool(text)
+                if final:
+                    segment, pending = text.rstrip(), ""
+                else:
+                    cut = find_token_boundary(text)
+                    if not cut and len(text) > 4 * max_chunk:
+                        # No safe boundary at all, accept an approximate split
+                        cut = len(text)
+                        approximate = True
+                    segment, pending = text[:cut], text[cut:]
+
+                if segment:
+                    segment = segment.replace("\r\n", "\n").replace("\r", "\n")
+                    tokens += len(enc.encode_ordinary(segment))
+                if ceiling is not None and tokens > ceiling and not final:
+                    return tokens, False, None
+
+    return tokens, not approximate, hasher.hexdigest()
+
+
+def read_token_source(
+    path: str, enc: "tiktoken.Encoding", ceiling: Optional[int] = None
+) -> Tuple[Optional[int], os.stat_result, Optional[str], Optional[str]]:
+    """
+    Reads a file for tokenization, answering from the token cache where possible.
+
+    The file is only read if its size or modification time changed since it was
+    cached and its git blob hash, if known, does not match the cached content hash.
+    It is only returned for tokenization if its content hash changed as well.
+    Files larger than STREAMING_THRESHOLD are counted right away by the streaming
+    counter, which may stop early once the ceiling is exceeded.
+
+    Args:
+        path (str): Absolute path of the file.
+        enc (tiktoken.Encoding): The encoding the file is counted with.
+        ceiling (Optional[int]): Token count above which counting may stop early.
+
+    Returns:
+        Tuple[Optional[int], os.stat_result, Optional[str], Optional[str]]: The
+        token count (None if the content still has to be tokenized), the stat result,
+        the content hash (None if the file was not read completely) and the stripped
+        content to tokenize (None if the count is already known).
+
+    Raises:
+        OSError: If the file cannot be read.
+        UnicodeDecodeError: If the file is not valid UTF-8.
+    """
+    cache = get_token_cache()
+    stat = os.stat(path)
+    tokens = cache.lookup(path, stat, enc.name)
+    if tokens is not None:
+        return tokens, stat, None, None
+
+    blob_sha = get_git_blob_sha(path)
+    if blob_sha is not None:
+        tokens = cache.lookup(path, stat, enc.name, blob_sha)
+        if tokens is not None:
+            return tokens, stat, blob_sha, None
+
+    if stat.st_size > STREAMING_THRESHOLD:
+        tokens, complete, digest = count_tokens_streaming(path, enc, ceiling)
+        if complete:
+            cache.store(path, stat, digest, enc.name, tokens)
+        return tokens, stat, digest, None
+
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hash_blob(data)
+    tokens = cache.lookup(path, stat, enc.name, digest)
+    if tokens is not None:
+        return tokens, stat, digest, None
+
+    # Decode the way a text-mode read would, including universal newlines
+    content = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+    return None, stat, digest, content.strip()
+
+
+def count_tokens_in_process(encoding_name: str, text: str) -> int:
+    """
+    Counts the tokens of a text in a worker process.
+
+    This is the process pool fallback for tiktoken versions without a batch encoder.
+
+    Args:
+        encoding_name (str): Name of the tiktoken encoding to use.
+        text (str): The text to tokenize.
+
+    Returns:
+        int: The number of tokens in the text.
+    """
+    return len(get_encoder(encoding_name).encode_ordinary(text))
+
+
+def encode_token_counts(enc: "tiktoken.Encoding", texts: List[str]) -> List[int]:
+    """
+    Counts the tokens of several texts, using all TOKENIZER_WORKERS.
+
+    Texts are encoded with tiktoken's multi-threaded encode_ordinary_batch. Older
+    tiktoken versions without it fall back to a process pool.
+
+    Args:
+        enc (tiktoken.Encoding): The encoding used to tokenize the texts.
+        texts (List[str]): The texts to tokenize.
+
+    Returns:
+        List[int]: The token count of each text, in input order.
+    """
+    if len(texts) == 1 or TOKENIZER_WORKERS <= 1:
+        return [len(enc.encode_ordinary(text)) for text in texts]
+    if hasattr(enc, "encode_ordinary_batch"):
+        return [
+            len(tokens)
+            for tokens in enc.encode_ordinary_batch(
+                texts, num_threads=TOKENIZER_WORKERS
+            )
+        ]
+    with ProcessPoolExecutor(max_workers=TOKENIZER_WORKERS) as pool:
+        return list(
+            pool.map(
+                count_tokens_in_process,
+                [enc.name] * len(texts),
+                texts,
+                chunksize=max(1, len(texts) // (TOKENIZER_WORKERS * 4)),
+            )
+        )
+
+
+def count_files_tokens(
+    files: List[str], enc: "tiktoken.Encoding", ceiling: Optional[int] = None
+) -> Dict[str, int]:
+    """
+    Counts the tokens of several files in parallel, using the token cache.
+
+    Files are read concurrently by a thread pool and the cache misses of each batch
+    are encoded together. Batches bound the number of file contents held in memory.
+
+    Args:
+        files (List[str]): Paths of the files to count.
+        enc (tiktoken.Encoding): The encoding used to tokenize the files.
+        ceiling (Optional[int]): Token count above which counting of large files may
+            stop early. Counts above the ceiling may then be lower bounds.
+
+    Returns:
+        Dict[str, int]: Token counts keyed by absolute file path.
+
+    Raises:
+        This function does not raise exceptions for individual files; files that
+        cannot be read or decoded are logged as errors and counted as 0 tokens.
+    """
+    cache = get_token_cache()
+    paths = list(dict.fromkeys(os.path.abspath(file) for file in files))
+    workers = max(1, min(TOKENIZER_WORKERS, len(paths)))
+    batch_size = workers * 64
+    counts = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(paths), batch_size):
+            batch = paths[start : start + batch_size]
+            futures = [
+                pool.submit(read_token_source, path, enc, ceiling) for path in batch
+            ]
+            pending = []
+            for path, future in zip(batch, futures):
+                try:
+                    tokens, stat, digest, content = future.result()
+                except Exception as e:
+                    logger.error(f"Error processing file {path}: {e}")
+                    counts[path] = 0
+                    continue
+                if tokens is None:
+                    pending.append((path, stat, digest, content))
+                else:
+                    counts[path] = tokens
+
+            if pending:
+                lengths = encode_token_counts(enc, [item[3] for item in pending])
+                for (path, stat, digest, _), tokens in zip(pending, lengths):
+                    cache.store(path, stat, digest, enc.name, tokens)
+                    counts[path] = tokens
+
+    return counts
+
+
+class TokenLedger:
+    """
+    Per-run memo of per-file token counts.
+
+    Every file is tokenized at most once per run and encoding: the first request for a
+    file counts it through the token cache, later requests are answered from memory.
+    The ledger is shared by the planners, the dry run logging and the summary in main,
+    so files that are used by many groups, such as the read-only files, are not
+    recounted per group. Files that are not in the ledger yet are counted together in
+    one parallel batch.
+
+    Counts are requested for a model and stored per encoding, so models sharing an
+    encoding share the work; the model's calibration ratio is applied on the way out.
+    Requests with a ceiling may be answered with a lower bound above the ceiling,
+    which is all a planner needs to know to classify a file as oversized.
+
+    Attributes:
+        counts (Dict[Tuple[str, str], int]): Exact token counts keyed by encoding name
+            and absolute file path.
+        floors (Dict[Tuple[str, str], int]): Lower bounds of token counts that
+            exceeded a ceiling, keyed like counts.
+    """
+
+    def __init__(self):
+        self.counts: Dict[Tuple[str, str], int] = {}
+        self.floors: Dict[Tuple[str, str], int] = {}
+        self.calibration: Dict[str, Dict[str, float]] = {}
+
+    def estimate(self, file: str, model: Optional[str] = None) -> int:
+        """
+        Estimates the token count of a file from its size, without reading it.
+
+        Exact counts already in the ledger are returned as they are. Otherwise the size
+        is divided by the bytes per token ratio of the file's extension, calibrated from
+        the token cache, or taken from TOKEN_ESTIMATE_BYTES_PER_TOKEN.
+
+        Args:
+            file (str): Path of the file to estimate.
+            model (Optional[str]): The model the file is counted for.
+
+        Returns:
+            int: The estimated token count, or 0 if the file cannot be accessed.
+        """
+        encoding_name, ratio = get_tokenizer(model)
+        path = os.path.abspath(file)
+        if (encoding_name, path) in self.counts:
+            return math.ceil(self.counts[(encoding_name, path)] * ratio)
+        return math.ceil(self.estimate_encoding(path, encoding_name) * ratio)
+
+    def estimate_encoding(self, path: str, encoding_name: str) -> int:
+        """
+        Estimates the number of tokens a file has in the given encoding.
+
+        Args:
+            path (str): Absolute path of the file.
+            encoding_name (str): Name of the encoding.
+
+        Returns:
+            int: The estimated token count, or 0 if the file cannot be accessed.
+        """
+        if encoding_name not in self.calibration:
+            self.calibration[encoding_name] = get_token_cache().bytes_per_token(
+                encoding_name
+            )
+            debug_log(
+                f"Calibrated bytes per token ({encoding_name}): "
+                f"{self.calibration[encoding_name]}"
+            )
+        ext = os.path.splitext(path)[1].lower()
+        bytes_per_token = self.calibration[encoding_name].get(
+            ext,
+            TOKEN_ESTIMATE_BYTES_PER_TOKEN.get(
+                ext, TOKEN_ESTIMATE_BYTES_PER_TOKEN["default"]
+            ),
+        )
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return 0
+        return math.ceil(size / bytes_per_token)
+
+    def known(self, key: Tuple[str, str], ceiling: Optional[int] = None) -> bool:
+        """
+        Tells whether a request for the given file can be answered from memory.
+
+        Args:
+            key (Tuple[str, str]): Encoding name and absolute path of the file.
+            ceiling (Optional[int]): Ceiling of the request in encoding tokens, if any.
+
+        Returns:
+            bool: True if the exact count, or a lower bound above the ceiling, is known.
+        """
+        if key in self.counts:
+            return True
+        return ceiling is not None and self.floors.get(key, -1) > ceiling
+
+    def prefetch(
+        self,
+        files: List[str],
+        ceiling: Optional[int] = None,
+        model: Optional[str] = None,
+    ):
+        """
+        Counts all files that are not in the ledger yet in one parallel batch.
+
+        If the tokenizer is unavailable, the files are estimated from their sizes.
+
+        Args:
+            files (List[str]): Paths of the files that will be needed.
+            ceiling (Optional[int]): Token count above which a lower bound suffices.
+            model (Optional[str]): The model the files are counted for.
+        """
+        encoding_name, ratio = get_tokenizer(model)
+        raw_ceiling = None if ceiling is None else int(ceiling / ratio)
+        missing = [
+            file
+            for file in files
+            if not self.known((encoding_name, os.path.abspath(file)), raw_ceiling)
+        ]
+        if not missing:
+            return
+        enc = get_encoder(encoding_name)
+        if enc is None:
+            # Fall back to the calibrated estimator instead of counting 0 tokens
+            for file in missing:
+                path = os.path.abspath(file)
+                self.counts[(encoding_name, path)] = self.estimate_encoding(
+                    path, encoding_name
+                )
+            return
+        counts = count_files_tokens(missing, enc, raw_ceiling)
+        for path, tokens in counts.items():
+            debug_log(f"File: {path}, Tokens ({encoding_name}): {tokens}")
+            if raw_ceiling is not None and tokens > raw_ceiling:
+                self.floors[(encoding_name, path)] = tokens
+            else:
+                self.counts[(encoding_name, path)] = tokens
+
+    def count(
+        self,
+        file: str,
+        ceiling: Optional[int] = None,
+        model: Optional[str] = None,
+    ) -> int:
+        """
+        Returns the token count of a single file, tokenizing it on first use.
+
+        Files that cannot be read or decoded are logged once and counted as 0 tokens.
+
+        Args:
+            file (str): Path of the file to count.
+            ceiling (Optional[int]): Token count above which a lower bound suffices.
+            model (Optional[str]): The model the file is counted for.
+
+        Returns:
+            int: The token count of the file for the model, or a lower bound of it if
+            that already exceeds the ceiling.
+        """
+        encoding_name, ratio = get_tokenizer(model)
+        raw_ceiling = None if ceiling is None else int(ceiling / ratio)
+        key = (encoding_name, os.path.abspath(file))
+        if not self.known(key, raw_ceiling):
+            self.prefetch([file], ceiling, model)
+        tokens = self.counts[key] if key in self.counts else self.floors[key]
+        return math.ceil(tokens * ratio)
+
+    def total(self, files: List[str], model: Optional[str] = None) -> int:
+        """
+        Returns the summed token count of the given files.
+
+        Args:
+            files (List[str]): Paths of the files to count.
+            model (Optional[str]): The model the files are counted for.
+
+        Returns:
+            int: The total token count across all files.
+        """
+        self.prefetch(files, model=model)
+        return sum(self.count(file, model=model) for file in files)
+
+
+_token_ledger = TokenLedger()
+
+
+def initialize_token_ledger():
+    """
+    Starts a fresh token ledger for a new run.
+
+    See Also:
+        TokenLedger: The per-run memo of token counts.
+    """
+    global _token_ledger
+    _token_ledger = TokenLedger()
+
+
+def get_token_ledger() -> TokenLedger:
+    """
+    Returns the token ledger shared by all token counting call sites of this run.
+
+    Returns:
+        TokenLedger: The current token ledger.
+    """
+    return _token_ledger
+
+
+def calculate_token_count(files: List[str], model: Optional[str] = None) -> int:
+    """
+    Calculate the total number of tokens in the given files using tiktoken.
+
+    This function calculates the total token count of the given files with the
+    tokenizer of the given model, as configured in TOKENIZERS. Per-file counts are
+    memoized in the token ledger of the current run, and counts of files that are
+    unchanged since they were last tokenized are served from the persistent token
+    cache, so every file is read and encoded at most once per encoding.
+
+    Args:
+        files (List[str]): A list of file paths for which token counts need to be calculated.
+        model (Optional[str]): The model the files are counted for. Defaults to the
+            model configured in LLM, or aider's default model.
+
+    Returns:
+        int: The total token count across all files.
+
+    Raises:
+        Exception: Logs an error if any file fails to process due to reading issues or encoding problems.
+
+    See Also:
+        TokenLedger: The per-run memo of per-file token counts.
+        TOKENIZERS: Tokenizers used for each model.
+    """
+    debug_log(f"Calculating token count for {len(files)} files")
+    if model is None and LLM not in ("default", "random", "turn-based"):
+        model = LLM
+    total_tokens = get_token_ledger().total(files, model)
+    debug_log(f"Total tokens: {total_tokens}")
+    return total_tokens
+
+
+def calculate_token_counts(
+    files: List[str], ceiling: Optional[int] = None, model: Optional[str] = None
+) -> Dict[str, int]:
+    """
+    Calculate the token count of each of the given files in one batch.
+
+    Files that are not in the token ledger yet are read concurrently and encoded with
+    tiktoken's multi-threaded batch encoder, so planners can fetch the counts of the
+    whole candidate set up front instead of tokenizing one file at a time.
+
+    Args:
+        files (List[str]): A list of file paths for which token counts need to be calculated.
+        ceiling (Optional[int]): Token count above which an exact count is not needed.
+            Large files are then only tokenized until the ceiling is exceeded, and
+            counts above the ceiling may be lower bounds.
+        model (Optional[str]): The model the files are counted for, or None for
+            aider's default model.
+
+    Returns:
+        Dict[str, int]: The token count of each file, keyed by the paths as given.
+
+    See Also:
+        calculate_token_count: Returns the total token count of a list of files.
+        TOKENIZER_WORKERS: Number of threads used for reading and encoding.
+    """
+    debug_log(f"Calculating token counts for {len(files)} files")
+    ledger = get_token_ledger()
+    ledger.prefetch(files, ceiling, model)
+    return {file: ledger.count(file, ceiling, model) for file in files}
+
+
+def translate_gitignore_pattern(pattern: str) -> Optional[Tuple[str, bool]]:
+    """
+    Translates a line of a .gitignore file into a regular expression.
+
+    The expression matches paths relative to the directory of the .gitignore file,
+    using "/" as separator, where directories are given with a trailing "/".
+
+    Args:
+        pattern (str): A line of a .gitignore file.
+
+    Returns:
+        Optional[Tuple[str, bool]]: The regular expression and whether the rule is
+        negated, or None for blank lines and comments.
+    """
+    pattern = pattern.rstrip("\n")
+    # Trailing spaces are ignored unless they are escaped
+    while pattern.endswith(" ") and not pattern.endswith("\\ "):
+        pattern = pattern[:-1]
+    if not pattern or pattern.startswith("#"):
+        return None
+    negate = pattern.startswith("!")
+    if negate:
+        pattern = pattern[1:]
+    elif pattern.startswith("\\!") or pattern.startswith("\\#"):
+        pattern = pattern[1:]
+    directory_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    if not pattern:
+        return None
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+
+    parts = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**", i):
+            at_start = i == 0 or pattern[i - 1] == "/"
+            if at_start and pattern.startswith("**/", i):
+                parts.append("(?:.*/)?")
+                i += 3
+                continue
+            if at_start and i + 2 == len(pattern):
+                # A trailing "/**" matches everything inside, but not the directory
+                parts.append(".+" if i else ".*")
+                i += 2
+                continue
+            parts.append("[^/]*")
+            i += 2
+        elif char == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif char == "?":
+            parts.append("[^/]")
+            i += 1
+        elif char == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                parts.append(re.escape(char))
+                i += 1
+                continue
+            content = pattern[i + 1 : end]
+            if content.startswith("!"):
+                content = "^" + content[1:]
+            parts.append("[" + content.replace("\\", "\\\\") + "]")
+            i = end + 1
+        elif char == "\\" and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(char))
+            i += 1
+
+    prefix = "" if anchored else "(?:.*/)?"
+    suffix = "/" if directory_only else "/?"
+    return prefix + "".join(parts) + suffix, negate
+
+
+class IgnoreMatcher:
+    """
+    Compiled matcher for IGNORE_FILES and the project's git ignore rules.
+
+    All patterns are compiled once into a few combined regular expressions, so
+    checking a path costs a handful of regex matches regardless of the number of
+    patterns. Rules of each ignore file are evaluated with git's semantics: the last
+    matching rule decides, and rules of deeper .gitignore files take precedence over
+    those of their parent directories.
+
+    Paths are relative to PROJECT_DIR. Directories are checked with is_directory set,
+    and a directory that is ignored can be skipped entirely.
+
+    Attributes:
+        rule_sets (Dict[str, List[Tuple[re.Pattern, bool]]]): Compiled git ignore
+            rules keyed by the directory of their ignore file relative to PROJECT_DIR,
+            with a trailing "/" (empty for PROJECT_DIR). Each rule set is a list of
+            combined expressions of consecutive rules, with whether they negate.
+        sources (List[str]): Paths of the ignore files loaded so far, in load order.
+    """
+
+    def __init__(self, patterns=(), use_ignore_files: bool = True):
+        translated = [fnmatch.translate(pattern) for pattern in patterns]
+        # Patterns ending in "*" also match everything below a matching directory
+        directory_patterns = [
+            fnmatch.translate(pattern) for pattern in patterns if pattern.endswith("*")
+        ]
+        self.file_regex = re.compile("|".join(translated)) if translated else None
+        self.directory_regex = (
+            re.compile("|".join(directory_patterns)) if directory_patterns else None
+        )
+        self.use_ignore_files = use_ignore_files
+        self.rule_sets: Dict[str, List[Tuple["re.Pattern", bool]]] = {}
+        self.sources: List[str] = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_project(cls) -> "IgnoreMatcher":
+        """
+        Builds the matcher for the current configuration.
+
+        Returns:
+            IgnoreMatcher: A matcher for IGNORE_FILES and, if USE_IGNORE_FILES is set,
+            the .gitignore and .aiderignore files of PROJECT_DIR and .git/info/exclude.
+        """
+        matcher = cls(sorted(IGNORE_FILES), USE_IGNORE_FILES)
+        if USE_IGNORE_FILES:
+            matcher.add_ignore_file(
+                os.path.join(PROJECT_DIR, ".git", "info", "exclude"), ""
+            )
+            matcher.add_ignore_file(os.path.join(PROJECT_DIR, ".gitignore"), "")
+            matcher.add_ignore_file(os.path.join(PROJECT_DIR, ".aiderignore"), "")
+        return matcher
+
+    def add_ignore_file(self, path: str, base: str):
+        """
+        Compiles the rules of an ignore file and adds them to the matcher.
+
+        Rules of several files for the same directory are evaluated as if they were
+        one file, in the order the files were added.
+
+        Args:
+            path (str): Path of the ignore file. Missing files are skipped.
+            base (str): Directory of the rules relative to PROJECT_DIR, with a trailing
+                separator, or an empty string for PROJECT_DIR.
+        """
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        rules = [rule for rule in map(translate_gitignore_pattern, lines) if rule]
+        base = base.replace(os.sep, "/")
+
+        groups = []
+        for regex, negate in rules:
+            if groups and groups[-1][1] == negate:
+                groups[-1][0].append(regex)
+            else:
+                groups.append(([regex], negate))
+        compiled = [
+            (re.compile("(?:" + ")|(?:".join(regexes) + ")$"), negate)
+            for regexes, negate in groups
+        ]
+        with self.lock:
+            self.rule_sets[base] = self.rule_sets.get(base, []) + compiled
+            self.sources.append(path)
+        debug_log(f"Loaded {len(rules)} ignore rules from {path}")
+
+    def add_scan_start_ignore_files(self, scan_start_path: str) -> str:
+        """
+        Adds the .gitignore files from below PROJECT_DIR down to the scan start.
+
+        Args:
+            scan_start_path (str): The directory scanning starts from.
+
+        Returns:
+            str: The scan start relative to PROJECT_DIR with a trailing separator, or
+            an empty string if scanning starts from PROJECT_DIR.
+        """
+        start_relative = os.path.relpath(scan_start_path, PROJECT_DIR)
+        if start_relative == os.curdir:
+            return ""
+        start_relative += os.sep
+        if self.use_ignore_files:
+            parts = start_relative.split(os.sep)[:-1]
+            for index in range(1, len(parts) + 1):
+                base = os.sep.join(parts[:index]) + os.sep
+                self.add_ignore_file(
+                    os.path.join(PROJECT_DIR, base, ".gitignore"), base
+                )
+        return start_relative
+
+    def matches_ignore_files(self, relative_path: str, is_directory: bool = False):
+        """
+        Checks a path against the IGNORE_FILES patterns only.
+
+        Args:
+            relative_path (str): The path relative to PROJECT_DIR.
+            is_directory (bool): Whether the path is a directory, in which case it
+                matches only if everything below it matches.
+
+        Returns:
+            bool: True if the path matches an IGNORE_FILES pattern.
+        """
+        if is_directory:
+            regex, relative_path = self.directory_regex, relative_path + os.sep
+        else:
+            regex = self.file_regex
+        return bool(regex and regex.match(relative_path))
+
+    def is_ignored(self, relative_path: str, is_directory: bool = False) -> bool:
+        """
+        Checks whether a path is ignored, assuming its parent directory is not.
+
+        Args:
+            relative_path (str): The path relative to PROJECT_DIR.
+            is_directory (bool): Whether the path is a directory.
+
+        Returns:
+            bool: True if the path is ignored.
+        """
+        if self.matches_ignore_files(relative_path, is_directory):
+            return True
+        if not self.use_ignore_files:
+            return False
+        path = relative_path.replace(os.sep, "/")
+        name = path.rsplit("/", 1)[-1]
+        if is_directory and name == ".git":
+            return True
+        path = path + "/" if is_directory else path
+
+        # Deeper ignore files take precedence over their parent directories
+        base_end = path.rfind("/", 0, len(path) - 1)
+        while True:
+            base = path[: base_end + 1]
+            rule_set = self.rule_sets.get(base)
+            if rule_set:
+                relative_to_base = path[len(base) :]
+                for regex, negate in reversed(rule_set):
+                    if regex.match(relative_to_base):
+                        return not negate
+            if base_end == -1:
+                return False
+            base_end = path.rfind("/", 0, base_end)
+
+    def is_ignored_file(self, relative_path: str) -> bool:
+        """
+        Checks whether a file is ignored, including through one of its parent directories.
+
+        Args:
+            relative_path (str): The file path relative to PROJECT_DIR.
+
+        Returns:
+            bool: True if the file or one of its parent directories is ignored.
+        """
+        parts = relative_path.split(os.sep)
+        for index in range(1, len(parts)):
+            if self.is_ignored(os.sep.join(parts[:index]), is_directory=True):
+                return True
+        return self.is_ignored(relative_path)
+
+
+class ScanManifest:
+    """
+    Persistent cache of directory listings, validated by directory modification times.
+
+    Each entry holds the modification time of a directory, the modification time and
+    size of its .gitignore file, and the files and subdirectories scan_directory found
+    in it. Adding, removing or renaming an entry changes the modification time of its
+    directory, so an unchanged modification time means the cached listing is still
+    valid, as long as the ignore rules did not change. The listings are only valid for
+    the configuration fingerprint they were built with.
+
+    Attributes:
+        path (Optional[str]): Path of the JSON file backing the manifest, or None if
+            the manifest is kept in memory only.
+        entries (Dict[str, dict]): Listings of the previous run keyed by directory path.
+        updated (Dict[str, dict]): Listings of the current run keyed by directory path.
+        fingerprint (Optional[str]): Fingerprint of the configuration of the listings.
+    """
+
+    VERSION = 1
+    # Directories modified this close to the scan may change again within the same
+    # modification time tick, so their listings are not trusted on the next run
+    RACY_INTERVAL_NS = 2 * 10**9
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self.updated: Dict[str, dict] = {}
+        self.fingerprint: Optional[str] = None
+        self.dirty_prefixes: List[str] = []
+        self.started_ns = time.time_ns()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path: Optional[str]) -> "ScanManifest":
+        """
+        Loads the scan manifest from the given file.
+
+        A missing, unreadable or incompatible manifest file results in an empty
+        manifest, so a damaged manifest never prevents the script from running.
+
+        Args:
+            path (Optional[str]): Path of the JSON manifest file.
+
+        Returns:
+            ScanManifest: The loaded manifest.
+        """
+        manifest = cls(path)
+        if not path or not os.path.isfile(path):
+            return manifest
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == cls.VERSION:
+                manifest.fingerprint = data.get("fingerprint")
+                manifest.entries = data.get("directories", {})
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable scan manifest {path}: {e}")
+        debug_log(f"Loaded {len(manifest.entries)} scan manifest entries from {path}")
+        return manifest
+
+    @staticmethod
+    def compute_fingerprint(scan_start_path: str, matcher: IgnoreMatcher) -> str:
+        """
+        Computes the fingerprint of the scan configuration.
+
+        Args:
+            scan_start_path (str): The directory scanning starts from.
+            matcher (IgnoreMatcher): The ignore matcher, with the ignore files of
+                PROJECT_DIR and down to the scan start loaded.
+
+        Returns:
+            str: A hash of the scan settings and the contents of the loaded ignore
+            files.
+        """
+        settings = [
+            PROJECT_DIR,
+            scan_start_path,
+            SCAN_START,
+            SCAN_DEPTH,
+            sorted(PROCESSED_EXTENSIONS),
+            sorted(IGNORE_FILES),
+            USE_IGNORE_FILES,
+            FOLLOW_SYMLINKS,
+        ]
+        digest = hashlib.sha1(json.dumps(settings).encode("utf-8"))
+        for source in matcher.sources:
+            digest.update(source.encode("utf-8", "surrogateescape"))
+            try:
+                with open(source, "rb") as f:
+                    digest.update(hashlib.sha1(f.read()).digest())
+            except OSError:
+                continue
+        return digest.hexdigest()
+
+    def validate(self, fingerprint: str):
+        """
+        Discards the cached listings if they were built with another configuration.
+
+        Args:
+            fingerprint (str): The fingerprint of the current configuration.
+        """
+        if self.fingerprint != fingerprint:
+            if self.entries:
+                debug_log("Scan configuration changed, discarding the scan manifest")
+            self.entries = {}
+        self.fingerprint = fingerprint
+
+    @staticmethod
+    def stat_ignore_file(directory: str) -> Optional[List[int]]:
+        """
+        Returns the modification time and size of the .gitignore file of a directory.
+
+        Args:
+            directory (str): The directory.
+
+        Returns:
+            Optional[List[int]]: The modification time in nanoseconds and the size, or
+            None if the directory has no .gitignore file.
+        """
+        try:
+            stat = os.stat(os.path.join(directory, ".gitignore"))
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def lookup(
+        self, directory: str, relative_directory: str, mtime_ns: Optional[int]
+    ) -> Optional[dict]:
+        """
+        Returns the cached listing of a directory if it is still valid.
+
+        Args:
+            directory (str): The directory path.
+            relative_directory (str): The directory relative to PROJECT_DIR, with a
+                trailing separator.
+            mtime_ns (Optional[int]): The current modification time of the directory.
+
+        Returns:
+            Optional[dict]: The cached entry, or None if the directory has to be listed
+            again.
+        """
+        entry = self.entries.get(directory)
+        if entry is None or mtime_ns is None or entry["mtime_ns"] != mtime_ns:
+            return None
+        if any(relative_directory.startswith(prefix) for prefix in self.dirty_prefixes):
+            return None
+        if entry["ignore"] is not None:
+            if self.stat_ignore_file(directory) != entry["ignore"]:
+                return None
+        with self.lock:
+            self.hits += 1
+            self.updated[directory] = entry
+        return entry
+
+    def store(
+        self,
+        directory: str,
+        relative_directory: str,
+        mtime_ns: Optional[int],
+        ignore_stat: Optional[List[int]],
+        files: List[Tuple[str, str]],
+        subdirectories: List[Tuple[str, str, str, int]],
+    ):
+        """
+        Stores the listing of a directory that was scanned.
+
+        If the .gitignore file of the directory changed since the previous run, the
+        cached listings below the directory are invalidated as well, since they were
+        filtered with the old rules.
+
+        Args:
+            directory (str): The directory path.
+            relative_directory (str): The directory relative to PROJECT_DIR, with a
+                trailing separator.
+            mtime_ns (Optional[int]): The modification time of the directory before
+                it was scanned.
+            ignore_stat (Optional[List[int]]): The modification time and size of the
+                .gitignore file of the directory.
+            files (List[Tuple[str, str]]): The files found by scan_directory.
+            subdirectories (List[Tuple[str, str, str, int]]): The subdirectories found
+                by scan_directory.
+        """
+        if mtime_ns is not None and mtime_ns >= self.started_ns - self.RACY_INTERVAL_NS:
+            mtime_ns = None
+        entry = {
+            "mtime_ns": mtime_ns,
+            "ignore": ignore_stat,
+            "files": files,
+            "subdirectories": subdirectories,
+        }
+        with self.lock:
+            previous = self.entries.get(directory)
+            if previous is not None and previous["ignore"] != ignore_stat:
+                debug_log(f"Ignore rules changed below {relative_directory}")
+                self.dirty_prefixes.append(relative_directory)
+            self.misses += 1
+            self.updated[directory] = entry
+
+    def save(self):
+        """
+        Writes the listings of the current run back to the manifest file.
+
+        Listings of directories that were not visited by the current run are dropped.
+        The file is written to a temporary path first and then moved into place.
+
+        Raises:
+            This method does not raise exceptions; write errors are logged as warnings.
+        """
+        debug_log(
+            f"Scan manifest: {self.hits} directories reused, {self.misses} listed"
+        )
+        if not self.path or self.fingerprint is None:
+            return
+        # Scans may finish concurrently, e.g. while the pipeline builds the dependency
+        # graph, so each writer uses its own temporary file
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "version": self.VERSION,
+                        "fingerprint": self.fingerprint,
+                        "directories": self.updated,
+                    },
+                    f,
+                )
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write scan manifest {self.path}: {e}")
+
+
+def scan_directory(
+    directory: str,
+    relative_directory: str,
+    real_directory: str,
+    level: int,
+    matcher: IgnoreMatcher,
+    manifest: Optional[ScanManifest] = None,
+) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str, str, int]]]:
+    """
+    Scans a single directory for files to process and subdirectories to descend into.
+
+    The entries are read with os.scandir, reusing their file type information, and
+    sorted by name. Subdirectories that are ignored or deeper than SCAN_DEPTH are
+    pruned. The .gitignore file of the directory is added to the ignore matcher before
+    its entries are checked. With a scan manifest, the cached listing of the
+    directory is returned instead if the directory did not change.
+
+    Args:
+        directory (str): The directory to scan.
+        relative_directory (str): The directory relative to PROJECT_DIR, with a
+            trailing separator, or an empty string for PROJECT_DIR itself.
+        real_directory (str): The real path of the directory.
+        level (int): The nesting level of the directory below the scan start.
+        matcher (IgnoreMatcher): The ignore matcher to use.
+        manifest (Optional[ScanManifest]): The scan manifest to reuse and record
+            listings in.
+
+    Returns:
+        Tuple[List[Tuple[str, str]], List[Tuple[str, str, str, int]]]: The path and real
+        path of each file to process, and the path, relative path, real path and level
+        of each subdirectory to descend into, in name order.
+
+    Raises:
+        This function does not raise exceptions for unreadable directories; they are
+        logged as warnings and treated as empty.
+    """
+    mtime_ns = None
+    if manifest is not None:
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            pass
+        cached = manifest.lookup(directory, relative_directory, mtime_ns)
+        if cached is not None:
+            if cached["ignore"] is not None:
+                matcher.add_ignore_file(
+                    os.path.join(directory, ".gitignore"), relative_directory
+                )
+            return (
+                [tuple(file) for file in cached["files"]],
+                [tuple(subdirectory) for subdirectory in cached["subdirectories"]],
+            )
+
+    try:
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError as e:
+        logger.warning(f"Cannot scan directory {directory}: {e}")
+        return [], []
+
+    ignore_stat = None
+    if matcher.use_ignore_files and relative_directory:
+        for entry in entries:
+            if entry.name == ".gitignore":
+                try:
+                    stat = entry.stat()
+                    ignore_stat = [stat.st_mtime_ns, stat.st_size]
+                except OSError:
+                    pass
+                matcher.add_ignore_file(entry.path, relative_directory)
+                break
+
+    extensions = tuple(PROCESSED_EXTENSIONS)
+    files = []
+    subdirectories = []
+    for entry in entries:
+        relative_path = relative_directory + entry.name
+        try:
+            is_directory = entry.is_dir(follow_symlinks=FOLLOW_SYMLINKS)
+        except OSError:
+            continue
+
+        if is_directory:
+            # The scan start and its direct subdirectories are both at depth 0
+            if SCAN_DEPTH > 0 and level > SCAN_DEPTH:
+                continue
+            if matcher.is_ignored(relative_path, is_directory=True):
+                debug_log(f"Pruning ignored directory: {relative_path}")
+                continue
+            if entry.is_symlink():
+                real_path = os.path.realpath(entry.path)
+            else:
+                real_path = os.path.join(real_directory, entry.name)
+            subdirectories.append(
+                (entry.path, relative_path + os.sep, real_path, level + 1)
+            )
+        elif entry.name.endswith(extensions) and entry.is_file():
+            if matcher.is_ignored(relative_path):
+                continue
+            if entry.is_symlink():
+                real_path = os.path.realpath(entry.path)
+            else:
+                real_path = os.path.join(real_directory, entry.name)
+            files.append((entry.path, real_path))
+
+    if manifest is not None:
+        manifest.store(
+            directory, relative_directory, mtime_ns, ignore_stat, files, subdirectories
+        )
+    return files, subdirectories
+
+
+def iter_project_files(
+    scan_start_path: str,
+    matcher: Optional[IgnoreMatcher] = None,
+    manifest: Optional[ScanManifest] = None,
+) -> Iterator[str]:
+    """
+    Yields the files below a directory that match the processing criteria.
+
+    The directory tree is walked depth-first with scan_directory, yielding the files of
+    each directory before those of its subdirectories, so the files are yielded in a
+    deterministic order. With SCAN_WORKERS above 1, subdirectories are scanned
+    concurrently as soon as their parent has been scanned, while the results are still
+    merged in the same depth-first order.
+
+    Args:
+        scan_start_path (str): The directory to scan.
+        matcher (Optional[IgnoreMatcher]): The ignore matcher to use. Defaults to a
+            matcher built for the current configuration.
+        manifest (Optional[ScanManifest]): The scan manifest to reuse unchanged
+            directory listings from. It is validated against the configuration
+            fingerprint before the scan.
+
+    Yields:
+        str: The path of each file with one of the PROCESSED_EXTENSIONS that does not
+        match an ignore pattern.
+
+    Raises:
+        This function does not raise exceptions for unreadable directories; they are
+        logged as warnings and skipped.
+
+    Note:
+        Directories reachable through several paths when FOLLOW_SYMLINKS is set are
+        only yielded once, but a concurrent scan may read them more than once.
+    """
+    if matcher is None:
+        matcher = IgnoreMatcher.for_project()
+    start_relative = matcher.add_scan_start_ignore_files(scan_start_path)
+    if manifest is not None:
+        manifest.validate(ScanManifest.compute_fingerprint(scan_start_path, matcher))
+    start_real = os.path.realpath(scan_start_path)
+    start = (scan_start_path, start_relative, start_real, 0)
+    visited_directories = {start_real}
+    seen_files = set()
+
+    if SCAN_WORKERS <= 1:
+        stack = [start]
+        while stack:
+            files, subdirectories = scan_directory(*stack.pop(), matcher, manifest)
+            for path, real_path in files:
+                if real_path not in seen_files:
+                    seen_files.add(real_path)
+                    yield path
+            descend = []
+            for subdirectory in subdirectories:
+                if subdirectory[2] in visited_directories:
+                    debug_log(f"Skipping already visited directory: {subdirectory[0]}")
+                    continue
+                visited_directories.add(subdirectory[2])
+                descend.append(subdirectory)
+            stack.extend(reversed(descend))
+        return
+
+    stopped = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=SCAN_WORKERS)
+
+    def scan_subtree(directory: Tuple[str, str, str, int], ancestors: frozenset):
+        # Scans a directory and immediately submits its subdirectories, skipping
+        # symbolic link loops back to an ancestor
+        files, subdirectories = scan_directory(*directory, matcher, manifest)
+        children = []
+        if not stopped.is_set():
+            ancestors = ancestors | {directory[2]}
+            for subdirectory in subdirectories:
+                if subdirectory[2] not in ancestors:
+                    future = executor.submit(scan_subtree, subdirectory, ancestors)
+                    children.append((subdirectory, future))
+        return files, children
+
+    try:
+        stack = [executor.submit(scan_subtree, start, frozenset())]
+        while stack:
+            files, children = stack.pop().result()
+            for path, real_path in files:
+                if real_path not in seen_files:
+                    seen_files.add(real_path)
+                    yield path
+            descend = []
+            for subdirectory, future in children:
+                if subdirectory[2] in visited_directories:
+                    debug_log(f"Skipping already visited directory: {subdirectory[0]}")
+                    continue
+                visited_directories.add(subdirectory[2])
+                descend.append(future)
+            stack.extend(reversed(descend))
+    finally:
+        stopped.set()
+        executor.shutdown(wait=True)
+
+
+def benchmark_directory_scan(scan_start_path: str, elapsed: float, file_count: int):
+    """
+    Logs the duration of a directory scan compared with a serial os.walk traversal.
+
+    The os.walk traversal lists every directory below the scan start without pruning
+    or ignore checks, so it is the baseline cost of reading the tree with one thread.
+
+    Args:
+        scan_start_path (str): The directory that was scanned.
+        elapsed (float): The duration of the scan in seconds.
+        file_count (int): The number of files found by the scan.
+    """
+    started = time.perf_counter()
+    directories = 0
+    for _ in os.walk(scan_start_path, followlinks=FOLLOW_SYMLINKS):
+        directories += 1
+    walk_elapsed = time.perf_counter() - started
+    logger.info(
+        f"Scan benchmark: {file_count} files in {elapsed:.3f}s with {SCAN_WORKERS} "
+        f"workers, os.walk of {directories} directories in {walk_elapsed:.3f}s "
+        f"({walk_elapsed / max(elapsed, 1e-9):.2f}x speedup)"
+    )
+
+
+_git_blob_shas: Dict[str, str] = {}
+
+
+def get_git_blob_sha(path: str) -> Optional[str]:
+    """
+    Returns the git blob hash of a file listed by the git discovery backend.
+
+    Only tracked files without unstaged modifications have a blob hash, since the hash
+    in the git index only describes the working tree file for them.
+
+    Args:
+        path (str): Absolute path of the file.
+
+    Returns:
+        Optional[str]: The blob hash, or None if it is not known.
+    """
+    return _git_blob_shas.get(path)
+
+
+def run_git_ls_files(cwd: str, *args: str) -> List[str]:
+    """
+    Runs "git ls-files -z" with the given arguments and splits its output.
+
+    Args:
+        cwd (str): The directory to run git in; paths are relative to it.
+        *args (str): Additional arguments for git ls-files.
+
+    Returns:
+        List[str]: The output records.
+
+    Raises:
+        subprocess.CalledProcessError: If git fails, e.g. outside a git checkout.
+        FileNotFoundError: If git is not installed.
+    """
+    result = subprocess.run(
+        ["git", "ls-files", "-z"] + list(args),
+        cwd=cwd,
+        capture_output=True,
+        check=True,
+    )
+    return [os.fsdecode(record) for record in result.stdout.split(b"\0") if record]
+
+
+def list_git_files(scan_start_path: str, matcher: IgnoreMatcher) -> Optional[List[str]]:
+    """
+    Lists the files to process from the git index instead of scanning the file system.
+
+    Tracked files and, if GIT_INCLUDE_UNTRACKED is set, untracked files that are not
+    ignored by git are listed below the scan start. The same extension, ignore and
+    depth criteria as in iter_project_files are then applied. The blob hashes of
+    tracked, unmodified files are recorded for get_git_blob_sha.
+
+    Args:
+        scan_start_path (str): The directory to list files from.
+        matcher (IgnoreMatcher): The ignore matcher to apply.
+
+    Returns:
+        Optional[List[str]]: The absolute paths of the files to process, or None if
+        git is unavailable or the scan start is not inside a git checkout.
+    """
+    try:
+        staged = run_git_ls_files(scan_start_path, "--stage")
+        deleted = set(run_git_ls_files(scan_start_path, "--deleted"))
+        modified = set(run_git_ls_files(scan_start_path, "--modified"))
+        untracked = (
+            run_git_ls_files(scan_start_path, "--others", "--exclude-standard")
+            if GIT_INCLUDE_UNTRACKED
+            else []
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        debug_log(f"git ls-files is unavailable in {scan_start_path}: {e}")
+        return None
+
+    _git_blob_shas.clear()
+    candidates = {}
+    for record in staged:
+        info, relative_path = record.split("\t", 1)
+        mode, blob_sha, _ = info.split(" ")
+        if mode == "160000" or relative_path in deleted:
+            continue  # Submodules and deleted files
+        if mode == "120000" or relative_path in modified:
+            blob_sha = None  # The blob does not describe the file content
+        candidates[relative_path] = blob_sha
+    for relative_path in untracked:
+        candidates.setdefault(relative_path, None)
+
+    start_relative = matcher.add_scan_start_ignore_files(scan_start_path)
+    if matcher.use_ignore_files:
+        for relative_path in candidates:
+            directory, name = os.path.split(os.path.normpath(relative_path))
+            if name == ".gitignore" and directory:
+                base = start_relative + directory + os.sep
+                matcher.add_ignore_file(
+                    os.path.join(PROJECT_DIR, base, ".gitignore"), base
+                )
+
+    extensions = tuple(PROCESSED_EXTENSIONS)
+    directory_ignored: Dict[str, bool] = {}
+
+    def is_directory_ignored(relative_directory):
+        """
+        Checks whether a directory or one of its parents is ignored, memoized.
+        """
+        if not relative_directory:
+            return False
+        if relative_directory not in directory_ignored:
+            parent = os.path.dirname(relative_directory)
+            directory_ignored[relative_directory] = is_directory_ignored(
+                parent
+            ) or matcher.is_ignored(relative_directory, is_directory=True)
+        return directory_ignored[relative_directory]
+
+    files = []
+    for relative_path, blob_sha in candidates.items():
+        if not relative_path.endswith(extensions):
+            continue
+        native_path = os.path.normpath(relative_path)
+        # The scan start and its direct subdirectories are both at depth 0
+        depth = max(native_path.count(os.sep) - 1, 0)
+        if SCAN_DEPTH > 0 and depth > SCAN_DEPTH:
+            continue
+        project_relative = start_relative + native_path
+        if is_directory_ignored(
+            os.path.dirname(project_relative)
+        ) or matcher.is_ignored(project_relative):
+            continue
+        file_path = os.path.join(scan_start_path, native_path)
+        if blob_sha is None and not os.path.isfile(file_path):
+            continue
+        if blob_sha is not None:
+            _git_blob_shas[file_path] = blob_sha
+        files.append(file_path)
+
+    debug_log(f"Listed {len(files)} files from git in {scan_start_path}")
+    return files
+
+
+def iter_files_to_process() -> Iterator[str]:
+    """
+    Yields the files to be processed based on project-specific rules.
+
+    This function scans the project directory starting from a specified subdirectory and
+    yields all files with extensions that match the configured processed extensions,
+    as they are found. It excludes any files that match the specified ignore patterns.
+    Afterwards, it yields any manually added files even if they don't match the
+    processed extensions.
+
+    Yields:
+        str: The absolute path of each file that meets the processing criteria, once.
+
+    Raises:
+        This function does not explicitly raise any exceptions but will propagate any
         exceptions raised by underlying calls, such as issues with file reading or
         path manipulations.
+
+    See Also:
+        list_git_files: Lists the files from the git index.
+        iter_project_files: Generator that scans the project directory.
+    """
+    scan_start_path = os.path.join(PROJECT_DIR, SCAN_START)
+    matcher = IgnoreMatcher.for_project()
+    files = None
+    manifest = None
+    if DISCOVERY_BACKEND in ("auto", "git"):
+        files = list_git_files(scan_start_path, matcher)
+        if files is None and DISCOVERY_BACKEND == "git":
+            logger.warning("git is unavailable, scanning the file system instead.")
+    if files is None:
+        manifest = ScanManifest.load(SCAN_MANIFEST_FILE)
+        files = iter_project_files(scan_start_path, matcher, manifest)
+
+    started = time.perf_counter()
+    seen_files = set()
+    for file_path in files:
+        if file_path not in seen_files:
+            seen_files.add(file_path)
+            yield file_path
+
+    if manifest is not None:
+        elapsed = time.perf_counter() - started
+        manifest.save()
+        logger.info(
+            f"Scanned {len(seen_files)} files in {elapsed:.3f}s with {SCAN_WORKERS} "
+            "workers"
+        )
+        if SCAN_BENCHMARK:
+            benchmark_directory_scan(scan_start_path, elapsed, len(seen_files))
+
+    # Add manually added files
+    for file_pattern in MANUALLY_ADDED_FILES:
+        for file_path in glob.glob(
+            os.path.join(PROJECT_DIR, file_pattern), recursive=True
+        ):
+            relative_file_path = os.path.relpath(file_path, PROJECT_DIR)
+            if (
+                file_path not in seen_files
+                and os.path.isfile(file_path)
+                and not matcher.matches_ignore_files(relative_file_path)
+            ):
+                seen_files.add(file_path)
+                yield file_path
+
+
+def get_files_to_process() -> List[str]:
+    """
+    Collects a list of files to be processed based on project-specific rules.
+
+    Returns:
+        List[str]: A list of absolute file paths that meet the processing criteria.
+
+    See Also:
+        iter_files_to_process: Generator yielding the files as they are found.
+    """
+    return list(iter_files_to_process())
+
+
+def run_git(*args: str) -> str:
+    """
+    Runs a git command in PROJECT_DIR and returns its output.
+
+    Args:
+        *args (str): The git arguments.
+
+    Returns:
+        str: The standard output of the command.
+
+    Raises:
+        subprocess.CalledProcessError: If git fails.
+        FileNotFoundError: If git is not installed.
+    """
+    result = subprocess.run(
+        ["git"] + list(args),
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        check=True,
+        text=True,
+        encoding="utf-8",
+        errors="surrogateescape",
+    )
+    return result.stdout
+
+
+def load_run_state() -> dict:
+    """
+    Loads the state recorded by the last successful run.
+
+    Returns:
+        dict: The recorded state, or an empty dict if none was recorded.
+    """
+    try:
+        with open(RUN_STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_head_commit() -> Optional[str]:
+    """
+    Returns the commit checked out in PROJECT_DIR.
+
+    Returns:
+        Optional[str]: The commit hash, or None if git is unavailable.
+    """
+    try:
+        return run_git("rev-parse", "HEAD").strip()
+    except (OSError, subprocess.CalledProcessError) as e:
+        debug_log(f"Could not determine the checked out commit: {e}")
+        return None
+
+
+def record_successful_run(commit: Optional[str]):
+    """
+    Records the commit a successful run started from.
+
+    The commit checked out when the run started is recorded rather than the one at its
+    end, so changes committed while the run was in progress, by aider or anyone else,
+    are still considered changed by the next "last-run" run.
+
+    Args:
+        commit (Optional[str]): The commit checked out when the run started, or None
+            if git was unavailable, in which case nothing is recorded.
+
+    Raises:
+        This function does not raise exceptions; failures are logged as warnings.
+    """
+    if commit is None:
+        debug_log("Not recording the run state, git is unavailable")
+        return
+    state = load_run_state()
+    state["last_successful_commit"] = commit
+    try:
+        with open(RUN_STATE_FILE, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+    except OSError as e:
+        logger.warning(f"Could not write run state {RUN_STATE_FILE}: {e}")
+
+
+def get_changed_files(base_ref: str) -> Optional[Set[str]]:
+    """
+    Lists the files added or modified since a git revision.
+
+    Committed, staged and unstaged changes are included, as well as untracked files
+    that are not ignored by git.
+
+    Args:
+        base_ref (str): The git revision to compare with, or "last-run" for the commit
+            recorded by the last successful run.
+
+    Returns:
+        Optional[Set[str]]: The absolute paths of the changed files below PROJECT_DIR,
+        or None if the changes cannot be determined.
+    """
+    if base_ref == "last-run":
+        base_ref = load_run_state().get("last_successful_commit")
+        if not base_ref:
+            logger.warning("No successful run recorded yet, processing all files.")
+            return None
+    try:
+        changed = run_git(
+            "diff", "--name-only", "-z", "--relative", "--diff-filter=ACMR", base_ref
+        ).split("\0")
+        changed += run_git("ls-files", "-z", "--others", "--exclude-standard").split(
+            "\0"
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.error(f"Cannot determine the files changed since {base_ref}: {e}")
+        return None
+    return {
+        os.path.normpath(os.path.join(PROJECT_DIR, path)) for path in changed if path
+    }
+
+
+def find_dependents(changed_files: Set[str], candidates: List[str]) -> List[str]:
+    """
+    Finds the candidate files that depend on one of the changed files.
+
+    Args:
+        changed_files (Set[str]): Absolute paths of the changed files.
+        candidates (List[str]): The files to check.
+
+    Returns:
+        List[str]: The candidates that are not changed themselves but depend on a
+        changed file.
+    """
+    importers = get_dependency_graph().dependents(changed_files)
+    return [
+        file
+        for file in candidates
+        if file not in changed_files and os.path.abspath(file) in importers
+    ]
+
+
+def iter_changed_files(files: Iterable[str]) -> Iterator[str]:
+    """
+    Yields the files changed since CHANGED_SINCE among the given files.
+
+    Args:
+        files (Iterable[str]): The files found by the scan.
+
+    Yields:
+        str: The changed files, plus the files depending on them if
+        CHANGED_INCLUDE_DEPENDENTS is set, in scan order. All files are yielded if
+        the changes cannot be determined.
+    """
+    changed_files = get_changed_files(CHANGED_SINCE)
+    if changed_files is None:
+        yield from files
+        return
+    if CHANGED_INCLUDE_DEPENDENTS:
+        # Dependents are looked up in the graph of all files found by the scan
+        files = list(files)
+        get_dependency_graph(files)
+        dependent_files = set(find_dependents(changed_files, files))
+
+    total = changed = dependents = 0
+    for file in files:
+        total += 1
+        if file in changed_files:
+            changed += 1
+            yield file
+        elif CHANGED_INCLUDE_DEPENDENTS and file in dependent_files:
+            dependents += 1
+            yield file
+    logger.info(f"{changed} of {total} files changed since {CHANGED_SINCE}")
+    if CHANGED_INCLUDE_DEPENDENTS:
+        logger.info(f"Added {dependents} files depending on changed files")
+
+
+def filter_changed_files(files_to_process: List[str]) -> List[str]:
+    """
+    Limits the files to process to those changed since CHANGED_SINCE.
+
+    Args:
+        files_to_process (List[str]): The files found by the scan.
+
+    Returns:
+        List[str]: The changed files among them, plus the files depending on them if
+        CHANGED_INCLUDE_DEPENDENTS is set, in scan order. All files are returned if
+        the changes cannot be determined.
+
+    See Also:
+        iter_changed_files: Generator yielding the changed files as they are found.
+    """
+    return list(iter_changed_files(files_to_process))
+
+
+class DependencyEdge(NamedTuple):
+    """
+    A dependency of one module on another, as reported by dependency-cruiser.
+
+    Attributes:
+        source (str): Graph key of the importing module.
+        target (str): Graph key of the imported module: its absolute path, or the name
+            of a core module or of an import that could not be resolved.
+        module (str): The module name as written in the import statement.
+        core (bool): Whether the target is a core module of the runtime, such as "fs".
+        npm (bool): Whether the target is an npm package.
+        could_not_resolve (bool): Whether the import could not be resolved to a file.
+        dynamic (bool): Whether the target is imported dynamically with import().
+    """
+
+    source: str
+    target: str
+    module: str
+    core: bool = False
+    npm: bool = False
+    could_not_resolve: bool = False
+    dynamic: bool = False
+
+    @property
+    def is_file(self) -> bool:
+        """Whether the target is a file of the project or its packages."""
+        return not (self.core or self.could_not_resolve)
+
+
+class DependencyGraph:
+    """
+    In-memory module dependency graph of the project.
+
+    Modules are identified by absolute path; core modules and imports that could not be
+    resolved keep the name dependency-cruiser reports for them. The graph holds an
+    adjacency index from each module to the modules it imports and a reverse index from
+    each module to the modules importing it, so dependency lookups for a file or a group
+    of files do not need to run dependency-cruiser again.
+
+    Attributes:
+        adjacency (Dict[str, Set[str]]): The modules imported by each module.
+        reverse (Dict[str, Set[str]]): The modules importing each module.
+        edges (Dict[Tuple[str, str], DependencyEdge]): The dependencies keyed by
+            source and target.
+        resolved (Set[str]): The modules whose dependencies are known, as opposed to
+            modules that were only seen as the target of a dependency.
+        unresolved (Set[str]): The modules with imports that could not be resolved.
+    """
+
+    def __init__(self):
+        self.adjacency: Dict[str, Set[str]] = {}
+        self.reverse: Dict[str, Set[str]] = {}
+        self.edges: Dict[Tuple[str, str], DependencyEdge] = {}
+        self.resolved: Set[str] = set()
+        self.unresolved: Set[str] = set()
+        self.lock = threading.Lock()
+
+    def __contains__(self, module: str) -> bool:
+        return module in self.resolved
+
+    @staticmethod
+    def module_key(name: str, is_file: bool = True) -> str:
+        """
+        Returns the graph key of a module reported by dependency-cruiser.
+
+        Args:
+            name (str): The module path relative to the working directory, or the name
+                of a core module or unresolved import.
+            is_file (bool): Whether the module is a file.
+
+        Returns:
+            str: The absolute path of files, the name itself otherwise.
+        """
+        return os.path.abspath(name) if is_file else name
+
+    def add_module(self, module: str):
+        """
+        Adds a module to the graph and marks its dependencies as known.
+
+        Args:
+            module (str): The graph key of the module.
+        """
+        with self.lock:
+            self.adjacency.setdefault(module, set())
+            self.reverse.setdefault(module, set())
+            self.resolved.add(module)
+
+    def add_edge(self, edge: DependencyEdge):
+        """
+        Adds a dependency of one module on another.
+
+        Args:
+            edge (DependencyEdge): The dependency.
+        """
+        source, target = edge.source, edge.target
+        with self.lock:
+            self.adjacency.setdefault(source, set()).add(target)
+            self.adjacency.setdefault(target, set())
+            self.reverse.setdefault(target, set()).add(source)
+            self.reverse.setdefault(source, set())
+            self.edges[(source, target)] = edge
+            if edge.could_not_resolve:
+                self.unresolved.add(source)
+
+    def add_edges(
+        self,
+        modules: List[str],
+        edges: List[DependencyEdge],
+        sources: Optional[Set[str]] = None,
+    ):
+        """
+        Adds cruised modules and their dependencies to the graph.
+
+        Args:
+            modules (List[str]): Graph keys of the modules that were cruised.
+            edges (List[DependencyEdge]): The dependencies of the cruised modules.
+            sources (Optional[Set[str]]): If given, only these modules and their
+                dependencies are added, e.g. because the others were not followed.
+        """
+        for module in modules:
+            if sources is None or module in sources:
+                self.add_module(module)
+        for edge in edges:
+            if sources is None or edge.source in sources:
+                self.add_edge(edge)
+
+    def edges_from(self, module: str) -> List[DependencyEdge]:
+        """
+        Returns the dependencies of a module.
+
+        Args:
+            module (str): Graph key of the module.
+
+        Returns:
+            List[DependencyEdge]: The dependencies, ordered by target.
+        """
+        return [
+            self.edges[(module, target)]
+            for target in sorted(self.adjacency.get(module, ()))
+        ]
+
+    def dependency_edges(self, files: List[str]) -> List[DependencyEdge]:
+        """
+        Returns the dependencies on every path starting at one of the given files.
+
+        Only dependencies on files are followed further.
+
+        Args:
+            files (List[str]): The files to start from.
+
+        Returns:
+            List[DependencyEdge]: The dependencies in breadth-first order.
+        """
+        visited = {os.path.abspath(file) for file in files}
+        pending = sorted(visited)
+        edges = []
+        while pending:
+            next_pending = []
+            for module in pending:
+                for edge in self.edges_from(module):
+                    edges.append(edge)
+                    if edge.is_file and edge.target not in visited:
+                        visited.add(edge.target)
+                        next_pending.append(edge.target)
+            pending = next_pending
+        return edges
+
+    def dependencies(self, files: List[str]) -> List[str]:
+        """
+        Returns the files the given files depend on, directly or indirectly.
+
+        Core modules, imports that could not be resolved and the given files
+        themselves are not part of the result.
+
+        Args:
+            files (List[str]): The files to start from.
+
+        Returns:
+            List[str]: The absolute paths of the dependencies in breadth-first order.
+        """
+        sources = {os.path.abspath(file) for file in files}
+        targets = {}
+        for edge in self.dependency_edges(files):
+            if edge.is_file and edge.target not in sources:
+                targets[edge.target] = None
+        return list(targets)
+
+    def dependency_distances(self, files: List[str]) -> Dict[str, int]:
+        """
+        Returns the project files the given files depend on with their distance.
+
+        Only dependencies on files are followed; npm packages are neither returned nor
+        followed.
+
+        Args:
+            files (List[str]): The files to start from.
+
+        Returns:
+            Dict[str, int]: The length of the shortest import chain to each dependency,
+            in breadth-first order. The given files are not part of the result.
+        """
+        visited = {os.path.abspath(file) for file in files}
+        pending = sorted(visited)
+        distances = {}
+        distance = 0
+        while pending:
+            distance += 1
+            next_pending = []
+            for module in pending:
+                for edge in self.edges_from(module):
+                    if edge.is_file and not edge.npm and edge.target not in visited:
+                        visited.add(edge.target)
+                        distances[edge.target] = distance
+                        next_pending.append(edge.target)
+            pending = next_pending
+        return distances
+
+    def top_importers(self, files: List[str], count: int) -> List[str]:
+        """
+        Returns the modules importing each of the given files that rank highest.
+
+        Importers are ranked by how many of the given files they import, then by their
+        fan-in. npm packages and the given files themselves are not returned.
+
+        Args:
+            files (List[str]): The imported files.
+            count (int): The maximum number of importers of each file.
+
+        Returns:
+            List[str]: The importers of all files, without duplicates.
+        """
+        sources = [os.path.abspath(file) for file in files]
+        source_set = set(sources)
+        candidates = {
+            module
+            for module in self.dependents(sources)
+            if module not in source_set
+            and os.path.isabs(module)
+            and "node_modules" not in module.split(os.sep)
+        }
+        imported = {
+            module: len(self.adjacency.get(module, set()) & source_set)
+            for module in candidates
+        }
+        importers = {}
+        for source in sources:
+            ranked = sorted(
+                (
+                    module
+                    for module in self.reverse.get(source, ())
+                    if module in imported
+                ),
+                key=lambda module: (-imported[module], -self.fan_in(module), module),
+            )
+            importers.update(dict.fromkeys(ranked[:count]))
+        return list(importers)
+
+    def fan_in(self, module: str) -> int:
+        """
+        Returns the number of modules importing a module.
+
+        Args:
+            module (str): Graph key of the module.
+
+        Returns:
+            int: The number of importers.
+        """
+        return len(self.reverse.get(module, ()))
+
+    def file_targets(self, module: str) -> List[str]:
+        """
+        Returns the project files a module imports directly.
+
+        Args:
+            module (str): Graph key of the module.
+
+        Returns:
+            List[str]: The imported files, without npm packages, ordered by path.
+        """
+        return [
+            edge.target
+            for edge in self.edges_from(module)
+            if edge.is_file and not edge.npm
+        ]
+
+    def strongly_connected_components(self) -> List[List[str]]:
+        """
+        Returns the strongly connected components of the graph of project files.
+
+        The components are found with an iterative version of Tarjan's algorithm, so
+        long import chains do not exceed the recursion limit.
+
+        Returns:
+            List[List[str]]: The components in topological order from the leaves:
+            every component comes after all components it depends on.
+        """
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        components = []
+        for root in sorted(self.adjacency):
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.file_targets(root)))]
+            while work:
+                module, targets = work[-1]
+                for target in targets:
+                    if target not in index:
+                        index[target] = low[target] = len(index)
+                        stack.append(target)
+                        on_stack.add(target)
+                        work.append((target, iter(self.file_targets(target))))
+                        break
+                    if target in on_stack:
+                        low[module] = min(low[module], index[target])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[module])
+                    if low[module] == index[module]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == module:
+                                break
+                        components.append(sorted(component))
+        return components
+
+    def topological_levels(self, roots_first: bool = False) -> Dict[str, int]:
+        """
+        Assigns every module the level of its component in the condensed graph.
+
+        With leaves first, a component's level is one more than the highest level of
+        the components it depends on; with roots first, one more than the highest level
+        of the components importing it. Modules that depend on each other, directly or
+        indirectly, are on different levels unless they are in the same cycle.
+
+        Args:
+            roots_first (bool): Whether level 0 holds the modules nothing imports
+                instead of the modules that import nothing.
+
+        Returns:
+            Dict[str, int]: The level of each module.
+        """
+        components = self.strongly_connected_components()
+        component_of = {
+            module: number
+            for number, component in enumerate(components)
+            for module in component
+        }
+        levels = [0] * len(components)
+        numbers = range(len(components))
+        for number in reversed(numbers) if roots_first else numbers:
+            for module in components[number]:
+                for target in self.file_targets(module):
+                    target_number = component_of[target]
+                    if target_number == number:
+                        continue
+                    if roots_first:
+                        levels[target_number] = max(
+                            levels[target_number], levels[number] + 1
+                        )
+                    else:
+                        levels[number] = max(levels[number], levels[target_number] + 1)
+        return {module: levels[number] for module, number in component_of.items()}
+
+    def dependents(self, modules: Iterable[str]) -> Set[str]:
+        """
+        Returns the modules directly importing one of the given modules.
+
+        Args:
+            modules (Iterable[str]): Graph keys of the imported modules.
+
+        Returns:
+            Set[str]: Graph keys of the importing modules.
+        """
+        importers = set()
+        for module in modules:
+            importers.update(self.reverse.get(module, ()))
+        return importers
+
+    def edge_count(self) -> int:
+        """
+        Returns the number of dependencies in the graph.
+
+        Returns:
+            int: The number of edges.
+        """
+        return sum(len(targets) for targets in self.adjacency.values())
+
+
+class DependencyGraphCache:
+    """
+    Persistent cache of the dependency graph with a content fingerprint per module.
+
+    Each entry holds the size, modification time and content hash of a module file
+    when its dependencies were resolved, together with those dependencies. Content
+    hashes are git blob hashes, like in the token cache. The entries are only valid for
+    the module resolution configuration fingerprint they were built with.
+
+    Attributes:
+        path (Optional[str]): Path of the JSON file backing the cache, or None if the
+            cache is kept in memory only.
+        entries (Dict[str, dict]): Cache entries keyed by absolute module path.
+        fingerprint (Optional[str]): Fingerprint of the resolution configuration.
     """
-    files = []
-    scan_start_path = os.path.join(PROJECT_DIR, SCAN_START)
-    for root, _, filenames in os.walk(scan_start_path):
-        relative_path = os.path.relpath(root, scan_start_path)
-        current_depth = len(relative_path.split(os.sep)) - 1
-        if SCAN_DEPTH > 0 and current_depth > SCAN_DEPTH:
-            continue
-        for filename in filenames:
-            if any(filename.endswith(ext) for ext in PROCESSED_EXTENSIONS):
-                file_path = os.path.join(root, filename)
-                relative_file_path = os.path.relpath(file_path, PROJECT_DIR)
-                if not any(
-                    glob.fnmatch.fnmatch(relative_file_path, pattern)
-                    for pattern in IGNORE_FILES
-                ):
-                    files.append(file_path)
 
-    # Add manually added files
-    for file_pattern in MANUALLY_ADDED_FILES:
-        for file_path in glob.glob(
-            os.path.join(PROJECT_DIR, file_pattern), recursive=True
+    VERSION = 2
+    RESOLUTION_CONFIG_FILES = (
+        "package.json",
+        "tsconfig.json",
+        "jsconfig.json",
+        "webpack.config.js",
+        "vue.config.js",
+    )
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self.fingerprint: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @classmethod
+    def load(cls, path: Optional[str]) -> "DependencyGraphCache":
+        """
+        Loads the dependency graph cache from the given file.
+
+        A missing, unreadable or incompatible cache file results in an empty cache,
+        so a damaged cache never prevents the script from running.
+
+        Args:
+            path (Optional[str]): Path of the JSON cache file.
+
+        Returns:
+            DependencyGraphCache: The loaded cache.
+        """
+        cache = cls(path)
+        if not path or not os.path.isfile(path):
+            return cache
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == cls.VERSION:
+                cache.fingerprint = data.get("fingerprint")
+                cache.entries = data.get("modules", {})
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable dependency graph cache {path}: {e}")
+        debug_log(f"Loaded {len(cache.entries)} dependency graph entries from {path}")
+        return cache
+
+    @classmethod
+    def compute_fingerprint(cls) -> str:
+        """
+        Computes the fingerprint of the module resolution configuration.
+
+        Returns:
+            str: A hash of the contents of the resolution configuration files in
+            PROJECT_DIR, the working directory dependency-cruiser runs in, the
+            dependency backend, DEPENDENCY_ALIASES, SCSS_LOAD_PATHS and
+            PYTHON_PACKAGE_ROOTS.
+        """
+        settings = [
+            os.getcwd(),
+            get_dependency_backend(),
+            DEPENDENCY_ALIASES,
+            SCSS_LOAD_PATHS,
+            PYTHON_PACKAGE_ROOTS,
+        ]
+        digest = hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8"))
+        for name in cls.RESOLUTION_CONFIG_FILES:
+            try:
+                with open(os.path.join(PROJECT_DIR, name), "rb") as f:
+                    digest.update(name.encode("utf-8") + hash_blob(f.read()).encode())
+            except OSError:
+                continue
+        return digest.hexdigest()
+
+    def validate(self, fingerprint: str):
+        """
+        Discards the entries if they were built with another resolution configuration.
+
+        Args:
+            fingerprint (str): The fingerprint of the current configuration.
+        """
+        if self.fingerprint != fingerprint:
+            if self.entries:
+                debug_log("Module resolution changed, discarding the graph cache")
+            self.entries = {}
+        self.fingerprint = fingerprint
+
+    @staticmethod
+    def fingerprint_module(path: str, entry: Optional[dict] = None) -> Optional[dict]:
+        """
+        Computes the fingerprint of a module file.
+
+        The content hash is only computed if the size or modification time differs
+        from the given entry; unmodified files tracked by git use their blob hash.
+
+        Args:
+            path (str): Absolute path of the module.
+            entry (Optional[dict]): The cached entry of the module, if any.
+
+        Returns:
+            Optional[dict]: The size, modification time and content hash of the file,
+            or None if it does not exist.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime_ns"] == stat.st_mtime_ns
         ):
-            relative_file_path = os.path.relpath(file_path, PROJECT_DIR)
-            if os.path.isfile(file_path) and not any(
-                glob.fnmatch.fnmatch(relative_file_path, pattern)
-                for pattern in IGNORE_FILES
-            ):
-                files.append(file_path)
+            digest = entry["hash"]
+        else:
+            digest = get_git_blob_sha(path)
+            if digest is None:
+                try:
+                    with open(path, "rb") as f:
+                        digest = hash_blob(f.read())
+                except OSError:
+                    return None
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest}
+
+    def restore(self, graph: DependencyGraph, files: List[str]) -> List[str]:
+        """
+        Adds the still valid entries to the graph and returns the modules to resolve.
+
+        Args:
+            graph (DependencyGraph): The graph to add the cached dependencies to.
+            files (List[str]): The files to process that dependency-cruiser supports.
+
+        Returns:
+            List[str]: The modules whose dependencies have to be resolved again: new
+            and changed files, files importing deleted modules and, if files were
+            added, files with imports that could not be resolved before.
+        """
+        valid = {}
+        stale = []
+        deleted = set()
+        for module, entry in self.entries.items():
+            fingerprint = self.fingerprint_module(module, entry)
+            if fingerprint is None:
+                deleted.add(module)
+            elif fingerprint["hash"] != entry["hash"]:
+                stale.append(module)
+            else:
+                valid[module] = dict(entry, **fingerprint)
+
+        added = False
+        for file in files:
+            path = os.path.abspath(file)
+            if path not in self.entries:
+                stale.append(path)
+                added = True
+
+        for module, entry in list(valid.items()):
+            targets = {dependency[0] for dependency in entry["dependencies"]}
+            if deleted.intersection(targets) or (added and entry.get("unresolved")):
+                del valid[module]
+                stale.append(module)
+
+        for module, entry in valid.items():
+            graph.add_module(module)
+            for dependency in entry["dependencies"]:
+                graph.add_edge(DependencyEdge(module, *dependency))
+        self.entries = valid
+        self.hits = len(valid)
+        self.evicted = len(deleted)
+        return stale
+
+    def update(self, graph: DependencyGraph):
+        """
+        Records the dependencies of all resolved module files of the graph.
+
+        Args:
+            graph (DependencyGraph): The graph to record.
+        """
+        for module in list(graph.resolved):
+            if not os.path.isabs(module):
+                continue
+            entry = self.entries.get(module)
+            fingerprint = self.fingerprint_module(module, entry)
+            if fingerprint is None:
+                continue
+            if entry is None or entry["hash"] != fingerprint["hash"]:
+                self.misses += 1
+            self.entries[module] = dict(
+                fingerprint,
+                dependencies=[list(edge[1:]) for edge in graph.edges_from(module)],
+                unresolved=module in graph.unresolved,
+            )
+
+    def save(self):
+        """
+        Writes the cache back to its file.
+
+        The file is written to a temporary path first and then moved into place, so an
+        interrupted run never leaves a truncated cache behind.
+
+        Raises:
+            This method does not raise exceptions; write errors are logged as warnings.
+        """
+        logger.info(
+            f"Dependency graph cache: {self.hits} modules reused, {self.misses} "
+            f"resolved, {self.evicted} evicted"
+        )
+        if not self.path:
+            return
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "version": self.VERSION,
+                        "fingerprint": self.fingerprint,
+                        "modules": self.entries,
+                    },
+                    f,
+                )
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write dependency graph cache {self.path}: {e}")
 
-    return list(set(files))  # Remove duplicates
+
+_dependency_graph: Optional[DependencyGraph] = None
+_dependency_graph_cache: Optional[DependencyGraphCache] = None
+_dependency_graph_lock = threading.Lock()
+
+
+def get_dependency_graph(files: Optional[List[str]] = None) -> DependencyGraph:
+    """
+    Returns the dependency graph of the project, building it on first use.
+
+    The graph is restored from DEPENDENCY_GRAPH_CACHE_FILE, and only the modules that
+    changed since it was saved are passed to dependency-cruiser. Without a usable
+    cache, the graph is built with a single dependency-cruiser run over all files to
+    process that dependency-cruiser supports.
+
+    Args:
+        files (Optional[List[str]]): The files found by the scan, used if the graph is
+            built by this call. The project is only scanned again if the graph is
+            built without them.
+
+    Returns:
+        DependencyGraph: The shared dependency graph.
+    """
+    global _dependency_graph, _dependency_graph_cache
+    with _dependency_graph_lock:
+        if _dependency_graph is None:
+            started = time.perf_counter()
+            graph = DependencyGraph()
+            if files is None:
+                files = get_files_to_process()
+            files = filter_files_for_dependency_cruiser(files)
+            cache = DependencyGraphCache.load(DEPENDENCY_GRAPH_CACHE_FILE)
+            cache.validate(DependencyGraphCache.compute_fingerprint())
+            if cache.entries:
+                extend_dependency_graph(graph, cache.restore(graph, files))
+            elif files:
+                if DEPENDENCY_BENCHMARK:
+                    benchmark_dependency_backends(files)
+                result = cruise_dependencies(files, use_cache=True)
+                if result is not None:
+                    graph.add_edges(*result)
+                for file in files:
+                    graph.add_module(os.path.abspath(file))
+            logger.info(
+                f"Dependency graph has {len(graph.resolved)} modules and "
+                f"{graph.edge_count()} dependencies, built in "
+                f"{time.perf_counter() - started:.2f}s"
+            )
+            _dependency_graph = graph
+            _dependency_graph_cache = cache
+        return _dependency_graph
+
+
+def save_dependency_graph_cache():
+    """
+    Saves the dependency graph cache of the current run if the graph has been built.
+
+    See Also:
+        DependencyGraphCache.save: Writes the cache file.
+    """
+    if _dependency_graph is not None and _dependency_graph_cache is not None:
+        _dependency_graph_cache.update(_dependency_graph)
+        _dependency_graph_cache.save()
+
+
+@functools.lru_cache(maxsize=None)
+def get_dependency_backend() -> str:
+    """
+    Resolves the DEPENDENCY_BACKEND setting to the backend used in this run.
+
+    Returns:
+        str: "dependency-cruiser" or "native".
+    """
+    if DEPENDENCY_BACKEND != "auto":
+        return DEPENDENCY_BACKEND
+    if locate_dependency_cruiser():
+        return "dependency-cruiser"
+    logger.info("dependency-cruiser is not installed, using the native extractor")
+    return "native"
+
+
+def cruise_dependencies(
+    files: List[str], max_depth: Optional[int] = None, use_cache: bool = False
+) -> Optional[Tuple[List[str], List[DependencyEdge]]]:
+    """
+    Extracts the dependencies of files with the selected dependency backend.
+
+    Scripts are passed to the backend. The imports of SCSS files and of the
+    <style lang="scss"> blocks of Vue files are extracted natively with either backend,
+    and stylesheets imported by the scripts are followed if all levels are. Python
+    files are always handled by the native Python extractor.
+
+    Args:
+        files (List[str]): The files to extract the dependencies of.
+        max_depth (Optional[int]): How many levels of dependencies to follow, or None
+            to follow all of them.
+        use_cache (bool): Whether dependency-cruiser may use its own cache.
+
+    Returns:
+        Optional[Tuple[List[str], List[DependencyEdge]]]: The extracted modules and
+        their dependencies, or None if the backend could not be run.
+
+    See Also:
+        run_dependency_cruiser: The dependency-cruiser backend.
+        extract_dependencies: The native backend.
+        extract_stylesheet_dependencies: The SCSS extractor.
+        extract_python_dependencies: The Python extractor.
+    """
+    scripts = [
+        file for file in files if file.lower().endswith(DEPENDENCY_CRUISER_EXTENSIONS)
+    ]
+    stylesheets = [
+        file
+        for file in files
+        if file.lower().endswith(STYLESHEET_EXTENSIONS + (".vue",))
+    ]
+    python_files = [file for file in files if file.lower().endswith(PYTHON_EXTENSIONS)]
+    result = None
+    if scripts:
+        if get_dependency_backend() == "native":
+            result = extract_dependencies(scripts, max_depth)
+        else:
+            result = run_dependency_cruiser(scripts, max_depth, use_cache)
+    if not stylesheets and not python_files and result is None:
+        return None
+    modules, edges = result if result is not None else ([], [])
+    if max_depth is None:
+        stylesheets += [
+            edge.target
+            for edge in edges
+            if edge.is_file
+            and not edge.npm
+            and edge.target.lower().endswith(STYLESHEET_EXTENSIONS)
+        ]
+    if stylesheets:
+        stylesheet_modules, stylesheet_edges = extract_stylesheet_dependencies(
+            stylesheets, max_depth
+        )
+        modules = list(dict.fromkeys(list(modules) + stylesheet_modules))
+        edges = list(edges) + stylesheet_edges
+    if python_files:
+        python_modules, python_edges = extract_python_dependencies(
+            python_files, max_depth
+        )
+        modules = list(dict.fromkeys(list(modules) + python_modules))
+        edges = list(edges) + python_edges
+    return modules, edges
+
+
+def benchmark_dependency_backends(files: List[str]):
+    """
+    Logs the duration and the agreement of the dependency-cruiser and native backends.
+
+    Agreement is measured on the dependencies between files, as the share of the
+    dependencies found by either backend that both backends found.
+
+    Args:
+        files (List[str]): The files to extract the dependencies of.
+    """
+    results = {}
+    for backend, extract in (
+        ("dependency-cruiser", lambda: run_dependency_cruiser(files)),
+        ("native", lambda: extract_dependencies(files)),
+    ):
+        started = time.perf_counter()
+        result = extract()
+        elapsed = time.perf_counter() - started
+        if result is None:
+            logger.info(f"Dependency benchmark: {backend} failed after {elapsed:.2f}s")
+            return
+        results[backend] = {
+            (edge.source, edge.target) for edge in result[1] if edge.is_file
+        }
+        logger.info(
+            f"Dependency benchmark: {backend} found {len(results[backend])} "
+            f"dependencies between files in {elapsed:.2f}s"
+        )
+    cruiser, native = results["dependency-cruiser"], results["native"]
+    union = cruiser | native
+    agreement = len(cruiser & native) / len(union) if union else 1.0
+    logger.info(
+        f"Dependency benchmark: {agreement:.1%} agreement, "
+        f"{len(cruiser - native)} only found by dependency-cruiser, "
+        f"{len(native - cruiser)} only found by the native extractor"
+    )
+    for source, target in sorted(cruiser ^ native):
+        debug_log(f"Dependency found by one backend only: {source} → {target}")
+
+
+def extend_dependency_graph(graph: DependencyGraph, files: List[str]):
+    """
+    Resolves the dependencies of files and adds them to the graph.
+
+    dependency-cruiser is run on the files without following their dependencies, and
+    again on the imported files that are not in the graph yet, until all modules
+    reachable from the files are resolved. The files are added as modules even if
+    dependency-cruiser fails, so they are not cruised again for every lookup.
+
+    Args:
+        graph (DependencyGraph): The graph to extend.
+        files (List[str]): The files to cruise.
+    """
+    pending = list(dict.fromkeys(os.path.abspath(file) for file in files))
+    while pending:
+        sources = set(pending)
+        result = cruise_dependencies(pending, max_depth=1)
+        if result is not None:
+            graph.add_edges(*result, sources)
+        for module in pending:
+            graph.add_module(module)
+        targets = {
+            target
+            for module in sources
+            for target in graph.adjacency.get(module, ())
+            if os.path.isabs(target) and target not in graph
+        }
+        pending = []
+        for target in sorted(targets):
+            if target.lower().endswith(DEPENDENCY_EXTENSIONS):
+                if os.path.isfile(target):
+                    pending.append(target)
+            else:
+                # Other files, such as stylesheets, have no dependencies to follow
+                graph.add_module(target)
 
 
 def get_dependencies(files: List[str]) -> List[str]:
     """
-    Get dependencies for a list of files using dependency-cruiser.
+    Get dependencies for a list of files from the project's dependency graph.
 
     This function first filters the given list of files to include only those with valid
-    extensions for dependency-cruiser processing. It then uses dependency-cruiser to
-    discover and return a list of dependencies for the filtered files.
+    extensions for dependency-cruiser processing. It then looks up their dependencies in
+    the dependency graph, cruising only files that are not in the graph yet.
 
     Args:
         files (List[str]): A list of file paths for which dependencies need to be identified.
@@ -431,14 +3841,14 @@ def get_dependencies(files: List[str]) -> List[str]:
                    Returns an empty list if no dependencies are found or if input is empty.
 
     Notes:
-        This function relies on the presence of dependency-cruiser, and it assumes the tool
-        is installed and available in the system's execution path. It internally uses
-        `filter_files_for_dependency_cruiser` and `run_dependency_cruiser` to perform
+        Scripts rely on the selected dependency backend, while the dependencies of
+        stylesheets and Python files are extracted natively. It internally uses
+        `filter_files_for_dependency_cruiser` and `get_dependency_graph` to perform
         filtering and dependency extraction, respectively.
 
     See Also:
         filter_files_for_dependency_cruiser: Helper function to filter files for valid extensions.
-        run_dependency_cruiser: Executes dependency-cruiser to extract dependencies.
+        get_dependency_graph: Builds the dependency graph with one dependency-cruiser run.
     """
     if not files:
         return []
@@ -447,7 +3857,197 @@ def get_dependencies(files: List[str]) -> List[str]:
     if not filtered_files:
         return []
 
-    return run_dependency_cruiser(filtered_files)
+    return resolve_dependency_graph(filtered_files).dependencies(filtered_files)
+
+
+def resolve_dependency_graph(files: List[str]) -> DependencyGraph:
+    """
+    Returns the dependency graph after adding the files that are not in it yet.
+
+    Args:
+        files (List[str]): The files whose dependencies are needed.
+
+    Returns:
+        DependencyGraph: The project's dependency graph.
+    """
+    graph = get_dependency_graph()
+    missing = [file for file in files if os.path.abspath(file) not in graph]
+    if missing:
+        extend_dependency_graph(graph, missing)
+    return graph
+
+
+def get_processing_levels(files: List[str]) -> List[List[str]]:
+    """
+    Splits files into levels of the condensed dependency graph.
+
+    The files of a level do not depend on each other and could be processed
+    concurrently. Levels are ordered as configured in PROCESSING_ORDER, and files that
+    are not in the dependency graph are on the first level.
+
+    Args:
+        files (List[str]): The files to process.
+
+    Returns:
+        List[List[str]]: The files of each level, in the order in which they were given.
+    """
+    filtered_files = filter_files_for_dependency_cruiser(files)
+    levels = {}
+    if filtered_files:
+        graph = resolve_dependency_graph(filtered_files)
+        levels = graph.topological_levels(PROCESSING_ORDER == "roots-first")
+    processing_levels = {}
+    for file in files:
+        level = levels.get(os.path.abspath(file), 0)
+        processing_levels.setdefault(level, []).append(file)
+    return [processing_levels[level] for level in sorted(processing_levels)]
+
+
+def order_files_by_dependencies(files: List[str]) -> List[str]:
+    """
+    Orders files by their level in the dependency graph, as set in PROCESSING_ORDER.
+
+    Args:
+        files (List[str]): The files to process.
+
+    Returns:
+        List[str]: The files in processing order, or as given if PROCESSING_ORDER is
+        "scan".
+
+    See Also:
+        get_processing_levels: Function that computes the levels of the files.
+    """
+    if PROCESSING_ORDER == "scan" or not files:
+        return files
+    levels = get_processing_levels(files)
+    debug_log(
+        f"Processing {len(files)} files {PROCESSING_ORDER} in {len(levels)} levels: "
+        f"{[len(level) for level in levels]}"
+    )
+    return [file for level in levels for file in level]
+
+
+class DependencySelection(NamedTuple):
+    """
+    The dependencies selected as read-only context for a group of files.
+
+    Attributes:
+        files (List[str]): The selected dependencies, most relevant first.
+        dropped (List[Tuple[str, str]]): The dependencies that were left out, each
+            paired with the reason.
+    """
+
+    files: List[str]
+    dropped: List[Tuple[str, str]]
+
+
+def select_dependencies(
+    files: List[str],
+    model: Optional[str] = None,
+    token_limit: Optional[int] = None,
+) -> DependencySelection:
+    """
+    Selects the dependencies of files that fit into the read-only token budget.
+
+    The project files the given files depend on are ranked by their distance from the
+    files in the dependency graph, then by their fan-in, i.e. the number of modules
+    importing them, as widely used modules are the most likely to be relevant. If
+    READ_ONLY_IMPORTERS is set, the top importers of each file are ranked along with
+    the direct dependencies. The candidates are then added greedily as long as they fit
+    into the budget, so a large dependency does not keep smaller ones of the same rank
+    out. npm packages and imports that could not be resolved are dropped.
+
+    Args:
+        files (List[str]): The files of the group.
+        model (Optional[str]): The model whose tokenizer is used for counting, or None
+            for aider's default model.
+        token_limit (Optional[int]): The token budget of the dependencies. Defaults to
+            READ_ONLY_TOKEN_LIMIT.
+
+    Returns:
+        DependencySelection: The selected and the dropped dependencies.
+
+    See Also:
+        get_dependencies: Returns all dependencies without a budget.
+    """
+    if token_limit is None:
+        token_limit = READ_ONLY_TOKEN_LIMIT
+    filtered_files = filter_files_for_dependency_cruiser(files)
+    if not filtered_files:
+        return DependencySelection([], [])
+
+    graph = resolve_dependency_graph(filtered_files)
+    distances = graph.dependency_distances(filtered_files)
+    dropped = {}
+    for module in [os.path.abspath(file) for file in filtered_files] + list(distances):
+        for edge in graph.edges_from(module):
+            if edge.npm:
+                dropped.setdefault(edge.target, "npm package")
+            elif edge.could_not_resolve:
+                dropped.setdefault(edge.target, "could not be resolved")
+    if READ_ONLY_IMPORTERS > 0:
+        for module in graph.top_importers(filtered_files, READ_ONLY_IMPORTERS):
+            distances[module] = min(distances.get(module, 1), 1)
+    candidates = sorted(
+        distances, key=lambda module: (distances[module], -graph.fan_in(module), module)
+    )
+
+    selected = []
+    if token_limit is None:
+        selected = candidates
+    else:
+        ledger = get_token_ledger()
+        ledger.prefetch(candidates, token_limit, model)
+        used_tokens = 0
+        for module in candidates:
+            tokens = ledger.count(module, token_limit, model)
+            if used_tokens + tokens <= token_limit:
+                selected.append(module)
+                used_tokens += tokens
+            else:
+                dropped[module] = f"exceeds read-only token limit ({tokens} tokens)"
+
+    if dropped:
+        debug_log(
+            f"Selected {len(selected)} of {len(candidates)} dependencies, "
+            f"dropped {len(dropped)}"
+        )
+    return DependencySelection(selected, list(dropped.items()))
+
+
+DEPENDENCY_CRUISER_EXTENSIONS = (".js", ".ts", ".jsx", ".vue")
+"""
+Defines the file extensions dependency-cruiser is run on.
+
+See Also:
+    filter_files_for_dependency_cruiser: Function that filters files by these extensions
+"""
+
+STYLESHEET_EXTENSIONS = (".scss",)
+"""
+Defines the file extensions whose imports are extracted by the native SCSS extractor.
+
+See Also:
+    extract_stylesheet_dependencies: Function that extracts the SCSS imports
+"""
+
+PYTHON_EXTENSIONS = (".py",)
+"""
+Defines the file extensions whose imports are extracted by the native Python extractor.
+
+See Also:
+    extract_python_dependencies: Function that extracts the Python imports
+"""
+
+DEPENDENCY_EXTENSIONS = (
+    DEPENDENCY_CRUISER_EXTENSIONS + STYLESHEET_EXTENSIONS + PYTHON_EXTENSIONS
+)
+"""
+Defines the file extensions whose dependencies are added to the dependency graph.
+
+See Also:
+    filter_files_for_dependency_cruiser: Function that filters files by these extensions
+"""
 
 
 def filter_files_for_dependency_cruiser(
@@ -456,7 +4056,9 @@ def filter_files_for_dependency_cruiser(
     """
     Filters a list of files to retain only those with extensions valid for dependency-cruiser.
 
-    Valid extensions are provided as a tuple and include file types commonly used with dependency-cruiser.
+    Valid extensions are provided as a tuple and include file types commonly used with
+    dependency-cruiser, as well as stylesheets and Python files handled by the native
+    extractors.
 
     Args:
         files (List[Union[str, List[str]]]): A list of file paths or nested lists of file paths to filter.
@@ -467,7 +4069,7 @@ def filter_files_for_dependency_cruiser(
     Raises:
         This function does not explicitly raise any exceptions but logs a warning if no valid files are found.
     """
-    valid_extensions = (".js", ".ts", ".jsx", ".vue")
+    valid_extensions = DEPENDENCY_EXTENSIONS
 
     def is_valid_file(file):
         """
@@ -501,168 +4103,1250 @@ def filter_files_for_dependency_cruiser(
     return filtered_files
 
 
-def run_dependency_cruiser(files: List[str]) -> List[str]:
+def get_dependency_cruiser_package_command(package_dir: str) -> Optional[List[str]]:
+    """
+    Returns the command running the bin script of a dependency-cruiser package with node.
+
+    Args:
+        package_dir (str): The dependency-cruiser package directory.
+
+    Returns:
+        Optional[List[str]]: The command, or None if the directory does not contain
+        dependency-cruiser or node is not installed.
+    """
+    package = read_json_config(os.path.join(package_dir, "package.json"))
+    bin_entries = package.get("bin")
+    if isinstance(bin_entries, dict):
+        script = bin_entries.get("depcruise") or bin_entries.get("dependency-cruiser")
+    else:
+        script = bin_entries
+    node = shutil.which("node")
+    if not isinstance(script, str) or not node:
+        return None
+    return [node, os.path.join(package_dir, script)]
+
+
+def describe_dependency_cruiser_locations() -> str:
+    """
+    Describes where locate_dependency_cruiser looks for dependency-cruiser.
+
+    Returns:
+        str: The searched locations, in search order, for error messages.
+    """
+    configured = (
+        os.path.abspath(DEPENDENCY_CRUISER_PATH)
+        if DEPENDENCY_CRUISER_PATH
+        else "DEPENDENCY_CRUISER_PATH (not set)"
+    )
+    return (
+        f"node_modules/dependency-cruiser in {PROJECT_DIR} and its parent "
+        f"directories, the global npm installation (npm root -g), {configured}"
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def locate_dependency_cruiser() -> Optional[Tuple[str, ...]]:
+    """
+    Locates dependency-cruiser once per run.
+
+    dependency-cruiser is looked up in the node_modules directories of PROJECT_DIR and
+    its parents, then in the global npm installation, then at DEPENDENCY_CRUISER_PATH.
+
+    Returns:
+        Optional[Tuple[str, ...]]: The command prefix running dependency-cruiser, or
+        None if it is not installed.
+    """
+    directory = PROJECT_DIR
+    while True:
+        command = get_dependency_cruiser_package_command(
+            os.path.join(directory, "node_modules", "dependency-cruiser")
+        )
+        if command:
+            debug_log(f"Using local dependency-cruiser: {command}")
+            return tuple(command)
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            break
+        directory = parent
+
+    npm = shutil.which("npm.cmd" if sys.platform == "win32" else "npm")
+    if npm:
+        try:
+            global_root = subprocess.run(
+                [npm, "root", "-g"], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            global_root = ""
+        if global_root:
+            command = get_dependency_cruiser_package_command(
+                os.path.join(global_root, "dependency-cruiser")
+            )
+            if command:
+                debug_log(f"Using global dependency-cruiser: {command}")
+                return tuple(command)
+
+    if DEPENDENCY_CRUISER_PATH:
+        path = os.path.abspath(DEPENDENCY_CRUISER_PATH)
+        if os.path.isdir(path):
+            command = get_dependency_cruiser_package_command(path)
+        elif path.endswith((".js", ".mjs", ".cjs")):
+            node = shutil.which("node")
+            command = [node, path] if node else None
+        else:
+            command = [path]
+        if command:
+            debug_log(f"Using configured dependency-cruiser: {command}")
+            return tuple(command)
+        logger.warning(f"DEPENDENCY_CRUISER_PATH is not usable: {path}")
+    return None
+
+
+def get_argument_limit() -> int:
+    """
+    Returns the number of bytes available for the arguments of a subprocess.
+
+    Returns:
+        int: The command line length limit of the operating system, minus the size of
+        the environment and a safety margin.
+    """
+    if sys.platform == "win32":
+        # CreateProcess limits the whole command line to 32767 characters
+        return 32767 - 1024
+    try:
+        limit = os.sysconf("SC_ARG_MAX")
+    except (AttributeError, ValueError, OSError):
+        limit = 131072
+    if limit <= 0:
+        limit = 131072
+    environment = sum(len(key) + len(value) + 2 for key, value in os.environ.items())
+    return max(limit - environment - 4096, 4096)
+
+
+def chunk_arguments(
+    command: List[str], arguments: List[str], limit: Optional[int] = None
+) -> Iterator[List[str]]:
+    """
+    Splits arguments into chunks that fit on a command line with the given command.
+
+    Args:
+        command (List[str]): The command and options preceding the arguments.
+        arguments (List[str]): The arguments to split.
+        limit (Optional[int]): The available command line length in bytes. Defaults
+            to get_argument_limit().
+
+    Yields:
+        List[str]: The arguments of each command line, at least one per chunk.
+    """
+
+    def size(argument: str) -> int:
+        # Each argument also takes a terminator and a pointer in the argument vector
+        return len(os.fsencode(argument)) + 1 + 8
+
+    if limit is None:
+        limit = get_argument_limit()
+    available = limit - sum(size(argument) for argument in command)
+    chunk = []
+    chunk_size = 0
+    for argument in arguments:
+        argument_size = size(argument)
+        if chunk and chunk_size + argument_size > available:
+            yield chunk
+            chunk = []
+            chunk_size = 0
+        chunk.append(argument)
+        chunk_size += argument_size
+    if chunk:
+        yield chunk
+
+
+def run_dependency_cruiser(
+    files: List[str], max_depth: Optional[int] = None, use_cache: bool = False
+) -> Optional[Tuple[List[str], List[DependencyEdge]]]:
     """
     Executes the dependency-cruiser tool on a list of specified files and
     processes the output to extract file dependencies.
 
-    This function constructs a command to run dependency-cruiser, executes it,
-    and processes the stdout to extract dependencies. It logs errors if the
-    command execution fails or if the tool is not found.
+    This function constructs a command to run dependency-cruiser with JSON output,
+    executes it, and parses the output into dependency edges. Long file lists are split
+    into as few runs as the operating system's command line length limit allows. It
+    logs errors if the command execution fails or if the tool is not found.
 
     Args:
         files (List[str]): A list of file paths on which to run dependency-cruiser.
+        max_depth (Optional[int]): How many levels of dependencies to follow, or None
+            to follow all of them.
+        use_cache (bool): Whether to pass DEPENDENCY_CRUISER_CACHE_DIR to
+            dependency-cruiser's --cache option.
 
     Returns:
-        List[str]: A list of file dependencies identified by dependency-cruiser.
+        Optional[Tuple[List[str], List[DependencyEdge]]]: The cruised modules and
+        their dependencies, or None if dependency-cruiser could not be run.
 
     Raises:
         subprocess.CalledProcessError: If the subprocess running dependency-cruiser
                                         encounters an error.
-        FileNotFoundError: If the dependency-cruiser tool is not found in the system PATH.
+        FileNotFoundError: If node or the dependency-cruiser tool is not found.
 
     See Also:
-        process_dependency_cruiser_output: A helper function used to process the raw output.
+        locate_dependency_cruiser: Locates the dependency-cruiser installation.
+        process_dependency_cruiser_output: A helper function used to parse the output.
         log_dependency_cruiser_results: Logs results of the dependency extraction process.
     """
-    dependency_cruiser_cmd = "npx.cmd" if sys.platform == "win32" else "npx"
+    dependency_cruiser_cmd = locate_dependency_cruiser()
+    if not dependency_cruiser_cmd:
+        logger.error(
+            "Error: dependency-cruiser not found. Searched: "
+            f"{describe_dependency_cruiser_locations()}."
+        )
+        logger.error(
+            "You can install it by running: npm install -g dependency-cruiser, "
+            "or point DEPENDENCY_CRUISER_PATH at an existing installation."
+        )
+        return None
 
-    cmd = [
-        dependency_cruiser_cmd,
-        "dependency-cruiser",
+    cmd = list(dependency_cruiser_cmd) + [
         "--no-config",
         "--exclude",
         "node_modules",
         "-T",
-        "text",
-    ] + files
+        "json",
+    ]
+    if max_depth is not None:
+        cmd.extend(["--max-depth", str(max_depth)])
+    if use_cache and DEPENDENCY_CRUISER_CACHE_DIR:
+        cmd.extend(["--cache", DEPENDENCY_CRUISER_CACHE_DIR])
 
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        raw_output = result.stdout.strip().splitlines()
-        dependencies = process_dependency_cruiser_output(raw_output)
-        log_dependency_cruiser_results(raw_output, dependencies)
-        return dependencies
+        modules = {}
+        edges = {}
+        for chunk in chunk_arguments(cmd, files):
+            result = subprocess.run(
+                cmd + chunk,
+                capture_output=True,
+                text=True,
+                encoding="utf-8",
+                check=True,
+            )
+            chunk_modules, chunk_edges = process_dependency_cruiser_output(
+                result.stdout
+            )
+            modules.update(dict.fromkeys(chunk_modules))
+            for edge in chunk_edges:
+                edges.setdefault((edge.source, edge.target), edge)
+        log_dependency_cruiser_results(list(edges.values()))
+        return list(modules), list(edges.values())
     except subprocess.CalledProcessError as e:
         logger.error(f"Error running dependency-cruiser: {e}")
+        if e.stderr:
+            logger.error(e.stderr.strip())
+    except FileNotFoundError:
         logger.error(
-            "Please ensure dependency-cruiser is installed and in your system PATH."
+            "Error: dependency-cruiser could not be started with "
+            f"{' '.join(dependency_cruiser_cmd)}. Searched: "
+            f"{describe_dependency_cruiser_locations()}."
         )
-        logger.error("You can install it by running: npm install -g dependency-cruiser")
-    except FileNotFoundError:
         logger.error(
-            "Error: dependency-cruiser not found. Please install it and ensure it's in your system PATH."
+            "You can install it by running: npm install -g dependency-cruiser, "
+            "or point DEPENDENCY_CRUISER_PATH at an existing installation."
+        )
+    except ValueError as e:
+        logger.error(f"Could not parse the dependency-cruiser output: {e}")
+
+    return None
+
+
+def process_dependency_cruiser_output(
+    output: str,
+) -> Tuple[List[str], List[DependencyEdge]]:
+    """
+    Parses the JSON output of dependency-cruiser into modules and dependency edges.
+
+    The output is parsed in one pass. Module paths are resolved to absolute paths,
+    while core modules and imports that could not be resolved keep their names.
+
+    Args:
+        output (str): The output of dependency-cruiser with "-T json".
+
+    Returns:
+        Tuple[List[str], List[DependencyEdge]]: The graph keys of the cruised modules,
+        and the dependencies of these modules.
+
+    Raises:
+        ValueError: If the output is not valid JSON.
+    """
+    result = json.loads(output)
+    modules = []
+    edges = []
+    for module in result.get("modules", []):
+        is_file = not (module.get("coreModule") or module.get("couldNotResolve"))
+        source = DependencyGraph.module_key(module["source"], is_file)
+        modules.append(source)
+        for dependency in module.get("dependencies", []):
+            core = dependency.get("coreModule", False)
+            could_not_resolve = dependency.get("couldNotResolve", False)
+            dependency_types = dependency.get("dependencyTypes", [])
+            edges.append(
+                DependencyEdge(
+                    source=source,
+                    target=DependencyGraph.module_key(
+                        dependency["resolved"], not (core or could_not_resolve)
+                    ),
+                    module=dependency.get("module", dependency["resolved"]),
+                    core=core,
+                    npm=any(kind.startswith("npm") for kind in dependency_types),
+                    could_not_resolve=could_not_resolve,
+                    dynamic=dependency.get("dynamic", False),
+                )
+            )
+    debug_log(f"Parsed {len(modules)} modules and {len(edges)} dependencies")
+    return modules, edges
+
+
+def log_dependency_cruiser_results(edges: List[DependencyEdge]):
+    """
+    Logs the dependencies found by dependency-cruiser if in DRY_RUN mode.
+
+    This function checks if the DRY_RUN flag is enabled and, if so, writes each
+    dependency with its flags to the dry run log file.
+
+    Args:
+        edges (List[DependencyEdge]): The dependencies found by dependency-cruiser.
+
+    Raises:
+        This function does not explicitly raise any exceptions
+        but may propagate exceptions from underlying file operations.
+    """
+    if DRY_RUN:
+        log_file_path = os.path.join(os.path.dirname(__file__), "aider_all_dry_run.log")
+        with open(log_file_path, "a", encoding="utf-8") as log_file:
+            log_file.write("dependency-cruiser dependencies:\n")
+            for edge in edges:
+                flags = [
+                    flag
+                    for flag in ("core", "npm", "could_not_resolve", "dynamic")
+                    if getattr(edge, flag)
+                ]
+                suffix = f" ({', '.join(flags)})" if flags else ""
+                log_file.write(f"{edge.source} → {edge.target}{suffix}\n")
+
+
+JS_SOURCE_TOKENS = re.compile(
+    r"""("(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`)"""
+    r"|(/\*.*?\*/|//[^\n]*)",
+    re.DOTALL,
+)
+JS_IMPORT_PATTERNS = [
+    (
+        re.compile(
+            r"""\bimport\s+(?:type\s+)?(?:[\w*{}\s,$]+?\s+from\s*)?(['"])(?P<module>[^'"\n]+)\1"""
+        ),
+        False,
+    ),
+    (
+        re.compile(
+            r"""\bexport\s+(?:type\s+)?(?:\*(?:\s+as\s+[\w$]+)?|\{[^}]*\})\s*from\s*(['"])(?P<module>[^'"\n]+)\1"""
+        ),
+        False,
+    ),
+    (re.compile(r"""\brequire\s*\(\s*(['"])(?P<module>[^'"\n]+)\1\s*\)"""), False),
+    (re.compile(r"""\bimport\s*\(\s*(['"])(?P<module>[^'"\n]+)\1\s*\)"""), True),
+]
+VUE_SCRIPT_BLOCK = re.compile(r"<script\b[^>]*>(.*?)</script>", re.DOTALL | re.I)
+NODE_CORE_MODULES = frozenset(
+    [
+        "assert",
+        "async_hooks",
+        "buffer",
+        "child_process",
+        "cluster",
+        "console",
+        "constants",
+        "crypto",
+        "dgram",
+        "dns",
+        "domain",
+        "events",
+        "fs",
+        "http",
+        "http2",
+        "https",
+        "inspector",
+        "module",
+        "net",
+        "os",
+        "path",
+        "perf_hooks",
+        "process",
+        "punycode",
+        "querystring",
+        "readline",
+        "repl",
+        "stream",
+        "string_decoder",
+        "timers",
+        "tls",
+        "trace_events",
+        "tty",
+        "url",
+        "util",
+        "v8",
+        "vm",
+        "wasi",
+        "worker_threads",
+        "zlib",
+    ]
+)
+JS_RESOLVE_EXTENSIONS = (".js", ".ts", ".jsx", ".tsx", ".vue", ".mjs", ".cjs", ".json")
+SCSS_SOURCE_TOKENS = re.compile(
+    r"""("(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')|(/\*.*?\*/|(?<![:\w])//[^\n]*)""",
+    re.DOTALL,
+)
+SCSS_IMPORT_RULE = re.compile(r"@(import|use|forward)\s+([^;{}]+)")
+SCSS_URL = re.compile(r"""(['"])([^'"\n]+)\1""")
+VUE_STYLE_BLOCK = re.compile(r"<style\b([^>]*)>(.*?)</style>", re.DOTALL | re.I)
+SCSS_RESOLVE_EXTENSIONS = (".scss", ".sass", ".css")
+
+
+def strip_js_comments(source: str) -> str:
+    """
+    Removes the comments from JavaScript source, keeping string literals intact.
+
+    Args:
+        source (str): The source code.
+
+    Returns:
+        str: The source code without comments.
+    """
+    return JS_SOURCE_TOKENS.sub(lambda match: match.group(1) or " ", source)
+
+
+def extract_imports(path: str) -> List[Tuple[str, bool]]:
+    """
+    Extracts the imported module names of a JavaScript, TypeScript or Vue file.
+
+    ES imports and re-exports, require calls and dynamic imports are recognized. Only
+    the <script> blocks of Vue single file components are read. This function runs in
+    worker processes of the native extractor.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        List[Tuple[str, bool]]: The imported module names in source order, each with
+        whether it is imported dynamically. Unreadable files have no imports.
+    """
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            source = f.read()
+    except OSError:
+        return []
+    if path.lower().endswith(".vue"):
+        source = "\n".join(VUE_SCRIPT_BLOCK.findall(source))
+    source = strip_js_comments(source)
+    # Import statements quoted inside string literals are not imports
+    strings = [
+        match.span() for match in JS_SOURCE_TOKENS.finditer(source) if match.group(1)
+    ]
+    string_starts = [start for start, _ in strings]
+    found = []
+    for pattern, dynamic in JS_IMPORT_PATTERNS:
+        for match in pattern.finditer(source):
+            index = bisect.bisect_right(string_starts, match.start()) - 1
+            if index >= 0 and match.start() < strings[index][1]:
+                continue
+            found.append((match.start(), match.group("module"), dynamic))
+    return [(module, dynamic) for _, module, dynamic in sorted(found)]
+
+
+def extract_stylesheet_imports(path: str) -> List[str]:
+    """
+    Extracts the imported stylesheets of an SCSS file or of the SCSS blocks of a Vue file.
+
+    @import, @use and @forward rules are recognized. Plain CSS imports, i.e. url()
+    imports, imports of .css files and of URLs, are not stylesheet dependencies and are
+    skipped. This function runs in worker processes of the native extractor.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        List[str]: The imported URLs in source order. Unreadable files have no imports.
+    """
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            source = f.read()
+    except OSError:
+        return []
+    if path.lower().endswith(".vue"):
+        source = "\n".join(
+            block
+            for attributes, block in VUE_STYLE_BLOCK.findall(source)
+            if re.search(r"""\blang\s*=\s*['"]?scss\b""", attributes, re.I)
+        )
+    source = SCSS_SOURCE_TOKENS.sub(lambda match: match.group(1) or " ", source)
+    strings = [
+        match.span() for match in SCSS_SOURCE_TOKENS.finditer(source) if match.group(1)
+    ]
+    string_starts = [start for start, _ in strings]
+    imports = []
+    for match in SCSS_IMPORT_RULE.finditer(source):
+        index = bisect.bisect_right(string_starts, match.start()) - 1
+        if index >= 0 and match.start() < strings[index][1]:
+            continue
+        rule, arguments = match.groups()
+        arguments = re.sub(r"url\([^)]*\)", "", arguments)
+        urls = [url for _, url in SCSS_URL.findall(arguments)]
+        if rule != "import":
+            # @use and @forward load one module, followed by "as" or "with" clauses
+            urls = urls[:1]
+        for url in urls:
+            if url.lower().endswith(".css") or url.startswith(
+                ("http://", "https://", "//")
+            ):
+                continue
+            imports.append(url)
+    return imports
+
+
+def extract_python_imports(
+    path: str,
+) -> Tuple[Optional[str], List[Tuple[str, int, List[str]]]]:
+    """
+    Extracts the imports of a Python file from its syntax tree.
+
+    All import statements are recognized, including those inside functions and
+    conditional blocks. This function runs in worker processes of the native extractor.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        Tuple[Optional[str], List[Tuple[str, int, List[str]]]]: The hash of the file
+        content, or None if it cannot be read, and the imports in source order. Each
+        import is given as the module name, the number of leading dots of relative
+        imports and the names imported from the module. Files that cannot be parsed,
+        including files nested too deeply or too large for the parser, have no
+        imports.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None, []
+    try:
+        tree = ast.parse(data, filename=path)
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        # Invalid, deeply nested or huge files must not abort the graph build
+        return hash_blob(data), []
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                imports.append((node.lineno, node.col_offset, alias.name, 0, []))
+        elif isinstance(node, ast.ImportFrom):
+            names = [alias.name for alias in node.names if alias.name != "*"]
+            imports.append(
+                (node.lineno, node.col_offset, node.module or "", node.level, names)
+            )
+    return hash_blob(data), [entry[2:] for entry in sorted(imports)]
+
+
+def read_json_config(path: str) -> dict:
+    """
+    Reads a JSON configuration file that may contain comments and trailing commas.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        dict: The parsed configuration, or an empty dict if it cannot be read.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            text = strip_js_comments(f.read())
+        return json.loads(re.sub(r",(\s*[}\]])", r"\1", text))
+    except (OSError, ValueError):
+        return {}
+
+
+class ModuleResolver:
+    """
+    Resolves imported module names to files like Node.js and bundlers do.
+
+    Relative imports are resolved against the importing file, trying the extensions of
+    JS_RESOLVE_EXTENSIONS and index files of directories. Aliases map import prefixes
+    to directories. Other bare names are core modules or npm packages, which are
+    resolved through the node_modules directories above the importing file.
+
+    Attributes:
+        aliases (List[Tuple[str, List[str]]]): Alias patterns and their target
+            patterns, where "*" stands for the rest of the module name.
+    """
+
+    def __init__(self, aliases: List[Tuple[str, List[str]]]):
+        # Longer patterns are more specific, so they are tried first
+        self.aliases = sorted(aliases, key=lambda alias: -len(alias[0]))
+
+    @classmethod
+    def for_project(cls) -> "ModuleResolver":
+        """
+        Builds the resolver with the aliases configured for the project.
+
+        Aliases are read from compilerOptions.paths of tsconfig.json or jsconfig.json,
+        from resolve.alias entries of webpack.config.js and vue.config.js written as
+        path.resolve(__dirname, "...") or path.join(__dirname, "..."), and from
+        DEPENDENCY_ALIASES.
+
+        Returns:
+            ModuleResolver: The resolver.
+        """
+        aliases = []
+        for name in ("tsconfig.json", "jsconfig.json"):
+            options = read_json_config(os.path.join(PROJECT_DIR, name)).get(
+                "compilerOptions", {}
+            )
+            base = os.path.join(PROJECT_DIR, options.get("baseUrl", "."))
+            for pattern, targets in options.get("paths", {}).items():
+                aliases.append(
+                    (pattern, [os.path.join(base, target) for target in targets])
+                )
+        alias_entry = re.compile(
+            r"""['"]?([@~$\w][\w@~$/.-]*)['"]?\s*:\s*path\.(?:resolve|join)\(\s*"""
+            r"""__dirname\s*,\s*(['"])([^'"]+)\2\s*\)"""
+        )
+        configured = {}
+        for name in ("webpack.config.js", "vue.config.js"):
+            try:
+                with open(os.path.join(PROJECT_DIR, name), "r", encoding="utf-8") as f:
+                    source = strip_js_comments(f.read())
+            except OSError:
+                continue
+            for prefix, _, target in alias_entry.findall(source):
+                configured[prefix] = os.path.join(PROJECT_DIR, target)
+        for prefix, target in DEPENDENCY_ALIASES.items():
+            configured[prefix] = os.path.join(PROJECT_DIR, target)
+        for prefix, target in configured.items():
+            aliases.append((prefix, [target]))
+            aliases.append((prefix + "/*", [os.path.join(target, "*")]))
+        return cls(aliases)
+
+    @staticmethod
+    def resolve_path(base: str) -> Optional[str]:
+        """
+        Resolves a path without extension to a file.
+
+        Args:
+            base (str): The absolute path as imported.
+
+        Returns:
+            Optional[str]: The file, or None if none exists.
+        """
+        if os.path.isfile(base):
+            return base
+        for extension in JS_RESOLVE_EXTENSIONS:
+            if os.path.isfile(base + extension):
+                return base + extension
+        if os.path.isdir(base):
+            package = read_json_config(os.path.join(base, "package.json"))
+            main = package.get("module") or package.get("main")
+            if isinstance(main, str):
+                resolved = ModuleResolver.resolve_path(os.path.join(base, main))
+                if resolved:
+                    return resolved
+            for extension in JS_RESOLVE_EXTENSIONS:
+                index = os.path.join(base, "index" + extension)
+                if os.path.isfile(index):
+                    return index
+        return None
+
+    @staticmethod
+    def resolve_stylesheet_path(base: str) -> Optional[str]:
+        """
+        Resolves a stylesheet URL to a file like Sass does.
+
+        Partials prefixed with an underscore, the extensions of SCSS_RESOLVE_EXTENSIONS
+        and index files of directories are tried.
+
+        Args:
+            base (str): The absolute path as imported.
+
+        Returns:
+            Optional[str]: The file, or None if none exists.
+        """
+        directory, name = os.path.split(base)
+        if os.path.splitext(name)[1].lower() in SCSS_RESOLVE_EXTENSIONS:
+            candidates = ["_" + name, name]
+        else:
+            candidates = [
+                prefix + name + extension
+                for extension in SCSS_RESOLVE_EXTENSIONS
+                for prefix in ("_", "")
+            ] + [
+                os.path.join(name, prefix + "index" + extension)
+                for extension in SCSS_RESOLVE_EXTENSIONS
+                for prefix in ("_", "")
+            ]
+        for candidate in candidates:
+            path = os.path.join(directory, candidate)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def resolve_alias(
+        self,
+        module: str,
+        resolve_path: Optional[Callable[[str], Optional[str]]] = None,
+    ) -> Optional[str]:
+        """
+        Resolves a module name through the aliases.
+
+        Args:
+            module (str): The imported module name.
+            resolve_path (Optional[Callable[[str], Optional[str]]]): Resolves the
+                aliased path to a file. Defaults to resolve_path.
+
+        Returns:
+            Optional[str]: The file, or None if no alias applies or resolves.
+        """
+        if resolve_path is None:
+            resolve_path = self.resolve_path
+        for pattern, targets in self.aliases:
+            prefix, star, suffix = pattern.partition("*")
+            if star:
+                if not (
+                    module.startswith(prefix)
+                    and module.endswith(suffix)
+                    and len(module) >= len(prefix) + len(suffix)
+                ):
+                    continue
+                rest = module[len(prefix) : len(module) - len(suffix)]
+            elif module != pattern:
+                continue
+            else:
+                rest = ""
+            for target in targets:
+                resolved = resolve_path(os.path.normpath(target.replace("*", rest, 1)))
+                if resolved:
+                    return resolved
+        return None
+
+    def resolve(self, source: str, module: str, dynamic: bool) -> DependencyEdge:
+        """
+        Resolves an import of a file.
+
+        Args:
+            source (str): Absolute path of the importing file.
+            module (str): The imported module name.
+            dynamic (bool): Whether the module is imported dynamically.
+
+        Returns:
+            DependencyEdge: The dependency.
+        """
+        edge = functools.partial(DependencyEdge, source, module=module, dynamic=dynamic)
+        if module.startswith((".", "/")):
+            resolved = self.resolve_path(
+                os.path.normpath(os.path.join(os.path.dirname(source), module))
+            )
+            if resolved:
+                return edge(resolved)
+            return edge(module, could_not_resolve=True)
+
+        resolved = self.resolve_alias(module)
+        if resolved:
+            return edge(resolved)
+
+        name = module[5:] if module.startswith("node:") else module
+        if name.split("/")[0] in NODE_CORE_MODULES:
+            return edge(module, core=True)
+
+        directory = os.path.dirname(source)
+        while True:
+            candidate = os.path.join(directory, "node_modules", module)
+            resolved = self.resolve_path(candidate)
+            if resolved:
+                return edge(resolved, npm=True)
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                return edge(module, could_not_resolve=True)
+            directory = parent
+
+    def resolve_stylesheet(self, source: str, module: str) -> DependencyEdge:
+        """
+        Resolves an SCSS import of a file.
+
+        Built-in Sass modules such as "sass:math" are core modules. URLs prefixed with
+        "~" are looked up in node_modules only, as webpack's sass-loader does.
+
+        Args:
+            source (str): Absolute path of the importing file.
+            module (str): The imported URL.
+
+        Returns:
+            DependencyEdge: The dependency.
+        """
+        edge = functools.partial(DependencyEdge, source, module=module)
+        if module.startswith("sass:"):
+            return edge(module, core=True)
+
+        if not module.startswith("~"):
+            resolved = self.resolve_stylesheet_path(
+                os.path.normpath(os.path.join(os.path.dirname(source), module))
+            )
+            if resolved:
+                return edge(resolved)
+            resolved = self.resolve_alias(module, self.resolve_stylesheet_path)
+            if resolved:
+                return edge(resolved)
+            for load_path in SCSS_LOAD_PATHS:
+                resolved = self.resolve_stylesheet_path(
+                    os.path.normpath(os.path.join(PROJECT_DIR, load_path, module))
+                )
+                if resolved:
+                    return edge(resolved)
+
+        name = module.lstrip("~")
+        directory = os.path.dirname(source)
+        while True:
+            candidate = os.path.join(directory, "node_modules", name)
+            resolved = self.resolve_stylesheet_path(candidate)
+            if resolved:
+                return edge(resolved, npm=True)
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                return edge(module, could_not_resolve=True)
+            directory = parent
+
+    @staticmethod
+    def resolve_python_path(base: str) -> Optional[str]:
+        """
+        Resolves the path of a Python module to its file.
+
+        Args:
+            base (str): The absolute path of the module, without extension.
+
+        Returns:
+            Optional[str]: The module file or the __init__.py of the package, or None
+            if neither exists.
+        """
+        for candidate in (base + ".py", os.path.join(base, "__init__.py")):
+            if os.path.isfile(candidate):
+                return candidate
+        return None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get_python_roots(directory: str) -> Tuple[str, ...]:
+        """
+        Returns the directories absolute imports of a Python file are resolved against.
+
+        Args:
+            directory (str): Absolute path of the directory of the importing file.
+
+        Returns:
+            Tuple[str, ...]: The directory above the top-level package containing the
+            directory, then PYTHON_PACKAGE_ROOTS, PROJECT_DIR and its src directory.
+        """
+        top = directory
+        while os.path.isfile(os.path.join(top, "__init__.py")):
+            parent = os.path.dirname(top)
+            if parent == top:
+                break
+            top = parent
+        roots = [top]
+        roots += [os.path.join(PROJECT_DIR, root) for root in PYTHON_PACKAGE_ROOTS]
+        roots += [PROJECT_DIR, os.path.join(PROJECT_DIR, "src")]
+        return tuple(dict.fromkeys(os.path.normpath(root) for root in roots))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def find_installed_python_module(name: str) -> Optional[str]:
+        """
+        Finds the file of an installed top-level Python module without importing it.
+
+        Args:
+            name (str): The top-level module name.
+
+        Returns:
+            Optional[str]: The module file, or None if it is not installed.
+        """
+        try:
+            spec = importlib.util.find_spec(name)
+        except (ImportError, ValueError):
+            return None
+        if spec is None or not spec.origin or not os.path.isfile(spec.origin):
+            return None
+        return spec.origin
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def is_python_stdlib_module(name: str) -> bool:
+        """
+        Tells whether a top-level Python module belongs to the standard library.
+
+        Python 3.10 and later list the standard library modules. On older versions, a
+        module belongs to it if it is built in or installed in the standard library
+        directory rather than in site-packages, which is found without importing it.
+
+        Args:
+            name (str): The top-level module name.
+
+        Returns:
+            bool: True if the module is part of the standard library.
+        """
+        if hasattr(sys, "stdlib_module_names"):
+            return name in sys.stdlib_module_names
+        try:
+            spec = importlib.util.find_spec(name)
+        except (ImportError, ValueError):
+            return False
+        if spec is None or not spec.origin:
+            return False
+        if spec.origin in ("built-in", "frozen"):
+            return True
+        origin = os.path.realpath(spec.origin)
+        paths = sysconfig.get_paths()
+
+        def contains(key: str) -> bool:
+            return origin.startswith(os.path.realpath(paths[key]) + os.sep)
+
+        in_stdlib = contains("stdlib") or contains("platstdlib")
+        in_site_packages = (
+            contains("purelib")
+            or contains("platlib")
+            or "site-packages" in origin.split(os.sep)
+            or "dist-packages" in origin.split(os.sep)
         )
-        logger.error("You can install it by running: npm install -g dependency-cruiser")
+        return in_stdlib and not in_site_packages
 
-    return []
+    def resolve_python(
+        self, source: str, module: str, level: int, names: List[str]
+    ) -> List[DependencyEdge]:
+        """
+        Resolves an import statement of a Python file.
+
+        Relative imports are resolved against the package of the importing file,
+        absolute imports against its package roots. Names imported from a package
+        resolve to their submodules where those exist, and to the package otherwise.
+        Standard library modules are core modules, other installed modules resolve to
+        their files like npm packages.
+
+        Args:
+            source (str): Absolute path of the importing file.
+            module (str): The module name, empty for "from . import name".
+            level (int): The number of leading dots of a relative import.
+            names (List[str]): The names imported with "from ... import".
+
+        Returns:
+            List[DependencyEdge]: The dependencies of the statement.
+        """
+        written = "." * level + module
+        parts = module.split(".") if module else []
+        if level:
+            base = os.path.dirname(source)
+            for _ in range(level - 1):
+                base = os.path.dirname(base)
+            bases = [os.path.join(base, *parts)]
+        else:
+            bases = [
+                os.path.join(root, *parts)
+                for root in self.get_python_roots(os.path.dirname(source))
+            ]
+
+        for base in bases:
+            submodules = [
+                self.resolve_python_path(os.path.join(base, name)) for name in names
+            ]
+            targets = [
+                submodule
+                for submodule in submodules
+                if submodule and submodule != source
+            ]
+            if len(targets) < len(names) or not targets:
+                package = self.resolve_python_path(base)
+                if package and package != source:
+                    targets.append(package)
+            if targets:
+                return [
+                    DependencyEdge(source, target, written)
+                    for target in dict.fromkeys(targets)
+                ]
+
+        if not level:
+            top = parts[0]
+            if self.is_python_stdlib_module(top):
+                return [DependencyEdge(source, module, written, core=True)]
+            installed = self.find_installed_python_module(top)
+            if installed:
+                return [DependencyEdge(source, installed, written, npm=True)]
+        return [DependencyEdge(source, written, written, could_not_resolve=True)]
+
+
+@functools.lru_cache(maxsize=None)
+def get_module_resolver() -> ModuleResolver:
+    """
+    Returns the module resolver of the project, building it on first use.
+
+    Returns:
+        ModuleResolver: The shared module resolver.
+    """
+    return ModuleResolver.for_project()
 
 
-def process_dependency_cruiser_output(raw_output: List[str]) -> List[str]:
+def read_imports(extract: Callable[[str], list], paths: List[str]) -> List[list]:
+    """
+    Reads the imports of files, in DEPENDENCY_WORKERS processes for large batches.
+
+    Args:
+        extract (Callable[[str], list]): Extracts the imports of one file. It must be a
+            module level function, so it can be run in worker processes.
+        paths (List[str]): The files to read.
+
+    Returns:
+        List[list]: The imports of each file, in the order of the paths.
+    """
+    # Small batches are read in process, where they finish before a pool starts
+    if DEPENDENCY_WORKERS <= 1 or len(paths) < 32:
+        return [extract(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=DEPENDENCY_WORKERS) as pool:
+        return list(
+            pool.map(
+                extract,
+                paths,
+                chunksize=max(1, len(paths) // (DEPENDENCY_WORKERS * 4)),
+            )
+        )
+
+
+def extract_dependencies(
+    files: List[str], max_depth: Optional[int] = None
+) -> Tuple[List[str], List[DependencyEdge]]:
+    """
+    Extracts the dependencies of files with the native Python extractor.
+
+    Like dependency-cruiser, the dependencies of the extracted files are followed up
+    to max_depth levels, except those in node_modules. The imports of each level are
+    read in parallel by DEPENDENCY_WORKERS processes.
+
+    Args:
+        files (List[str]): The files to extract the dependencies of.
+        max_depth (Optional[int]): How many levels of dependencies to follow, or None
+            to follow all of them.
+
+    Returns:
+        Tuple[List[str], List[DependencyEdge]]: The graph keys of the extracted
+        modules, and their dependencies.
     """
-    Processes and extracts dependencies from the given raw output of dependency-cruiser.
+    resolver = get_module_resolver()
+    pending = list(dict.fromkeys(os.path.abspath(file) for file in files))
+    visited = set(pending)
+    modules = []
+    edges = []
+    depth = 0
+    while pending:
+        imports = read_imports(extract_imports, pending)
+        next_pending = []
+        for source, source_imports in zip(pending, imports):
+            modules.append(source)
+            targets = set()
+            for module, dynamic in source_imports:
+                edge = resolver.resolve(source, module, dynamic)
+                if edge.target in targets:
+                    continue
+                targets.add(edge.target)
+                edges.append(edge)
+                if not edge.is_file or edge.npm or edge.target in visited:
+                    continue
+                visited.add(edge.target)
+                if edge.target.lower().endswith(DEPENDENCY_CRUISER_EXTENSIONS):
+                    next_pending.append(edge.target)
+                elif max_depth is None or depth + 1 < max_depth:
+                    # Other files, such as stylesheets, have no dependencies to follow
+                    modules.append(edge.target)
+        depth += 1
+        if max_depth is not None and depth >= max_depth:
+            break
+        pending = next_pending
+    return modules, edges
+
+
+def extract_stylesheet_dependencies(
+    files: List[str], max_depth: Optional[int] = None
+) -> Tuple[List[str], List[DependencyEdge]]:
+    """
+    Extracts the SCSS imports of stylesheets and Vue files with the native extractor.
 
-    This function takes in raw output strings from the dependency-cruiser tool and extracts
-    the dependencies using predefined markers. It handles decoding and processing of lines to
-    ensure valid dependency pairs are identified. Any issues with malformed lines will result
-    in warnings being logged.
+    The imported stylesheets are followed up to max_depth levels, except those in
+    node_modules, like the dependencies of scripts.
 
     Args:
-        raw_output (List[str]): The raw lines of output as strings from the dependency-cruiser tool.
+        files (List[str]): The SCSS and Vue files to extract the imports of.
+        max_depth (Optional[int]): How many levels of imports to follow, or None to
+            follow all of them.
 
     Returns:
-        List[str]: A list of unique dependencies extracted from the input, retaining order for compatibility.
-
-    Raises:
-        ValueError: Issues related to malformed lines or invalid source/target pairs are logged as warnings.
+        Tuple[List[str], List[DependencyEdge]]: The graph keys of the extracted
+        modules, and their dependencies.
     """
-    logger.debug("Entering method: process_dependency_cruiser_output")
-
-    if not raw_output:
-        logger.warning("Empty raw output from dependency-cruiser.")
-        return []
+    resolver = get_module_resolver()
+    pending = list(dict.fromkeys(os.path.abspath(file) for file in files))
+    visited = set(pending)
+    modules = []
+    edges = []
+    depth = 0
+    while pending:
+        imports = read_imports(extract_stylesheet_imports, pending)
+        next_pending = []
+        for source, source_imports in zip(pending, imports):
+            modules.append(source)
+            targets = set()
+            for module in source_imports:
+                edge = resolver.resolve_stylesheet(source, module)
+                if edge.target in targets:
+                    continue
+                targets.add(edge.target)
+                edges.append(edge)
+                if edge.is_file and not edge.npm and edge.target not in visited:
+                    visited.add(edge.target)
+                    next_pending.append(edge.target)
+        depth += 1
+        if max_depth is not None and depth >= max_depth:
+            break
+        pending = next_pending
+    return modules, edges
+
+
+_python_imports: Dict[str, List[Tuple[str, int, List[str]]]] = {}
+_python_file_hashes: Dict[str, Tuple[int, int, Optional[str]]] = {}
+
+
+def extract_python_dependencies(
+    files: List[str], max_depth: Optional[int] = None
+) -> Tuple[List[str], List[DependencyEdge]]:
+    """
+    Extracts the imports of Python files with the native extractor.
 
-    dependencies = set()  # Use a set to avoid duplicates
-    logger.debug(
-        f"Raw output from dependency-cruiser received: {len(raw_output)} lines"
-    )
+    The imports of each level are parsed in parallel by DEPENDENCY_WORKERS processes,
+    and cached per file content hash for the rest of the run, so files that are
+    unchanged since they were parsed are not read again. The imported project modules
+    are followed up to max_depth levels, installed packages are not.
 
-    for line in raw_output:
-        line_clean = line.encode("utf-8", "ignore").decode("utf-8")
-        logger.debug(f"Processing line: {line_clean}")
+    Args:
+        files (List[str]): The Python files to extract the imports of.
+        max_depth (Optional[int]): How many levels of imports to follow, or None to
+            follow all of them.
 
-        # Handle non-standard or malformed lines using safer regex or string matching
-        try:
-            if " → " in line_clean or " â†’ " in line_clean:
-                arrow = " â†’ " if " â†’ " in line_clean else " → "
-                source, target = map(str.strip, line_clean.rsplit(arrow, 1))
-                if source and target:
-                    dependencies.update([source, target])
-                    logger.debug(
-                        f"Extracted dependency pair: (source: {source}, target: {target})"
-                    )
-                else:
-                    raise ValueError(
-                        f"Invalid source/target pair: source='{source}', target='{target}'"
-                    )
+    Returns:
+        Tuple[List[str], List[DependencyEdge]]: The graph keys of the extracted
+        modules, and their dependencies.
+    """
+    resolver = get_module_resolver()
+    pending = list(dict.fromkeys(os.path.abspath(file) for file in files))
+    visited = set(pending)
+    modules = []
+    edges = []
+    depth = 0
+    while pending:
+        imports = {}
+        unread = []
+        for path in pending:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                imports[path] = []
+                continue
+            known = _python_file_hashes.get(path)
+            if known and known[2] and known[:2] == (stat.st_mtime_ns, stat.st_size):
+                imports[path] = _python_imports[known[2]]
             else:
-                raise ValueError(
-                    f"Line did not contain the valid arrow separator: {line_clean}"
+                _python_file_hashes[path] = (stat.st_mtime_ns, stat.st_size, None)
+                unread.append(path)
+        for path, (content_hash, path_imports) in zip(
+            unread, read_imports(extract_python_imports, unread)
+        ):
+            imports[path] = path_imports
+            if content_hash is not None:
+                _python_imports[content_hash] = path_imports
+                _python_file_hashes[path] = _python_file_hashes[path][:2] + (
+                    content_hash,
                 )
-        except ValueError as ve:
-            logger.warning(f"Failed to process line: {ve}")
-
-    sanitized_output = list(
-        dependencies
-    )  # Convert back to list to preserve API compatibility
-    if sanitized_output:
-        debug_log(f"Sanitized dependency-cruiser output: {sanitized_output}")
-    else:
-        logger.warning("No valid dependencies found in the dependency-cruiser output.")
+            else:
+                del _python_file_hashes[path]
+
+        next_pending = []
+        for source in pending:
+            modules.append(source)
+            targets = set()
+            for module, level, names in imports[source]:
+                for edge in resolver.resolve_python(source, module, level, names):
+                    if edge.target in targets:
+                        continue
+                    targets.add(edge.target)
+                    edges.append(edge)
+                    if edge.is_file and not edge.npm and edge.target not in visited:
+                        visited.add(edge.target)
+                        next_pending.append(edge.target)
+        depth += 1
+        if max_depth is not None and depth >= max_depth:
+            break
+        pending = next_pending
+    return modules, edges
+
+
+def select_model() -> Optional[str]:
+    """
+    Selects the model for the next aider command according to the LLM setting.
 
-    logger.debug("Exiting method: process_dependency_cruiser_output")
-    return sanitized_output
+    Returns:
+        Optional[str]: The model name, or None to use aider's default model.
 
+    See Also:
+        LLM: Setting that determines how the model is selected
+        MODELS: List of models used by the "random" and "turn-based" settings
+    """
+    if LLM == "random":
+        return random.choice(MODELS)
+    if LLM == "turn-based":
+        model = MODELS[MODEL_TURN.value % len(MODELS)]
+        MODEL_TURN.value += 1
+        return model
+    if LLM == "default":
+        # For "default", we don't set a model, using aider's default
+        return None
+    return LLM
+
+
+def get_candidate_models() -> List[Optional[str]]:
+    """
+    Returns every model that select_model may choose with the current LLM setting.
 
-def log_dependency_cruiser_results(raw_output: List[str], sanitized_output: List[str]):
+    Returns:
+        List[Optional[str]]: The candidate models; None stands for aider's default model.
     """
-    Logs the results of the dependency-cruiser processing if in DRY_RUN mode.
+    if LLM in ("random", "turn-based"):
+        return list(MODELS)
+    return [select_model()]
 
-    This function checks if the DRY_RUN flag is enabled and, if so, writes the raw and
-    sanitized output of the dependency-cruiser tool to a log file. It handles potential
-    encoding issues by safely converting lines to ASCII if necessary.
 
-    Args:
-        raw_output (List[str]): The raw output from the dependency-cruiser tool.
-        sanitized_output (List[str]): The processed and cleaned list of dependencies as
-            identified by the dependency-cruiser tool.
+_failed_aider_commands: List[List[str]] = []
 
-    Raises:
-        UnicodeEncodeError: Catches any Unicode encoding errors during log writing,
-            encoding problematic lines into ASCII-compatible representation as a fallback.
+
+def get_failed_aider_commands() -> List[List[str]]:
     """
-    if DRY_RUN:
-        log_file_path = os.path.join(os.path.dirname(__file__), "aider_all_dry_run.log")
-        with open(log_file_path, "a", encoding="utf-8") as log_file:
-            log_file.write("Raw dependency-cruiser output:\n")
-            for line in raw_output:
-                try:
-                    log_file.write(line + "\n")
-                except UnicodeEncodeError:
-                    log_file.write(
-                        line.encode("ascii", "replace").decode("ascii") + "\n"
-                    )
-            log_file.write("Sanitized dependency-cruiser output:\n")
-            for line in sanitized_output:
-                try:
-                    log_file.write(line + "\n")
-                except UnicodeEncodeError:
-                    log_file.write(
-                        line.encode("ascii", "replace").decode("ascii") + "\n"
-                    )
+    Returns the files of the aider commands that failed in this run.
+
+    Returns:
+        List[List[str]]: The files passed to each failed command.
+    """
+    return _failed_aider_commands
 
 
-def execute_aider_command(files: List[str], read_only_files: List[str], message: str):
+def execute_aider_command(
+    files: List[str],
+    read_only_files: List[str],
+    message: str,
+    model: Optional[str] = None,
+    dropped_dependencies: Optional[List[Tuple[str, str]]] = None,
+) -> bool:
     """
     Executes the aider command to process or modify files.
 
@@ -674,18 +5358,22 @@ def execute_aider_command(files: List[str], read_only_files: List[str], message:
         files (List[str]): List of file paths to be included in processing.
         read_only_files (List[str]): List of file paths to be read-only during processing.
         message (str): A formatted message to accompany the aider command execution.
+        model (Optional[str]): The model selected when the files were grouped. If not
+            given, the model is selected according to the LLM setting.
+        dropped_dependencies (Optional[List[Tuple[str, str]]]): Dependencies that
+            were left out of the read-only files, with the reason. Their number per
+            reason is logged, and in dry run mode each one is listed in the dry run log.
+
+    Returns:
+        bool: Whether the command succeeded, or was logged in dry run mode. Failed
+        commands are also recorded in the list returned by get_failed_aider_commands.
 
     Raises:
         Exception: Logs any unexpected errors encountered during aider command execution.
     """
-    global EDIT_FORMAT_TURN, MODEL_TURN
-    model = None
-    if LLM == "random":
-        model = random.choice(MODELS)
-    elif LLM == "turn-based":
-        model = MODELS[MODEL_TURN % len(MODELS)]
-        MODEL_TURN += 1
-    # For "default", we don't set a model, using aider's default
+    global EDIT_FORMAT_TURN
+    if model is None:
+        model = select_model()
 
     if EDIT_FORMAT == "random":
         edit_format = random.choice(["diff", "udiff"])
@@ -695,6 +5383,16 @@ def execute_aider_command(files: List[str], read_only_files: List[str], message:
     else:
         edit_format = EDIT_FORMAT
 
+    if dropped_dependencies:
+        reasons = {}
+        for _, reason in dropped_dependencies:
+            reason = reason.split(" (")[0]
+            reasons[reason] = reasons.get(reason, 0) + 1
+        logger.info(
+            f"Dropped {len(dropped_dependencies)} dependencies of {len(files)} files: "
+            + ", ".join(f"{count} {reason}" for reason, count in reasons.items())
+        )
+
     cmd = ["aider"]
     if model:
         cmd.extend(["--model", model])
@@ -716,38 +5414,47 @@ def execute_aider_command(files: List[str], read_only_files: List[str], message:
     )
 
     if DRY_RUN:
-        log_aider_command(cmd, model, edit_format, message, read_only_files, files)
-    else:
-        try:
-            logger.info(f"Executing aider command: {' '.join(cmd)}")
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-                universal_newlines=True,
-            )
-
-            while True:
-                output = process.stdout.readline()
-                if output == "" and process.poll() is not None:
-                    break
-                if output:
-                    logger.info(output.strip())
+        log_aider_command(
+            cmd,
+            model,
+            edit_format,
+            message,
+            read_only_files,
+            files,
+            dropped_dependencies,
+        )
+        return True
 
-            return_code = process.poll()
+    try:
+        logger.info(f"Executing aider command: {' '.join(cmd)}")
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            universal_newlines=True,
+        )
 
-            if return_code == 0:
-                logger.info("Aider command executed successfully")
-            else:
-                error_output = process.stderr.read()
-                logger.error(
-                    f"Error executing aider command. Return code: {return_code}"
-                )
-                logger.error(f"Error output: {error_output}")
-        except Exception as e:
-            logger.error(f"Unexpected error executing aider command: {e}")
+        while True:
+            output = process.stdout.readline()
+            if output == "" and process.poll() is not None:
+                break
+            if output:
+                logger.info(output.strip())
+
+        return_code = process.poll()
+
+        if return_code == 0:
+            logger.info("Aider command executed successfully")
+            return True
+        error_output = process.stderr.read()
+        logger.error(f"Error executing aider command. Return code: {return_code}")
+        logger.error(f"Error output: {error_output}")
+    except Exception as e:
+        logger.error(f"Unexpected error executing aider command: {e}")
+    _failed_aider_commands.append(list(files))
+    return False
 
 
 def log_aider_command(
@@ -757,6 +5464,7 @@ def log_aider_command(
     message: str,
     read_only_files: List[str],
     files: List[str],
+    dropped_dependencies: Optional[List[Tuple[str, str]]] = None,
 ):
     """
     Logs the details of the aider command execution to a log file.
@@ -773,6 +5481,8 @@ def log_aider_command(
         message (str): The message associated with the aider command execution.
         read_only_files (List[str]): List of files that are to be treated as read-only.
         files (List[str]): List of files that are to be processed.
+        dropped_dependencies (Optional[List[Tuple[str, str]]]): Dependencies that
+            were left out of the read-only files, with the reason.
 
     Raises:
         This function does not explicitly raise any exceptions
@@ -793,19 +5503,163 @@ def log_aider_command(
         log_file.write(f"Files to process ({len(files)}):\n")
         for file in files:
             log_file.write(f"  - {file}\n")
-        log_file.write(f"Token count (files): {calculate_token_count(files)}\n")
-        log_file.write(
-            f"Token count (read-only): {calculate_token_count(read_only_files)}\n"
-        )
-        total_tokens = calculate_token_count(files + read_only_files)
+        if dropped_dependencies:
+            log_file.write(f"Dropped dependencies ({len(dropped_dependencies)}):\n")
+            for file, reason in dropped_dependencies:
+                log_file.write(f"  - {file}: {reason}\n")
+        ledger = get_token_ledger()
+        file_tokens = ledger.total(files, model)
+        read_only_tokens = ledger.total(read_only_files, model)
+        total_tokens = file_tokens + read_only_tokens
+        log_file.write(f"Token count (files): {file_tokens}\n")
+        log_file.write(f"Token count (read-only): {read_only_tokens}\n")
         log_file.write(f"Total token count: {total_tokens}\n")
         log_file.write(f"Token limit: {TOKEN_LIMIT}\n")
         log_file.write(f"Remaining tokens: {TOKEN_LIMIT - total_tokens}\n")
         log_file.write("\n")
 
 
+def iter_file_groups(
+    files: Iterable[str],
+    token_limit: int,
+    select_group_model: Callable[[], Optional[str]] = select_model,
+    oversized_files: Optional[List[str]] = None,
+) -> Iterator[Tuple[List[str], Optional[str]]]:
+    """
+    Groups files as they arrive, sizing each group for the model that runs it.
+
+    The model of each group is selected when the group is started, and the files of
+    the group are counted with that model's tokenizer, so groups fit the context of the
+    model that actually processes them. Each group is yielded as soon as the next file
+    no longer fits into it. If TOKEN_COUNTING is "estimate", only files that bring
+    their group close to the limit are tokenized.
+
+    Parameters:
+        files (Iterable[str]): The file paths to be organized based on token count.
+        token_limit (int): The maximum number of tokens allowed per group of files.
+        select_group_model (Callable[[], Optional[str]]): Selects the model of the
+            next group. Defaults to select_model.
+        oversized_files (Optional[List[str]]): Receives the files that individually
+            exceed the token limit.
+
+    Yields:
+        Tuple[List[str], Optional[str]]: Each file group within the token limit, paired
+        with the model selected for the group.
+
+    Raises:
+        This function does not explicitly raise any exceptions but will log a warning
+        for any file that exceeds the token limit.
+    """
+    ledger = get_token_ledger()
+    if oversized_files is None:
+        oversized_files = []
+    current_group = []
+    current_tokens = 0
+    grouped = False
+    model = None
+    model_selected = False
+    estimating = TOKEN_COUNTING == "estimate"
+    lower_bound = token_limit * (1 - TOKEN_ESTIMATE_MARGIN)
+    upper_bound = token_limit * (1 + TOKEN_ESTIMATE_MARGIN)
+
+    def measure(file, model, group_tokens):
+        """
+        Returns the token count of a file that is added to a group of the given total.
+
+        In "estimate" mode, the file is only counted exactly if the group total with
+        the file lands within the error margin of the limit. Totals below the margin
+        certainly fit and totals above it certainly overflow, so their estimates are
+        used as they are. The files already in the group keep the counts they were
+        added with.
+        """
+        if not estimating:
+            return ledger.count(file, token_limit, model)
+        file_tokens = ledger.estimate(file, model)
+        if not lower_bound < group_tokens + file_tokens <= upper_bound:
+            return file_tokens
+        return ledger.count(file, token_limit, model)
+
+    for file in files:
+        if not model_selected:
+            model, model_selected = select_group_model(), True
+        file_tokens = measure(file, model, current_tokens)
+        if current_group and current_tokens + file_tokens > token_limit:
+            if file_tokens <= token_limit:
+                # Start a new group if adding this file would exceed the limit
+                yield current_group, model
+                grouped = True
+                current_group = []
+                current_tokens = 0
+                model = select_group_model()
+                file_tokens = measure(file, model, 0)
+
+        if file_tokens > token_limit:
+            # Handle files that individually exceed the token limit
+            logger.warning(
+                f"File {file} exceeds token limit ({file_tokens} > {token_limit}). It will be processed individually."
+            )
+            oversized_files.append(file)
+            if current_group:
+                yield current_group, model
+                grouped = True
+                current_group = []
+                current_tokens = 0
+                model_selected = False
+        else:
+            # Add the file to the current group
+            current_group.append(file)
+            current_tokens += file_tokens
+
+    if current_group:
+        yield current_group, model
+        grouped = True
+
+    # Handle the case where a single file exceeds the token limit
+    if not grouped and len(oversized_files) == 1:
+        yield [oversized_files.pop()], model
+
+
+def plan_file_groups(
+    files: List[str],
+    token_limit: int,
+    select_group_model: Callable[[], Optional[str]] = select_model,
+) -> Tuple[List[Tuple[List[str], Optional[str]]], List[str]]:
+    """
+    Split the input files into groups, sizing each group for the model that runs it.
+
+    Token counts for every candidate model are fetched up front in one batch per
+    tokenizer, unless TOKEN_COUNTING is "estimate", before the files are grouped by
+    iter_file_groups.
+
+    Parameters:
+        files (List[str]): A list of file paths to be organized based on token count.
+        token_limit (int): The maximum number of tokens allowed per group of files.
+        select_group_model (Callable[[], Optional[str]]): Selects the model of the
+            next group. Defaults to select_model.
+
+    Returns:
+        Tuple[List[Tuple[List[str], Optional[str]]], List[str]]: A tuple where the
+        first element is a list of file groups each within the token limit, paired
+        with the model selected for the group, and the second element is a list of
+        files that individually exceed the token limit.
+
+    See Also:
+        iter_file_groups: Generator grouping the files as they arrive.
+    """
+    ledger = get_token_ledger()
+    if select_group_model is select_model and TOKEN_COUNTING != "estimate":
+        for candidate in get_candidate_models():
+            ledger.prefetch(files, token_limit, candidate)
+
+    oversized_files = []
+    file_groups = list(
+        iter_file_groups(files, token_limit, select_group_model, oversized_files)
+    )
+    return file_groups, oversized_files
+
+
 def split_files_by_token_limit(
-    files: List[str], token_limit: int
+    files: List[str], token_limit: int, model: Optional[str] = None
 ) -> Tuple[List[List[str]], List[str]]:
     """
     Split the input files into groups based on the token limit.
@@ -817,6 +5671,8 @@ def split_files_by_token_limit(
     Parameters:
         files (List[str]): A list of file paths to be organized based on token count.
         token_limit (int): The maximum number of tokens allowed per group of files.
+        model (Optional[str]): The model whose tokenizer is used for counting, or None
+            for aider's default model.
 
     Returns:
         Tuple[List[List[str]], List[str]]: A tuple where the first element is a list
@@ -826,44 +5682,212 @@ def split_files_by_token_limit(
     Raises:
         This function does not explicitly raise any exceptions but will log a warning
         for any file that exceeds the token limit.
+
+    See Also:
+        plan_file_groups: Groups files for the model selected for each group.
+    """
+    if TOKEN_COUNTING != "estimate":
+        calculate_token_counts(files, token_limit, model)
+    file_groups, oversized_files = plan_file_groups(files, token_limit, lambda: model)
+    return [file_group for file_group, _ in file_groups], oversized_files
+
+
+def pack_sequentially(
+    clusters: List[List[str]], tokens: Dict[str, int], token_limit: int
+) -> List[List[str]]:
+    """
+    Packs clusters of files into groups in the given order.
+
+    Args:
+        clusters (List[List[str]]): The clusters, each within the token limit.
+        tokens (Dict[str, int]): The token count of each file.
+        token_limit (int): The maximum number of tokens allowed per group.
+
+    Returns:
+        List[List[str]]: The groups, each holding one or more whole clusters.
     """
-    file_groups = []
+    groups = []
     current_group = []
     current_tokens = 0
-    oversized_files = []
+    for cluster in clusters:
+        cluster_tokens = sum(tokens[file] for file in cluster)
+        if current_group and current_tokens + cluster_tokens > token_limit:
+            groups.append(current_group)
+            current_group = []
+            current_tokens = 0
+        current_group.extend(cluster)
+        current_tokens += cluster_tokens
+    if current_group:
+        groups.append(current_group)
+    return groups
+
+
+def count_cross_group_tokens(
+    groups: List[List[str]],
+    graph: DependencyGraph,
+    token_count: Callable[[str], int],
+) -> int:
+    """
+    Counts the read-only tokens the groups need for their direct dependencies.
+
+    A dependency that is not part of a group has to be added to it as read-only
+    context, so a dependency shared by several groups is counted once per group.
+
+    Args:
+        groups (List[List[str]]): The file groups.
+        graph (DependencyGraph): The dependency graph.
+        token_count (Callable[[str], int]): Returns the token count of a file.
+
+    Returns:
+        int: The total token count of the direct dependencies outside each group.
+    """
+    total = 0
+    for group in groups:
+        members = {os.path.abspath(file) for file in group}
+        outside = {
+            target
+            for module in members
+            for target in graph.file_targets(module)
+            if target not in members
+        }
+        total += sum(token_count(target) for target in outside)
+    return total
+
+
+def plan_clustered_file_groups(
+    files: List[str], token_limit: int
+) -> Tuple[List[Tuple[List[str], Optional[str]]], List[str]]:
+    """
+    Groups files by partitioning the dependency graph into token-bounded clusters.
+
+    Every file starts as its own cluster. The two clusters connected by the most
+    dependencies are merged repeatedly, as long as the merged cluster stays within the
+    token limit, which greedily minimizes the dependencies between clusters. The
+    clusters are then packed into groups in the order of their first file, so the
+    processing order is kept as far as possible. Files are counted with every
+    candidate model's tokenizer and the largest count is used, so each group fits the
+    model selected for it.
+
+    The read-only tokens of the direct dependencies outside each group are compared
+    with those of sequential packing and the difference is logged.
+
+    Parameters:
+        files (List[str]): The file paths to be grouped, in processing order.
+        token_limit (int): The maximum number of tokens allowed per group of files.
+
+    Returns:
+        Tuple[List[Tuple[List[str], Optional[str]]], List[str]]: A tuple where the
+        first element is a list of file groups each within the token limit, paired
+        with the model selected for the group, and the second element is a list of
+        files that individually exceed the token limit.
 
+    See Also:
+        plan_file_groups: Groups files sequentially.
+    """
+    ledger = get_token_ledger()
+    models = get_candidate_models()
+    for model in models:
+        ledger.prefetch(files, token_limit, model)
+
+    tokens = {}
+    oversized_files = []
     for file in files:
-        file_tokens = calculate_token_count([file])
+        file_tokens = max(ledger.count(file, token_limit, model) for model in models)
         if file_tokens > token_limit:
-            # Handle files that individually exceed the token limit
             logger.warning(
                 f"File {file} exceeds token limit ({file_tokens} > {token_limit}). It will be processed individually."
             )
             oversized_files.append(file)
-            if current_group:
-                file_groups.append(current_group)
-                current_group = []
-                current_tokens = 0
-        elif current_tokens + file_tokens > token_limit:
-            # Start a new group if adding this file would exceed the limit
-            if current_group:
-                file_groups.append(current_group)
-            current_group = [file]
-            current_tokens = file_tokens
         else:
-            # Add the file to the current group
-            current_group.append(file)
-            current_tokens += file_tokens
+            tokens[file] = file_tokens
+    grouped_files = list(tokens)
+    if not grouped_files:
+        return [], oversized_files
+
+    filtered_files = filter_files_for_dependency_cruiser(grouped_files)
+    graph = (
+        resolve_dependency_graph(filtered_files)
+        if filtered_files
+        else DependencyGraph()
+    )
+    position = {file: index for index, file in enumerate(grouped_files)}
+    by_path = {os.path.abspath(file): file for file in grouped_files}
+
+    # Cluster ids are the positions of their first file
+    members = {index: [file] for index, file in enumerate(grouped_files)}
+    cluster_tokens = {index: tokens[file] for index, file in enumerate(grouped_files)}
+    neighbors = {index: {} for index in members}
+    for file in filtered_files:
+        source = position[file]
+        for target in graph.file_targets(os.path.abspath(file)):
+            if target in by_path and by_path[target] != file:
+                target = position[by_path[target]]
+                neighbors[source][target] = neighbors[source].get(target, 0) + 1
+                neighbors[target][source] = neighbors[target].get(source, 0) + 1
+
+    heap = [
+        (-weight, cluster_tokens[a] + cluster_tokens[b], a, b)
+        for a in neighbors
+        for b, weight in neighbors[a].items()
+        if a < b
+    ]
+    heapq.heapify(heap)
+    while heap:
+        weight, combined_tokens, a, b = heapq.heappop(heap)
+        if a not in members or b not in members:
+            continue
+        if neighbors[a].get(b) != -weight:
+            continue
+        if combined_tokens != cluster_tokens[a] + cluster_tokens[b]:
+            continue
+        if combined_tokens > token_limit:
+            continue
+        # Merge the later cluster into the earlier one
+        a, b = min(a, b), max(a, b)
+        members[a].extend(members.pop(b))
+        cluster_tokens[a] += cluster_tokens.pop(b)
+        for neighbor, edge_weight in neighbors.pop(b).items():
+            del neighbors[neighbor][b]
+            if neighbor != a:
+                neighbors[a][neighbor] = neighbors[a].get(neighbor, 0) + edge_weight
+                neighbors[neighbor][a] = neighbors[a][neighbor]
+        for neighbor, edge_weight in neighbors[a].items():
+            heapq.heappush(
+                heap,
+                (
+                    -edge_weight,
+                    cluster_tokens[a] + cluster_tokens[neighbor],
+                    min(a, neighbor),
+                    max(a, neighbor),
+                ),
+            )
 
-    if current_group:
-        file_groups.append(current_group)
+    clusters = [
+        sorted(members[index], key=position.__getitem__) for index in sorted(members)
+    ]
+    groups = pack_sequentially(clusters, tokens, token_limit)
+    sequential_groups = pack_sequentially(
+        [[file] for file in grouped_files], tokens, token_limit
+    )
 
-    # Handle the case where a single file exceeds the token limit
-    if not file_groups and len(oversized_files) == 1:
-        file_groups.append(oversized_files)
-        oversized_files = []
+    def token_count(file):
+        return max(ledger.count(file, model=model) for model in models)
 
-    return file_groups, oversized_files
+    clustered_tokens = count_cross_group_tokens(groups, graph, token_count)
+    sequential_tokens = count_cross_group_tokens(sequential_groups, graph, token_count)
+    summary = (
+        f"Clustered {len(grouped_files)} files into {len(groups)} groups "
+        f"({len(sequential_groups)} when packed sequentially), needing "
+        f"{clustered_tokens} read-only dependency tokens instead of "
+        f"{sequential_tokens}, saving {sequential_tokens - clustered_tokens}"
+    )
+    logger.info(summary)
+    if DRY_RUN:
+        log_file_path = os.path.join(os.path.dirname(__file__), "aider_all_dry_run.log")
+        with open(log_file_path, "a", encoding="utf-8") as log_file:
+            log_file.write(summary + "\n")
+
+    return [(group, select_model()) for group in groups], oversized_files
 
 
 def process_files(files_to_process: List[str], read_only_files: List[str]):
@@ -946,12 +5970,12 @@ def process_standard(files_to_process: List[str], read_only_files: List[str]):
     Raises:
         This function might propagate exceptions from the execute_aider_command function.
     """
-    file_groups, oversized_files = split_files_by_token_limit(
-        files_to_process, TOKEN_LIMIT
-    )
+    file_groups, oversized_files = plan_file_groups(files_to_process, TOKEN_LIMIT)
 
-    for file_group in file_groups:
-        execute_aider_command(file_group, read_only_files, random.choice(MESSAGES))
+    for file_group, model in file_groups:
+        execute_aider_command(
+            file_group, read_only_files, random.choice(MESSAGES), model
+        )
 
     for file in oversized_files:
         logger.warning(f"Processing oversized file: {file}")
@@ -965,8 +5989,8 @@ def process_basic_dependency_cruiser(
     Processes each file individually with dependency consideration.
 
     This function uses the dependency-cruiser to find dependencies for each file
-    in the files_to_process list. It includes these dependencies as part of the
-    read-only context during processing. The processed files are executed using
+    in the files_to_process list. It includes the dependencies that fit into
+    READ_ONLY_TOKEN_LIMIT as part of the read-only context during processing. The processed files are executed using
     the aider command, with a randomly selected message from a predefined list.
 
     Parameters:
@@ -974,15 +5998,20 @@ def process_basic_dependency_cruiser(
         read_only_files (List[str]): A list of file paths intended to remain read-only
         during processing but to be included for context.
 
+    Note:
+        Files are processed in the order set in PROCESSING_ORDER.
+
     Raises:
         The function relies on execute_aider_command, which may raise exceptions
         related to command execution errors. These are not handled within this
         function, so will propagate to the caller.
     """
-    for file in files_to_process:
-        dependencies = get_dependencies([file])
-        all_read_only = list(set(read_only_files + dependencies))
-        execute_aider_command([file], all_read_only, random.choice(MESSAGES))
+    for file in order_files_by_dependencies(files_to_process):
+        dependencies = select_dependencies([file])
+        all_read_only = list(set(read_only_files + dependencies.files))
+        execute_aider_command(
+            [file], all_read_only, random.choice(MESSAGES), None, dependencies.dropped
+        )
 
 
 def process_standard_dependency_cruiser(
@@ -993,8 +6022,9 @@ def process_standard_dependency_cruiser(
 
     This function collects files into groups where each group's total
     token count is within the defined token limit. It finds dependencies
-    for each group of files using the dependency-cruiser tool. It processes
-    each group, including dependencies and read-only files as context during
+    for each group of files using the dependency-cruiser tool and selects
+    those that fit into READ_ONLY_TOKEN_LIMIT. It processes each group,
+    including these dependencies and read-only files as context during
     execution, using the aider command.
 
     Parameters:
@@ -1004,25 +6034,238 @@ def process_standard_dependency_cruiser(
         read_only_files (List[str]): A list of file paths that should
         remain read-only during processing.
 
+    Note:
+        Files are grouped in the order set in PROCESSING_ORDER, and clustered by
+        their dependencies if GROUPING_STRATEGY is "clustered".
+
     Raises:
-        This function may propagate exceptions from the get_dependencies
+        This function may propagate exceptions from the select_dependencies
         or execute_aider_command functions if any errors occur during
         dependency extraction or command execution.
     """
-    file_groups, oversized_files = split_files_by_token_limit(
-        files_to_process, TOKEN_LIMIT
-    )
+    files_to_process = order_files_by_dependencies(files_to_process)
+    if GROUPING_STRATEGY == "clustered":
+        file_groups, oversized_files = plan_clustered_file_groups(
+            files_to_process, TOKEN_LIMIT
+        )
+    else:
+        file_groups, oversized_files = plan_file_groups(files_to_process, TOKEN_LIMIT)
+
+    for file_group, model in file_groups:
+        dependencies = select_dependencies(file_group, model)
+        all_read_only = list(set(read_only_files + dependencies.files))
+        execute_aider_command(
+            file_group,
+            all_read_only,
+            random.choice(MESSAGES),
+            model,
+            dependencies.dropped,
+        )
+
+    for file in oversized_files:
+        logger.warning(f"Processing oversized file: {file}")
+        dependencies = select_dependencies([file])
+        all_read_only = list(set(read_only_files + dependencies.files))
+        execute_aider_command(
+            [file], all_read_only, random.choice(MESSAGES), None, dependencies.dropped
+        )
+
+
+def run_in_background(items: Iterable, name: str) -> Iterator:
+    """
+    Iterates over items in a background thread, buffering them in a bounded queue.
+
+    This is a stage of the streaming pipeline: the returned iterator yields the same
+    items in the same order, while the background thread works up to
+    PIPELINE_QUEUE_SIZE items ahead. Exceptions raised while producing the items are
+    re-raised by the returned iterator. If the returned iterator is closed early, the
+    background thread stops producing.
+
+    Args:
+        items (Iterable): The items to produce, typically a generator of an earlier
+            stage.
+        name (str): Name of the background thread, used in log messages.
+
+    Returns:
+        Iterator: An iterator over the produced items.
+    """
+    buffer = queue.Queue(maxsize=max(1, PIPELINE_QUEUE_SIZE))
+    stopped = threading.Event()
+
+    def put(entry) -> bool:
+        while not stopped.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((True, item)):
+                    return
+        except Exception as e:
+            put((False, e))
+        else:
+            put((False, None))
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+
+    def consume():
+        try:
+            while True:
+                has_item, value = buffer.get()
+                if not has_item:
+                    if value is not None:
+                        raise value
+                    return
+                yield value
+        finally:
+            stopped.set()
+
+    return consume()
+
+
+def iter_prefetched_files(files: Iterable[str], token_limit: int) -> Iterator[str]:
+    """
+    Tokenizes files in batches for every candidate model and passes them on.
+
+    Args:
+        files (Iterable[str]): The files to tokenize.
+        token_limit (int): The token limit of the groups, used as the ceiling.
+
+    Yields:
+        str: Each file, once its token counts are in the ledger.
+    """
+    ledger = get_token_ledger()
+    candidates = get_candidate_models()
+    batch = []
+    for file in files:
+        batch.append(file)
+        if len(batch) >= PIPELINE_BATCH_SIZE:
+            for candidate in candidates:
+                ledger.prefetch(batch, token_limit, candidate)
+            yield from batch
+            batch = []
+    for candidate in candidates:
+        ledger.prefetch(batch, token_limit, candidate)
+    yield from batch
+
+
+def run_pipeline(read_only_files: List[str]) -> List[str]:
+    """
+    Processes the project with the streaming pipeline.
+
+    Discovering files, counting their tokens, grouping them according to SCAN_LOGIC and
+    resolving their dependencies run as background stages connected by bounded queues,
+    while the aider commands are executed in the calling thread in the same order as
+    process_files would execute them. Files that individually exceed the token limit
+    are processed after all groups, as in process_files.
+
+    Args:
+        read_only_files (List[str]): A list of file paths intended to provide
+            read-only context during processing.
+
+    Returns:
+        List[str]: The files that were found for processing.
+
+    See Also:
+        process_files: Processes an already collected list of files.
+    """
+    if SCAN_LOGIC not in (
+        "basic",
+        "standard",
+        "basic_dependency-cruiser",
+        "standard_dependency-cruiser",
+    ):
+        logger.error(f"Invalid SCAN_LOGIC: {SCAN_LOGIC}")
+        return []
+
+    found_files = []
+    use_dependencies = SCAN_LOGIC.endswith("_dependency-cruiser")
+
+    def discover():
+        files = iter_files_to_process()
+        if use_dependencies:
+            # The dependency graph covers all files found by the scan
+            files = list(files)
+            get_dependency_graph(files)
+        if CHANGED_SINCE:
+            files = iter_changed_files(files)
+        if use_dependencies:
+            files = order_files_by_dependencies(list(files))
+        for file in files:
+            found_files.append(file)
+            yield file
+
+    files = run_in_background(discover(), "discover")
+    oversized_files = []
+    if SCAN_LOGIC.startswith("basic"):
+        file_groups = (([file], None) for file in files)
+    elif use_dependencies and GROUPING_STRATEGY == "clustered":
+
+        def cluster(files):
+            file_groups, oversized = plan_clustered_file_groups(
+                list(files), TOKEN_LIMIT
+            )
+            oversized_files.extend(oversized)
+            yield from file_groups
+
+        file_groups = run_in_background(cluster(files), "group")
+    else:
+        if TOKEN_COUNTING != "estimate":
+            files = run_in_background(
+                iter_prefetched_files(files, TOKEN_LIMIT), "tokenize"
+            )
+        file_groups = run_in_background(
+            iter_file_groups(files, TOKEN_LIMIT, oversized_files=oversized_files),
+            "group",
+        )
+
+    if use_dependencies:
+
+        def select_group_dependencies(file_group, model):
+            dependencies = select_dependencies(file_group, model)
+            all_read_only = list(set(read_only_files + dependencies.files))
+            return file_group, model, all_read_only, dependencies.dropped
+
+        file_groups = run_in_background(
+            (
+                select_group_dependencies(file_group, model)
+                for file_group, model in file_groups
+            ),
+            "dependencies",
+        )
+    else:
+        file_groups = (
+            (file_group, model, read_only_files, None)
+            for file_group, model in file_groups
+        )
 
-    for file_group in file_groups:
-        dependencies = get_dependencies(file_group)
-        all_read_only = list(set(read_only_files + dependencies))
-        execute_aider_command(file_group, all_read_only, random.choice(MESSAGES))
+    for file_group, model, all_read_only, dropped in file_groups:
+        execute_aider_command(
+            file_group, all_read_only, random.choice(MESSAGES), model, dropped
+        )
 
     for file in oversized_files:
         logger.warning(f"Processing oversized file: {file}")
-        dependencies = get_dependencies([file])
-        all_read_only = list(set(read_only_files + dependencies))
-        execute_aider_command([file], all_read_only, random.choice(MESSAGES))
+        all_read_only = read_only_files
+        dropped = None
+        if use_dependencies:
+            dependencies = select_dependencies([file])
+            all_read_only = list(set(read_only_files + dependencies.files))
+            dropped = dependencies.dropped
+        execute_aider_command(
+            [file], all_read_only, random.choice(MESSAGES), None, dropped
+        )
+
+    logger.info(
+        f"Processed {len(found_files)} files with {len(read_only_files)} read-only files"
+    )
+    return found_files
 
 
 def main():
@@ -1044,6 +6287,9 @@ def main():
         along with the full exception details.
     """
     try:
+        initialize_token_ledger()
+        _failed_aider_commands.clear()
+        start_commit = get_head_commit() if not DRY_RUN else None
         log_file_path = os.path.join(os.path.dirname(__file__), "aider_all_dry_run.log")
         log_content = []
 
@@ -1055,16 +6301,37 @@ def main():
                     f"Scan Start: {SCAN_START}\n",
                     f"Scan Depth: {SCAN_DEPTH}\n",
                     f"Scan Logic: {SCAN_LOGIC}\n",
+                    f"Changed Since: {CHANGED_SINCE}\n",
+                    f"Processing Order: {PROCESSING_ORDER}\n",
                     f"LLM: {LLM}\n",
                     f"Edit Format: {EDIT_FORMAT}\n",
                     f"Token Limit: {TOKEN_LIMIT}\n\n",
                 ]
             )
+            # Start a fresh log; commands and the summary are appended to it
+            with open(log_file_path, "w", encoding="utf-8") as log_file:
+                log_file.writelines(log_content)
+            log_content = []
 
-        files_to_process = get_files_to_process()
         read_only_files = MANUALLY_ADDED_FILES.copy()
-
-        process_files(files_to_process, read_only_files)
+        if PIPELINE:
+            files_to_process = run_pipeline(read_only_files)
+        else:
+            files_to_process = get_files_to_process()
+            if SCAN_LOGIC.endswith("_dependency-cruiser"):
+                get_dependency_graph(files_to_process)
+            if CHANGED_SINCE:
+                files_to_process = filter_changed_files(files_to_process)
+            process_files(files_to_process, read_only_files)
+        if not DRY_RUN:
+            failed_commands = get_failed_aider_commands()
+            if failed_commands:
+                logger.warning(
+                    f"{len(failed_commands)} aider commands failed, not recording "
+                    'this run for CHANGED_SINCE = "last-run"'
+                )
+            else:
+                record_successful_run(start_commit)
 
         if DRY_RUN:
             log_content.extend(
@@ -1082,11 +6349,14 @@ def main():
                 count = sum(1 for f in files_to_process if f.endswith(ext))
                 log_content.append(f"  {ext}: {count}\n")
 
-            with open(log_file_path, "w", encoding="utf-8") as log_file:
+            with open(log_file_path, "a", encoding="utf-8") as log_file:
                 log_file.writelines(log_content)
     except Exception as e:
         logger.error(f"An unexpected error occurred: {str(e)}")
         logger.exception("Exception details:")
+    finally:
+        save_token_cache()
+        save_dependency_graph_cache()
 
 
 if __name__ == "__main__":
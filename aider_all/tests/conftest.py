@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import aider_all  # noqa: E402
+
+
+class StubEncoding:
+    """Counts whitespace-separated words, so no BPE file has to be loaded."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def encode_ordinary(self, text):
+        return text.split()
+
+
+@pytest.fixture
+def stub_encoding():
+    return StubEncoding("stub")
+
+
+@pytest.fixture
+def token_state(monkeypatch):
+    """Starts a run with an in-memory token cache, a fresh ledger and stub encoders."""
+    monkeypatch.setattr(aider_all, "TOKEN_CACHE_FILE", None)
+    monkeypatch.setattr(aider_all, "_token_cache", None)
+    monkeypatch.setattr(aider_all, "get_encoder", StubEncoding)
+    aider_all.initialize_token_ledger()
+    yield
+    aider_all.initialize_token_ledger()
@@ -0,0 +1,156 @@
+import os
+
+import pytest
+
+import aider_all
+from aider_all import DependencyEdge, DependencyGraph, DependencyGraphCache
+
+
+def module(name):
+    return os.path.abspath(os.path.join(os.sep, "project", name + ".js"))
+
+
+APP, A, B, D, S, C1, C2, C3 = map(module, ["app", "a", "b", "d", "s", "c1", "c2", "c3"])
+PACKAGE = os.path.abspath(os.path.join(os.sep, "project", "node_modules", "x.js"))
+
+
+@pytest.fixture
+def graph():
+    """
+    A diamond app -> a, b -> d, a cycle c1 -> c2 -> c3 -> c1 below app, a module s
+    importing itself, a core module and an npm package.
+    """
+    graph = DependencyGraph()
+    edges = [
+        (APP, A),
+        (APP, B),
+        (APP, C1),
+        (APP, S),
+        (A, D),
+        (B, D),
+        (C1, C2),
+        (C2, C3),
+        (C3, C1),
+        (C3, D),
+        (S, S),
+    ]
+    for source in [APP, A, B, D, S, C1, C2, C3]:
+        graph.add_module(source)
+    for source, target in edges:
+        graph.add_edge(DependencyEdge(source, target, os.path.basename(target)))
+    graph.add_edge(DependencyEdge(D, "fs", "fs", core=True))
+    graph.add_edge(DependencyEdge(APP, PACKAGE, "x", npm=True))
+    return graph
+
+
+def test_strongly_connected_components(graph):
+    components = graph.strongly_connected_components()
+    number = {
+        member: index
+        for index, component in enumerate(components)
+        for member in component
+    }
+
+    assert sorted([C1, C2, C3]) in components
+    assert [S] in components
+    assert [D] in components
+    for source in graph.adjacency:
+        for target in graph.file_targets(source):
+            if number[source] != number[target]:
+                assert number[target] < number[source]
+
+
+def test_strongly_connected_components_of_a_long_chain():
+    graph = DependencyGraph()
+    chain = [module(f"m{index}") for index in range(5000)]
+    for source, target in zip(chain, chain[1:]):
+        graph.add_edge(DependencyEdge(source, target, target))
+
+    components = graph.strongly_connected_components()
+
+    assert components == [[member] for member in reversed(chain)]
+
+
+def test_topological_levels_leaves_first(graph):
+    levels = graph.topological_levels()
+
+    assert levels[D] == 0
+    assert levels[S] == 0
+    assert levels[A] == levels[B] == 1
+    assert levels[C1] == levels[C2] == levels[C3] == 1
+    assert levels[APP] == 2
+
+
+def test_topological_levels_roots_first(graph):
+    levels = graph.topological_levels(roots_first=True)
+
+    assert levels[APP] == 0
+    assert levels[A] == levels[B] == levels[S] == 1
+    assert levels[C1] == levels[C2] == levels[C3] == 1
+    assert levels[D] == 2
+
+
+def test_dependency_distances(graph):
+    distances = graph.dependency_distances([APP])
+
+    assert distances == {A: 1, B: 1, C1: 1, S: 1, D: 2, C2: 2, C3: 3}
+
+
+def test_leaves_first_processing_order(graph, monkeypatch):
+    monkeypatch.setattr(aider_all, "PROCESSING_ORDER", "leaves-first")
+    monkeypatch.setattr(aider_all, "resolve_dependency_graph", lambda files: graph)
+    files = [APP, C1, A, D, S, B]
+
+    ordered = aider_all.order_files_by_dependencies(files)
+
+    assert ordered == [D, S, C1, A, B, APP]
+
+
+def write_modules(tmp_path, contents):
+    paths = {}
+    for name, content in contents.items():
+        path = tmp_path / f"{name}.js"
+        path.write_text(content, encoding="utf-8")
+        paths[name] = str(path)
+    return paths
+
+
+def build_graph(paths, imports):
+    graph = DependencyGraph()
+    for path in paths.values():
+        graph.add_module(path)
+    for source, target in imports:
+        graph.add_edge(DependencyEdge(paths[source], paths[target], f"./{target}"))
+    return graph
+
+
+def test_cache_invalidates_edges_of_changed_files(tmp_path):
+    paths = write_modules(tmp_path, {"a": "import './b'", "b": "", "c": "import './b'"})
+    cache = DependencyGraphCache()
+    cache.update(build_graph(paths, [("a", "b"), ("c", "b")]))
+
+    with open(paths["a"], "w", encoding="utf-8") as f:
+        f.write("// no imports any more")
+    graph = DependencyGraph()
+    stale = cache.restore(graph, list(paths.values()))
+
+    assert stale == [paths["a"]]
+    assert paths["a"] not in graph
+    assert graph.file_targets(paths["a"]) == []
+    assert graph.file_targets(paths["c"]) == [paths["b"]]
+    assert graph.dependents([paths["b"]]) == {paths["c"]}
+
+
+def test_cache_invalidates_importers_of_deleted_files(tmp_path):
+    paths = write_modules(tmp_path, {"a": "import './b'", "b": "", "c": "import './a'"})
+    cache = DependencyGraphCache()
+    cache.update(build_graph(paths, [("a", "b"), ("c", "a")]))
+
+    os.remove(paths["b"])
+    del paths["b"]
+    graph = DependencyGraph()
+    stale = cache.restore(graph, list(paths.values()))
+
+    assert stale == [paths["a"]]
+    assert cache.evicted == 1
+    assert graph.file_targets(paths["c"]) == [paths["a"]]
@@ -0,0 +1,29 @@
+import aider_all
+
+
+def test_estimate_mode_counts_only_files_near_the_limit(
+    tmp_path, monkeypatch, token_state
+):
+    files = []
+    for index in range(200):
+        path = tmp_path / f"file{index}.txt"
+        path.write_text("word " * 80, encoding="utf-8")
+        files.append(str(path))
+    counted = []
+    count_files_tokens = aider_all.count_files_tokens
+
+    def counting(files, enc, ceiling=None):
+        counted.extend(files)
+        return count_files_tokens(files, enc, ceiling)
+
+    monkeypatch.setattr(aider_all, "count_files_tokens", counting)
+    monkeypatch.setattr(aider_all, "TOKEN_COUNTING", "estimate")
+
+    groups, oversized = aider_all.plan_file_groups(
+        files, 4096, select_group_model=lambda: None
+    )
+
+    assert [file for group, _ in groups for file in group] == files
+    assert oversized == []
+    assert all(len(group) > 1 for group, _ in groups)
+    assert len(counted) < len(files)
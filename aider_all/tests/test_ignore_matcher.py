@@ -0,0 +1,111 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import aider_all
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="needs git")
+
+IGNORE_FILES = {
+    "": [
+        "# comment",
+        "*.log",
+        "!keep.log",
+        "/build",
+        "docs/**/*.tmp",
+        "**/cache/",
+        "out/",
+        "logs/**",
+        "!logs/important/",
+        "!logs/important/**",
+        "sub/anchored.txt",
+        "\\#hash",
+        "[ab].cfg",
+        "trailing.md   ",
+        "src/**/gen/",
+    ],
+    "sub/": ["*.txt", "!local.txt", "/only-here"],
+}
+
+PATHS = [
+    "a.log",
+    "keep.log",
+    "dir/b.log",
+    "dir/keep.log",
+    "build/x.js",
+    "src/build/x.js",
+    "docs/a.tmp",
+    "docs/x/y/a.tmp",
+    "other/a.tmp",
+    "cache/x.js",
+    "src/cache/x.js",
+    "lib/cache",
+    "out/x.js",
+    "src/out/y.js",
+    "logs/a.js",
+    "logs/deep/a.js",
+    "logs/important/b.js",
+    "logs/important/deep/c.js",
+    "sub/anchored.txt",
+    "sub/x.txt",
+    "sub/local.txt",
+    "sub/deeper/local2.txt",
+    "sub/deeper/local.txt",
+    "sub/only-here",
+    "sub/deeper/only-here",
+    "#hash",
+    "a.cfg",
+    "c.cfg",
+    "trailing.md",
+    "src/main.js",
+    "src/gen/x.js",
+    "src/a/b/gen/y.js",
+    "gen/z.js",
+]
+
+
+@pytest.fixture(scope="module")
+def project(tmp_path_factory):
+    root = tmp_path_factory.mktemp("project")
+    subprocess.run(["git", "init", "-q", str(root)], check=True)
+    for base, lines in IGNORE_FILES.items():
+        ignore_file = root / base / ".gitignore"
+        ignore_file.parent.mkdir(parents=True, exist_ok=True)
+        ignore_file.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    for path in PATHS:
+        file = root / path
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text("", encoding="utf-8")
+
+    matcher = aider_all.IgnoreMatcher()
+    for base in IGNORE_FILES:
+        matcher.add_ignore_file(str(root / base / ".gitignore"), base)
+    return root, matcher
+
+
+def git_ignores(root, path):
+    result = subprocess.run(["git", "check-ignore", "-q", "--no-index", path], cwd=root)
+    assert result.returncode in (0, 1)
+    return result.returncode == 0
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_matches_git_check_ignore(project, path):
+    root, matcher = project
+
+    ignored = matcher.is_ignored_file(path.replace("/", os.sep))
+
+    assert ignored == git_ignores(root, path)
+
+
+@pytest.mark.parametrize(
+    "path", ["build", "cache", "src/cache", "out", "logs/deep", "logs/important"]
+)
+def test_directories_match_git_check_ignore(project, path):
+    root, matcher = project
+
+    ignored = matcher.is_ignored(path.replace("/", os.sep), is_directory=True)
+
+    assert ignored == git_ignores(root, path + "/")
@@ -0,0 +1,54 @@
+import sys
+
+import pytest
+
+import aider_all
+
+
+@pytest.mark.parametrize(
+    "source",
+    ["x = " + "-" * 100000 + "1", "x = " + "1+" * 200000 + "1", "def f(:\n"],
+    ids=["too-deep", "too-long", "invalid"],
+)
+def test_unparsable_files_have_no_imports(tmp_path, source):
+    path = tmp_path / "module.py"
+    path.write_text("import os\n" + source, encoding="utf-8")
+
+    digest, imports = aider_all.extract_python_imports(str(path))
+
+    assert digest == aider_all.hash_blob(path.read_bytes())
+    assert imports == []
+
+
+def test_imports_are_listed_in_source_order(tmp_path):
+    path = tmp_path / "module.py"
+    path.write_text(
+        "import os.path\nfrom . import helpers\n"
+        "def f():\n    from ..pkg.mod import a, b as c\n",
+        encoding="utf-8",
+    )
+
+    _, imports = aider_all.extract_python_imports(str(path))
+
+    assert imports == [
+        ("os.path", 0, []),
+        ("", 1, ["helpers"]),
+        ("pkg.mod", 2, ["a", "b"]),
+    ]
+
+
+@pytest.mark.parametrize("listed", [True, False])
+def test_standard_library_modules_are_recognized(monkeypatch, listed):
+    is_stdlib = aider_all.ModuleResolver.is_python_stdlib_module
+    if not listed:
+        # Python versions before 3.10 do not list the standard library modules
+        monkeypatch.delattr(sys, "stdlib_module_names", raising=False)
+    is_stdlib.cache_clear()
+    try:
+        assert is_stdlib("json")
+        assert is_stdlib("sys")
+        assert not is_stdlib("pytest")
+        assert not is_stdlib("aider_all")
+        assert not is_stdlib("no_such_module")
+    finally:
+        is_stdlib.cache_clear()
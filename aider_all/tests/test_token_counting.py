@@ -0,0 +1,114 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import aider_all  # noqa: E402
+
+SOURCE = "".join(
+    [
+        "function f(a, b) {\n",
+        "  return a + b;\n",
+        "}\n",
+        "/* block comment */\n",
+        "const x = f(1, 2);\n",
+        "// line comment\n",
+        "if (x) {\n  y = z; \n}\n",
+        "url = 'a/b/c';\n///\n",
+    ]
+    * 400
+)
+
+
+ENCODING_NAMES = sorted(
+    {encoding_name for encoding_name, _ in aider_all.TOKENIZERS.values()}
+)
+
+
+def build_offline_encoding(monkeypatch, encoding_name):
+    """
+    Builds an encoding with the real pre-tokenization pattern but a small vocabulary.
+
+    Every pre-token of SOURCE is a single token of the vocabulary, other text falls
+    back to smaller pieces, so a split that changes pre-tokenization changes the count.
+    No BPE file has to be downloaded.
+    """
+    tiktoken = pytest.importorskip("tiktoken")
+    regex = pytest.importorskip("regex")
+    openai_public = pytest.importorskip("tiktoken_ext.openai_public")
+
+    byte_ranks = {bytes([i]): i for i in range(256)}
+    monkeypatch.setattr(
+        openai_public, "load_tiktoken_bpe", lambda *args, **kwargs: byte_ranks
+    )
+    pattern = openai_public.ENCODING_CONSTRUCTORS[encoding_name]()["pat_str"]
+    ranks = dict(byte_ranks)
+    for piece in regex.findall(pattern, SOURCE):
+        data = piece.encode("utf-8")
+        for end in range(2, len(data) + 1):
+            ranks.setdefault(data[:end], len(ranks))
+    return tiktoken.Encoding(
+        encoding_name, pat_str=pattern, mergeable_ranks=ranks, special_tokens={}
+    )
+
+
+@pytest.mark.parametrize("encoding_name", ENCODING_NAMES)
+@pytest.mark.parametrize("max_chunk", [4096, 5000, 8191])
+def test_streamed_count_matches_whole_file_offline(
+    tmp_path, monkeypatch, encoding_name, max_chunk
+):
+    enc = build_offline_encoding(monkeypatch, encoding_name)
+    path = tmp_path / "source.js"
+    path.write_text(SOURCE, encoding="utf-8")
+
+    tokens, complete, _ = aider_all.count_tokens_streaming(
+        str(path), enc, max_chunk=max_chunk
+    )
+
+    assert complete
+    assert tokens == len(enc.encode_ordinary(SOURCE.strip()))
+
+
+@pytest.mark.parametrize("encoding_name", ENCODING_NAMES)
+@pytest.mark.parametrize("max_chunk", [4096, 5000, 8191])
+def test_streamed_count_matches_whole_file(tmp_path, encoding_name, max_chunk):
+    enc = aider_all.get_encoder(encoding_name)
+    if enc is None:
+        pytest.skip(f"{encoding_name} is not available")
+    path = tmp_path / "source.js"
+    path.write_text(SOURCE, encoding="utf-8")
+
+    tokens, complete, _ = aider_all.count_tokens_streaming(
+        str(path), enc, max_chunk=max_chunk
+    )
+
+    assert complete
+    assert tokens == len(enc.encode_ordinary(SOURCE.strip()))
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["a;\n//b", "a}\n/*b", "a;\n b", "a; b", "a;\n\nb"],
+)
+def test_boundary_does_not_split_after_punctuation(text):
+    cut = aider_all.find_token_boundary(text)
+    assert text[:cut] in ("", "a;\n\n")
+
+
+def test_boundary_splits_before_letters_and_after_words():
+    assert aider_all.find_token_boundary("a;\nb = c") == len("a;\n")
+    assert aider_all.find_token_boundary("a; bc d;") == len("a; bc")
+
+
+def test_approximate_split_is_reported_incomplete(tmp_path, stub_encoding):
+    path = tmp_path / "minified.js"
+    path.write_text(";" * 40000, encoding="utf-8")
+
+    tokens, complete, _ = aider_all.count_tokens_streaming(
+        str(path), stub_encoding, max_chunk=4096
+    )
+
+    assert tokens > 0
+    assert not complete